@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Compare chart_log's executemany insert path with LOAD DATA LOCAL INFILE.
+
+Both writers load the same synthetic rows into their own scratch table
+(created like a real snapshot table and dropped afterwards), committing
+once per chart the way chart_log does. Each writer runs twice: with
+secondary indexes maintained during the load (plus the per-chart DELETE),
+and with them deferred to one ALTER TABLE at the end, timed separately.
+
+    python bench_chart_insert.py --charts 400 --chart-size 200 --bad-rows 5
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+from chart_db import (
+    batch_insert_podcasts,
+    build_insert_sql,
+    build_secondary_indexes,
+    connect_db,
+    create_new_table,
+    load_data_rows,
+)
+
+REGIONS = ("us", "gb", "de", "fr", "jp", "br", "in", "au")
+
+
+def synthetic_charts(charts, chart_size, bad_rows):
+    """Rows shaped like build_chart_rows output, grouped per chart"""
+    now = datetime.datetime.now().replace(microsecond=0)
+    out = []
+    for c in range(charts):
+        region = random.choice(REGIONS)
+        rows = []
+        for rank in range(1, chart_size + 1):
+            aid = random.randint(10**8, 2 * 10**9)
+            rows.append(
+                (
+                    rank,
+                    f"https://podcasts.apple.com/{region}/podcast/id{aid}",
+                    aid,
+                    f"Podcast {aid}\twith tab",
+                    f"https://is1-ssl.mzstatic.com/image/{aid}/600x600bb.jpg",
+                    region,
+                    region.upper(),
+                    "Podcasts",
+                    f"Genre {c}",
+                    None,
+                    "NEW",
+                    now,
+                    now,
+                )
+            )
+        out.append(rows)
+
+    # Non-integer ranks: strict executemany rejects the batch, LOAD DATA warns
+    for _ in range(bad_rows):
+        rows = random.choice(out)
+        i = random.randrange(len(rows))
+        rows[i] = ("bad",) + rows[i][1:]
+    return out
+
+
+def run(db, cursor, table, charts, method, deferred):
+    failed = []
+    insert_sql = build_insert_sql(table)
+    inserted = 0
+    start = time.perf_counter()
+    for rows in charts:
+        if not deferred:
+            # write_chart's replace step, which needs idx_chart_key
+            cursor.execute(
+                f"DELETE FROM {table} "
+                f"WHERE countryCode = %s AND category = %s AND subcategory_key = %s",
+                (rows[0][5], rows[0][7], rows[0][8] or ""),
+            )
+        if method == "load_data":
+            loaded = load_data_rows(cursor, table, rows)
+            if loaded is None:
+                # The load warned and was rolled back: chart_log's executemany fallback
+                loaded = batch_insert_podcasts(cursor, insert_sql, rows, failed)
+            inserted += loaded
+        else:
+            inserted += batch_insert_podcasts(cursor, insert_sql, rows, failed)
+        db.commit()
+    load_time = time.perf_counter() - start
+    index_time = build_secondary_indexes(cursor, table) if deferred else 0.0
+    return inserted, load_time, index_time, len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--charts", type=int, default=400)
+    parser.add_argument("--chart-size", type=int, default=200)
+    parser.add_argument("--bad-rows", type=int, default=0)
+    args = parser.parse_args()
+
+    db, cursor = connect_db(local_infile=True)
+    charts = synthetic_charts(args.charts, args.chart_size, args.bad_rows)
+    total = args.charts * args.chart_size
+    suffix = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    print(f"{total} rows in {args.charts} charts, {args.bad_rows} bad rows")
+    for method in ("executemany", "load_data"):
+        for deferred in (False, True):
+            label = f"{method}{'+deferred' if deferred else ''}"
+            table = f"bench_insert_{method}_{int(deferred)}_{suffix}"
+            create_new_table(cursor, table, defer_indexes=deferred)
+            try:
+                inserted, load_time, index_time, failures = run(
+                    db, cursor, table, charts, method, deferred
+                )
+                elapsed = load_time + index_time
+                print(
+                    f"{label:21s} {elapsed:8.2f}s total  (load {load_time:.2f}s, "
+                    f"index {index_time:.2f}s)  {inserted / elapsed:10.0f} rows/s  "
+                    f"{inserted} inserted  {failures} failure entries"
+                )
+            except Exception as e:
+                db.rollback()
+                print(f"{label:21s} failed: {e}")
+            finally:
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    cursor.close()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
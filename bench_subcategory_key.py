@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""EXPLAIN and time chart lookups: NULL-or-equal subcategory predicate vs subcategory_key.
+
+Runs the per-row lookup that the comparison UPDATEs perform, once with the
+old predicate and once with equality on the generated column, against the
+same sample of rows from one snapshot table. The "before" numbers are taken
+on the original index set (idx_comparison, idx_country) before the key is
+added: on the snapshot itself with idx_chart_key ignored when it still has
+those indexes, otherwise on a temporary copy built with them.
+
+    python bench_subcategory_key.py                      # newest snapshot
+    python bench_subcategory_key.py apple_chart_20250825_103954 --samples 2000
+"""
+
+import argparse
+import random
+import time
+
+from chart_db import connect_db, ensure_subcategory_key, get_last_table_name
+
+OLD_PREDICATE = """
+    WHERE appleid=%s AND countryCode=%s AND category=%s
+      AND ((subcategory IS NULL AND %s IS NULL) OR subcategory=%s)
+"""
+NEW_PREDICATE = """
+    WHERE countryCode=%s AND category=%s AND subcategory_key=%s AND appleid=%s
+"""
+
+# Secondary indexes chart tables had before subcategory_key
+BASELINE_INDEXES = """
+    INDEX idx_comparison (appleid, countryCode, category, subcategory),
+    INDEX idx_country (countryCode)
+"""
+
+
+def old_params(appleid, country, category, subcategory):
+    return (appleid, country, category, subcategory, subcategory)
+
+
+def new_params(appleid, country, category, subcategory):
+    return (country, category, subcategory or "", appleid)
+
+
+def table_indexes(cursor, table):
+    cursor.execute(
+        """
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """,
+        (table,),
+    )
+    return {name for (name,) in cursor.fetchall()}
+
+
+def baseline_source(cursor, table):
+    """FROM clause for the "before" lookups, restricted to the original indexes"""
+    indexes = table_indexes(cursor, table)
+    if "idx_comparison" not in indexes:
+        baseline = f"baseline_{table}"
+        print(f"{table} lacks idx_comparison; copying it to temporary {baseline}")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {baseline} ({BASELINE_INDEXES}) "
+            f"SELECT * FROM {table}"
+        )
+        return baseline
+    if "idx_chart_key" in indexes:
+        return f"{table} IGNORE INDEX (idx_chart_key)"
+    return table
+
+
+def explain(cursor, table, predicate, params):
+    cursor.execute(f"EXPLAIN SELECT chart_rank FROM {table} {predicate}", params)
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def time_lookups(cursor, table, predicate, make_params, sample):
+    start = time.perf_counter()
+    for row in sample:
+        cursor.execute(f"SELECT chart_rank FROM {table} {predicate}", make_params(*row))
+        cursor.fetchall()
+    return time.perf_counter() - start
+
+
+def report(cursor, name, source, predicate, make_params, probe, sample):
+    print(f"\n== {name}")
+    for plan in explain(cursor, source, predicate, make_params(*probe)):
+        print(
+            f"  type={plan.get('type')} key={plan.get('key')} "
+            f"rows={plan.get('rows')} extra={plan.get('Extra')}"
+        )
+    elapsed = time_lookups(cursor, source, predicate, make_params, sample)
+    print(
+        f"  {len(sample)} lookups in {elapsed:.3f}s "
+        f"({elapsed / max(len(sample), 1) * 1000:.2f} ms each)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("table", nargs="?")
+    parser.add_argument("--samples", type=int, default=1000)
+    args = parser.parse_args()
+
+    db, cursor = connect_db()
+    table = args.table or get_last_table_name(cursor)
+
+    cursor.execute(
+        f"SELECT appleid, countryCode, category, subcategory FROM {table} "
+        f"WHERE appleid IS NOT NULL"
+    )
+    rows = cursor.fetchall()
+    sample = random.sample(rows, min(args.samples, len(rows)))
+    print(f"{table}: {len(rows)} rows, {len(sample)} sampled lookups")
+
+    # EXPLAIN a top-level chart row (NULL subcategory) if there is one, the case
+    # the old predicate exists for
+    probe = next((r for r in sample if r[3] is None), sample[0])
+    report(
+        cursor,
+        "before (NULL-or-equal)",
+        baseline_source(cursor, table),
+        OLD_PREDICATE,
+        old_params,
+        probe,
+        sample,
+    )
+
+    if ensure_subcategory_key(cursor, table):
+        db.commit()
+    report(
+        cursor,
+        "after (subcategory_key)",
+        table,
+        NEW_PREDICATE,
+        new_params,
+        probe,
+        sample,
+    )
+
+    cursor.close()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ from typing import Dict, List, Tuple
 from collections import defaultdict
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+from metadata_cache import MetadataCache
+from chart_db import bisect_insert, is_row_error
 
 # ===============================
 # CONFIG
@@ -28,6 +30,9 @@ RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
 REQUEST_TIMEOUT = (10, 30)  # (connect timeout, read timeout)
 MAX_CONSECUTIVE_FAILURES = 10
 
+# Persistent (country, appleid) -> metadata cache in front of LOOKUP_URL_TPL
+USE_METADATA_CACHE = True
+
 DB_CONFIG = {
     "host": "localhost",
     "user": "root",
@@ -601,9 +606,12 @@ def batched(iterable, n):
 
 
 def lookup_metadata(
-    session, apple_ids: List[int], country: str, missing_ids_set: set
+    session, apple_ids: List[int], country: str, missing_ids_set: set, cache=None
 ) -> Dict[int, dict]:
     out = {}
+    if cache is not None:
+        out = cache.get_many(country, apple_ids)
+        apple_ids = [aid for aid in apple_ids if aid not in out]
     consecutive_failures = 0
 
     for chunk in batched(apple_ids, 100):
@@ -650,6 +658,9 @@ def lookup_metadata(
                 }
                 found_ids.add(int(aid))
 
+            if cache is not None:
+                cache.put_many(country, {aid: out[aid] for aid in found_ids})
+
             # Track missing ones for investigation
             for aid in chunk:
                 if aid not in found_ids:
@@ -828,14 +839,11 @@ def batch_insert_podcasts(cursor, insert_sql, batch_data, failed_inserts):
                 print(f"  ✅ Inserted {total_inserted} records...")
 
         except mysql.connector.Error as err:
-            # Handle individual failures if needed
-            print(f"  ⚠️ Batch insert failed: {err}")
-            for single_record in chunk:
-                try:
-                    cursor.execute(insert_sql, single_record)
-                    total_inserted += 1
-                except mysql.connector.Error as single_err:
-                    failed_inserts.append(f"Individual insert failed: {single_err}")
+            if not is_row_error(err):
+                raise
+            # Split the chunk until the bad rows are isolated
+            print(f"  ⚠️ Batch insert failed, bisecting {len(chunk)} rows: {err}")
+            total_inserted += bisect_insert(cursor, insert_sql, chunk, failed_inserts)
 
     return total_inserted
 
@@ -850,6 +858,7 @@ def main():
 
     # Create robust HTTP session
     session = create_robust_session()
+    metadata_cache = MetadataCache() if USE_METADATA_CACHE else None
 
     # Fetch and build genres mapping
     open(os.path.join(OUTPUT_DIR, "lookup_missing_ids.txt"), "w").close()
@@ -962,7 +971,9 @@ def main():
 
             # 2) Enrich with Lookup metadata in batches
             try:
-                meta_map = lookup_metadata(session, ids_ranked, region, missing_ids_set)
+                meta_map = lookup_metadata(
+                    session, ids_ranked, region, missing_ids_set, metadata_cache
+                )
                 print(f"    ✅ Retrieved metadata for {len(meta_map)} podcasts")
             except Exception as e:
                 print(f"    ❌ Metadata lookup error: {e}")
@@ -1102,6 +1113,8 @@ def main():
         cursor.close()
         db.close()
         session.close()
+        if metadata_cache is not None:
+            metadata_cache.close()
         print("✅ Cleaned up connections")
     except Exception as e:
         print(f"⚠️ Cleanup warning: {e}")
@@ -1112,6 +1125,8 @@ def main():
     print(f"  • Failed requests: {len(failed_requests)}")
     print(f"  • Failed inserts: {len(failed_inserts)}")
     print(f"  • Missing lookup IDs: {len(missing_ids_set)}")
+    if metadata_cache is not None:
+        print(f"  • Metadata cache: {metadata_cache.summary()}")
     print(f"  • Created table: {current_table}")
 
     if failed_requests:
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+import mysql.connector
+from mysql.connector import errorcode
+import datetime
+import os
+import time
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ===============================
+# CONFIG
+# ===============================
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",
+    "database": "podcast_169",
+}
+
+# Built with the table, or in one ALTER TABLE once it is loaded (DEFER_SECONDARY_INDEXES)
+SECONDARY_INDEXES = {
+    "idx_chart_key": "(countryCode, category, subcategory_key, appleid, chart_rank)",
+}
+
+LOAD_DATA_DIR = os.path.join("./documents", "load_data")
+
+
+# ===============================
+# SESSIONS
+# ===============================
+def session_config(local_infile=False):
+    db_config_optimized = DB_CONFIG.copy()
+    db_config_optimized.update(
+        {
+            "autocommit": False,
+            "use_unicode": True,
+            "charset": "utf8mb4",
+            "allow_local_infile": local_infile,
+        }
+    )
+    return db_config_optimized
+
+
+def connect_db(local_infile=False):
+    """Open a connection with bulk-load session settings; returns (db, cursor)"""
+    db = mysql.connector.connect(**session_config(local_infile))
+    cursor = db.cursor(buffered=True)
+    optimize_session(cursor)
+    return db, cursor
+
+
+def optimize_session(cursor):
+    """Optimize MySQL session variables for bulk operations"""
+    try:
+        logger.debug("Optimizing database session")
+        cursor.execute("SET SESSION bulk_insert_buffer_size = 67108864")  # 64MB
+        cursor.execute("SET SESSION myisam_sort_buffer_size = 67108864")  # 64MB
+        cursor.execute(
+            "SET SESSION innodb_lock_wait_timeout = 120"
+        )  # Increase lock timeout
+        cursor.execute("SET SESSION max_heap_table_size = 134217728")  # 128MB
+        cursor.execute("SET SESSION tmp_table_size = 134217728")  # 128MB
+        logger.debug("Database session optimized for bulk operations")
+    except mysql.connector.Error as e:
+        logger.warning(f"Some database optimizations failed (this is usually OK): {e}")
+
+
+# ===============================
+# SNAPSHOT TABLES
+# ===============================
+def get_last_table_name(cursor):
+    """Get the most recent chart table name"""
+    logger.debug("Fetching last table name")
+
+    cursor.execute("""
+        SELECT TABLE_NAME 
+        FROM information_schema.TABLES 
+        WHERE TABLE_SCHEMA = DATABASE() 
+        AND TABLE_NAME LIKE 'apple_chart_%'
+        ORDER BY TABLE_NAME DESC 
+        LIMIT 1
+    """)
+    result = cursor.fetchone()
+
+    if result:
+        logger.info(f"Found last table: {result[0]}")
+        return result[0]
+    else:
+        logger.info("No previous table found")
+        return None
+
+
+def create_new_table(cursor, table_name, defer_indexes=False):
+    """Create a new chart table with timestamp and optimized indexes
+
+    With defer_indexes only the primary key is created; build_secondary_indexes
+    adds the rest once the table is loaded.
+    """
+    logger.info(f"Creating new table: {table_name}")
+    indexes = "".join(
+        f",\n            INDEX {name} {columns}"
+        for name, columns in SECONDARY_INDEXES.items()
+        if not defer_indexes
+    )
+
+    cursor.execute(f"""
+        CREATE TABLE {table_name} (
+            id int NOT NULL AUTO_INCREMENT,
+            chart_rank int DEFAULT NULL,
+            podcast_url varchar(255) DEFAULT NULL,
+            appleid BIGINT UNSIGNED DEFAULT NULL,
+            title varchar(255) DEFAULT NULL,
+            img_url varchar(255) DEFAULT NULL,
+            countryCode varchar(10) DEFAULT NULL,
+            countryName varchar(100) DEFAULT NULL,
+            category varchar(50) DEFAULT NULL,
+            subcategory varchar(255) DEFAULT NULL,
+            old_rank int DEFAULT NULL,
+            movement varchar(10) DEFAULT NULL,
+            createdTime datetime DEFAULT NULL,
+            updatedTime datetime DEFAULT NULL,
+            subcategory_key varchar(255) AS (COALESCE(subcategory, '')) STORED NOT NULL,
+            PRIMARY KEY (id){indexes}
+        ) ENGINE=InnoDB
+    """)
+
+    logger.info(f"Successfully created table {table_name}")
+
+
+def build_secondary_indexes(cursor, table):
+    """Add whichever SECONDARY_INDEXES the table lacks in a single ALTER TABLE
+
+    One sorted bulk build per index instead of row-by-row B-tree maintenance
+    during the load. Safe to rerun: existing indexes are skipped.
+    """
+    cursor.execute(
+        """
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """,
+        (table,),
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = [name for name in SECONDARY_INDEXES if name not in existing]
+    if not missing:
+        return 0.0
+
+    start = time.time()
+    cursor.execute(
+        f"ALTER TABLE {table} "
+        + ", ".join(f"ADD INDEX {name} {SECONDARY_INDEXES[name]}" for name in missing)
+    )
+    elapsed = time.time() - start
+    logger.info(f"Built {', '.join(missing)} on {table} in {elapsed:.1f}s")
+    return elapsed
+
+
+def ensure_subcategory_key(cursor, table):
+    """Add subcategory_key and idx_chart_key to a chart table created before they existed
+
+    Comparisons match subcategory by equality on the NOT NULL key, so
+    (countryCode, category, subcategory_key, appleid) is an index lookup
+    instead of the NULL-or-equal predicate MySQL cannot range-scan.
+    """
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+          AND COLUMN_NAME = 'subcategory_key'
+    """,
+        (table,),
+    )
+    if cursor.fetchone()[0]:
+        return False
+    logger.info(f"Adding subcategory_key and idx_chart_key to {table}")
+    cursor.execute(f"""
+        ALTER TABLE {table}
+        ADD COLUMN subcategory_key varchar(255) AS (COALESCE(subcategory, '')) STORED NOT NULL,
+        ADD INDEX idx_chart_key (countryCode, category, subcategory_key, appleid, chart_rank)
+    """)
+    return True
+
+
+# ===============================
+# RANK MOVEMENT
+# ===============================
+def compute_movement(old_rank, new_rank):
+    """Movement string stored in the chart table: NEW, +n, -n or 0"""
+    if old_rank is None:
+        return "NEW"
+    diff = old_rank - new_rank
+    if diff > 0:
+        return f"+{diff}"
+    return str(diff)
+
+
+def movement_bucket(movement):
+    """Stats bucket for a movement value: new, up, down or same"""
+    if movement == "NEW":
+        return "new"
+    if movement.startswith("+"):
+        return "up"
+    if movement.startswith("-"):
+        return "down"
+    return "same"
+
+
+# ===============================
+# CHART INSERTS
+# ===============================
+CHART_INSERT_COLUMNS = (
+    "chart_rank",
+    "podcast_url",
+    "appleid",
+    "title",
+    "img_url",
+    "countryCode",
+    "countryName",
+    "category",
+    "subcategory",
+    "old_rank",
+    "movement",
+    "createdTime",
+    "updatedTime",
+)
+
+
+def build_insert_sql(table):
+    """INSERT statement matching the tuples produced by build_chart_rows"""
+    return f"""
+        INSERT INTO {table}
+        ({", ".join(CHART_INSERT_COLUMNS)})
+        VALUES ({",".join(["%s"] * len(CHART_INSERT_COLUMNS))})
+        """
+
+
+def chart_row_key(row):
+    """Identify a build_chart_rows tuple by country/category/subcategory/rank/appleid"""
+    return f"{row[5]} | {row[7]} | {row[8] or ''} | rank {row[0]} | appleid {row[2]}"
+
+
+# Errors caused by the values in a row; anything else (lost connection, lock
+# waits, deadlocks) is re-raised instead of bisected one row at a time
+ROW_ERRORS = (
+    errorcode.ER_TRUNCATED_WRONG_VALUE_FOR_FIELD,
+    errorcode.ER_WARN_DATA_OUT_OF_RANGE,
+    errorcode.ER_DATA_TOO_LONG,
+    errorcode.ER_TRUNCATED_WRONG_VALUE,
+    errorcode.ER_BAD_NULL_ERROR,
+    errorcode.ER_DUP_ENTRY,
+)
+
+
+def is_row_error(err):
+    """True when a failed INSERT was rejected because of its rows' values"""
+    if isinstance(err, (mysql.connector.DataError, mysql.connector.IntegrityError)):
+        return True
+    # Client-side conversion failures ("Failed processing format-parameters")
+    if isinstance(err, mysql.connector.ProgrammingError) and err.errno in (None, -1):
+        return True
+    return err.errno in ROW_ERRORS
+
+
+def bisect_insert(cursor, insert_sql, rows, failed_inserts):
+    """Retry a failed batch in halves until the bad rows are isolated
+
+    A multi-row INSERT is atomic, so a failed half left nothing behind and
+    can be split again. k bad rows cost O(k log n) round trips instead of
+    one per row.
+    """
+    inserted = 0
+    mid = len(rows) // 2
+    for half in (rows[:mid], rows[mid:]):
+        if not half:
+            continue
+        try:
+            cursor.executemany(insert_sql, half)
+            inserted += len(half)
+        except mysql.connector.Error as err:
+            if not is_row_error(err):
+                raise
+            if len(half) > 1:
+                inserted += bisect_insert(cursor, insert_sql, half, failed_inserts)
+                continue
+            logger.error(f"Insert failed for {chart_row_key(half[0])}: {err}")
+            failed_inserts.append(
+                f"Individual insert failed: {chart_row_key(half[0])} | {err}"
+            )
+    return inserted
+
+
+def batch_insert_podcasts(cursor, insert_sql, batch_data, failed_inserts):
+    """Insert podcast data in batches for better performance"""
+    logger.debug(f"Starting batch insert of {len(batch_data)} records")
+
+    chunk_size = 500
+    total_inserted = 0
+
+    for i in range(0, len(batch_data), chunk_size):
+        chunk = batch_data[i : i + chunk_size]
+        try:
+            cursor.executemany(insert_sql, chunk)
+            total_inserted += len(chunk)
+
+            if i % 2000 == 0 and i > 0:
+                logger.info(f"Inserted {total_inserted} records so far...")
+
+        except mysql.connector.Error as err:
+            if not is_row_error(err):
+                raise
+            logger.error(f"Batch insert failed, bisecting {len(chunk)} rows: {err}")
+            total_inserted += bisect_insert(cursor, insert_sql, chunk, failed_inserts)
+
+    logger.debug(f"Batch insert completed: {total_inserted} records inserted")
+    return total_inserted
+
+
+def tsv_field(value):
+    """Encode one value for LOAD DATA's default escaping (\\N is NULL)"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def write_tsv(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for row in rows:
+            f.write("\t".join(tsv_field(v) for v in row))
+            f.write("\n")
+
+
+def load_data_rows(cursor, table, rows):
+    """Bulk load rows with LOAD DATA LOCAL INFILE; returns rows loaded, or None if it warned
+
+    LOCAL loads behave as IGNORE: duplicates are skipped and bad values are
+    truncated or zeroed with a warning instead of failing the statement. A
+    load that raised any warning is rolled back to a savepoint and None is
+    returned, so the caller can insert the chart with executemany and report
+    the rows strict mode rejects. Raises mysql.connector.Error if the server
+    refuses the load.
+    """
+    os.makedirs(LOAD_DATA_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".tsv", dir=LOAD_DATA_DIR)
+    os.close(fd)
+    try:
+        write_tsv(path, rows)
+        cursor.execute("SAVEPOINT load_data_chart")
+        cursor.execute(f"""
+            LOAD DATA LOCAL INFILE '{os.path.abspath(path)}'
+            INTO TABLE {table}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t'
+            LINES TERMINATED BY '\\n'
+            ({", ".join(CHART_INSERT_COLUMNS)})
+        """)
+        loaded = cursor.rowcount
+        if loaded != len(rows) or cursor.warning_count:
+            logger.warning(
+                f"LOAD DATA into {table} loaded {loaded} of {len(rows)} rows with "
+                f"{cursor.warning_count} warnings; retrying the chart with executemany"
+            )
+            cursor.execute("ROLLBACK TO SAVEPOINT load_data_chart")
+            return None
+        cursor.execute("RELEASE SAVEPOINT load_data_chart")
+        return loaded
+    finally:
+        os.remove(path)
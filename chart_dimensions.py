@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ===============================
+# CONFIG
+# ===============================
+PODCAST_TABLE = "podcast"
+COUNTRY_TABLE = "country"
+GENRE_TABLE = "genre"
+FACT_TABLE = "chart_fact"
+WIDE_VIEW = "chart_wide"
+LOOKUP_CHUNK = 1000  # appleids per podcast dimension SELECT
+
+
+def create_dimension_tables(cursor):
+    """Create the podcast/country/genre dimensions, the chart fact table and the wide view.
+
+    Fact rows carry only small integer keys; titles, URLs and names live once
+    in the dimensions. old_rank is kept on the fact row because it cannot be
+    derived from a single snapshot.
+    """
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PODCAST_TABLE} (
+            appleid bigint unsigned NOT NULL,
+            title varchar(255) DEFAULT NULL,
+            artwork varchar(255) DEFAULT NULL,
+            podcast_url varchar(255) DEFAULT NULL,
+            updated_at datetime NOT NULL,
+            PRIMARY KEY (appleid)
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {COUNTRY_TABLE} (
+            country_id smallint unsigned NOT NULL AUTO_INCREMENT,
+            countryCode varchar(10) NOT NULL,
+            countryName varchar(100) DEFAULT NULL,
+            PRIMARY KEY (country_id),
+            UNIQUE KEY uq_country_code (countryCode)
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {GENRE_TABLE} (
+            genre_id int unsigned NOT NULL,
+            category varchar(50) NOT NULL,
+            subcategory varchar(255) DEFAULT NULL,
+            PRIMARY KEY (genre_id)
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {FACT_TABLE} (
+            snapshot_id bigint unsigned NOT NULL,
+            country_id smallint unsigned NOT NULL,
+            genre_id int unsigned NOT NULL,
+            chart_rank smallint unsigned NOT NULL,
+            appleid bigint unsigned NOT NULL,
+            old_rank smallint unsigned DEFAULT NULL,
+            PRIMARY KEY (snapshot_id, country_id, genre_id, chart_rank),
+            INDEX idx_appleid (appleid, snapshot_id)
+        ) ENGINE=InnoDB
+    """)
+    create_wide_view(cursor)
+
+
+def create_wide_view(cursor):
+    """chart_wide: the per-run table's column layout (plus snapshot_id) over the fact table
+
+    Query one snapshot with WHERE snapshot_id = 20250825103954. Titles and
+    URLs are the podcast's latest known metadata.
+    """
+    cursor.execute(f"""
+        CREATE OR REPLACE VIEW {WIDE_VIEW} AS
+        SELECT f.snapshot_id,
+               f.chart_rank,
+               p.podcast_url,
+               f.appleid,
+               p.title,
+               p.artwork AS img_url,
+               c.countryCode,
+               c.countryName,
+               g.category,
+               g.subcategory,
+               f.old_rank,
+               CASE
+                   WHEN f.old_rank IS NULL THEN 'NEW'
+                   WHEN f.old_rank > f.chart_rank
+                       THEN CONCAT('+', CAST(f.old_rank AS SIGNED) - CAST(f.chart_rank AS SIGNED))
+                   ELSE CAST(CAST(f.old_rank AS SIGNED) - CAST(f.chart_rank AS SIGNED) AS CHAR)
+               END AS movement,
+               STR_TO_DATE(f.snapshot_id, '%Y%m%d%H%i%s') AS createdTime,
+               STR_TO_DATE(f.snapshot_id, '%Y%m%d%H%i%s') AS updatedTime
+        FROM {FACT_TABLE} f
+        JOIN {COUNTRY_TABLE} c ON c.country_id = f.country_id
+        JOIN {GENRE_TABLE} g ON g.genre_id = f.genre_id
+        LEFT JOIN {PODCAST_TABLE} p ON p.appleid = f.appleid
+    """)
+
+
+class ChartDimensions:
+    """Run-scoped writer for the normalized chart schema.
+
+    Country and genre keys are resolved once per run. Podcast rows are read
+    once per appleid and only rewritten when title, artwork or URL actually
+    changed, so a typical day touches a small fraction of the dimension.
+
+    Keys and metadata written inside a chart's transaction are staged per
+    thread and only enter the shared caches on commit(); rollback() drops
+    them, so a rolled-back chart never leaves ids that are not in the tables.
+    """
+
+    def __init__(self, snapshot_id):
+        self.snapshot_id = snapshot_id
+        self.country_ids = {}  # countryCode -> country_id
+        self.genres = set()  # genre ids upserted this run
+        self.podcasts = {}  # appleid -> (title, artwork, podcast_url) as stored
+        self.podcasts_upserted = 0
+        self.facts_written = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _staged(self):
+        """This thread's uncommitted cache changes"""
+        if not hasattr(self._local, "staged"):
+            self._local.staged = {
+                "country_ids": {},
+                "genres": set(),
+                "podcasts": {},
+                "podcasts_upserted": 0,
+                "facts_written": 0,
+            }
+        return self._local.staged
+
+    def commit(self):
+        """Publish this thread's staged keys and counters; call after the transaction commits"""
+        staged = self._staged()
+        with self._lock:
+            self.country_ids.update(staged["country_ids"])
+            self.genres |= staged["genres"]
+            self.podcasts.update(staged["podcasts"])
+            self.podcasts_upserted += staged["podcasts_upserted"]
+            self.facts_written += staged["facts_written"]
+        del self._local.staged
+
+    def rollback(self):
+        """Forget this thread's staged keys; call after the transaction rolls back"""
+        if hasattr(self._local, "staged"):
+            del self._local.staged
+
+    def country_id(self, cursor, country_code, country_name):
+        staged = self._staged()
+        if country_code in staged["country_ids"]:
+            return staged["country_ids"][country_code]
+        with self._lock:
+            if country_code in self.country_ids:
+                return self.country_ids[country_code]
+        cursor.execute(
+            f"""
+            INSERT INTO {COUNTRY_TABLE} (countryCode, countryName) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE countryName = VALUES(countryName),
+                                    country_id = LAST_INSERT_ID(country_id)
+        """,
+            (country_code, country_name),
+        )
+        staged["country_ids"][country_code] = cursor.lastrowid
+        return cursor.lastrowid
+
+    def ensure_genre(self, cursor, genre_id, category, subcategory):
+        staged = self._staged()
+        if genre_id in staged["genres"]:
+            return
+        with self._lock:
+            if genre_id in self.genres:
+                return
+        cursor.execute(
+            f"""
+            INSERT INTO {GENRE_TABLE} (genre_id, category, subcategory) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE category = VALUES(category), subcategory = VALUES(subcategory)
+        """,
+            (genre_id, category, subcategory or None),
+        )
+        staged["genres"].add(genre_id)
+
+    def _load_podcasts(self, cursor, apple_ids):
+        with self._lock:
+            unseen = [aid for aid in apple_ids if aid not in self.podcasts]
+        for i in range(0, len(unseen), LOOKUP_CHUNK):
+            chunk = unseen[i : i + LOOKUP_CHUNK]
+            placeholders = ",".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"""
+                SELECT appleid, title, artwork, podcast_url
+                FROM {PODCAST_TABLE} WHERE appleid IN ({placeholders})
+            """,
+                chunk,
+            )
+            found = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+            with self._lock:
+                for aid in chunk:
+                    self.podcasts.setdefault(aid, found.get(aid))
+
+    def upsert_podcasts(self, cursor, podcasts, now):
+        """Write (appleid, title, artwork, podcast_url) rows whose metadata changed"""
+        # No title means the lookup missed; keep whatever is stored
+        podcasts = [p for p in podcasts if p[1]]
+        self._load_podcasts(cursor, list(dict.fromkeys(p[0] for p in podcasts)))
+
+        staged = self._staged()["podcasts"]
+        with self._lock:
+            changed = {
+                p[0]: p
+                for p in podcasts
+                if staged.get(p[0], self.podcasts.get(p[0])) != p[1:]
+            }
+        if not changed:
+            return 0
+
+        # Upsert in appleid order so concurrent writers lock podcast rows in the
+        # same order instead of deadlocking on each other
+        cursor.executemany(
+            f"""
+            INSERT INTO {PODCAST_TABLE} (appleid, title, artwork, podcast_url, updated_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE title = VALUES(title), artwork = VALUES(artwork),
+                                    podcast_url = VALUES(podcast_url),
+                                    updated_at = VALUES(updated_at)
+        """,
+            [changed[aid] + (now,) for aid in sorted(changed)],
+        )
+        for aid, p in changed.items():
+            staged[aid] = p[1:]
+        self._staged()["podcasts_upserted"] += len(changed)
+        return len(changed)
+
+    def write_chart(
+        self,
+        cursor,
+        source_table,
+        country_code,
+        country_name,
+        genre_id,
+        category,
+        subcategory,
+        podcasts,
+        now,
+        min_id=0,
+        replace=True,
+    ):
+        """Replace one chart's fact rows from the rows just written to source_table.
+
+        Runs inside the caller's transaction, so the fact rows commit (or roll
+        back) together with the per-run table and the chart checkpoint. min_id
+        limits the read to a primary key range while source_table has no
+        secondary indexes yet; replace=False skips the DELETE for charts that
+        cannot have fact rows yet.
+
+        source_table is read with a plain SELECT (a consistent read) rather
+        than INSERT ... SELECT, which would take shared next-key locks on rows
+        other writers are still appending and serialize them.
+        """
+        country_id = self.country_id(cursor, country_code, country_name)
+        self.ensure_genre(cursor, genre_id, category, subcategory)
+        self.upsert_podcasts(cursor, podcasts, now)
+
+        if replace:
+            cursor.execute(
+                f"""
+                DELETE FROM {FACT_TABLE}
+                WHERE snapshot_id = %s AND country_id = %s AND genre_id = %s
+            """,
+                (self.snapshot_id, country_id, genre_id),
+            )
+        cursor.execute(
+            f"""
+            SELECT chart_rank, appleid, old_rank
+            FROM {source_table}
+            WHERE id > %s AND countryCode = %s AND category = %s AND subcategory_key = %s
+              AND chart_rank IS NOT NULL AND appleid IS NOT NULL
+        """,
+            (min_id, country_code, category, subcategory or ""),
+        )
+        facts = [
+            (self.snapshot_id, country_id, genre_id) + tuple(row)
+            for row in cursor.fetchall()
+        ]
+        if not facts:
+            return 0
+        cursor.executemany(
+            f"""
+            INSERT IGNORE INTO {FACT_TABLE}
+            (snapshot_id, country_id, genre_id, chart_rank, appleid, old_rank)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """,
+            facts,
+        )
+        self._staged()["facts_written"] += cursor.rowcount
+        return cursor.rowcount
+
+    def refresh_old_ranks(self, db, cursor, source_table):
+        """Copy old_rank from source_table onto this snapshot's fact rows; returns rows changed
+
+        Needed when the rank comparison fills old_rank after the charts were
+        written. Commits once per country to keep the transactions short.
+        """
+        cursor.execute(
+            f"SELECT DISTINCT country_id FROM {FACT_TABLE} WHERE snapshot_id = %s",
+            (self.snapshot_id,),
+        )
+        country_ids = [row[0] for row in cursor.fetchall()]
+        changed = 0
+        for country_id in country_ids:
+            cursor.execute(
+                f"""
+                UPDATE {FACT_TABLE} f
+                JOIN {COUNTRY_TABLE} c ON c.country_id = f.country_id
+                JOIN {GENRE_TABLE} g ON g.genre_id = f.genre_id
+                JOIN {source_table} s
+                  ON s.countryCode = c.countryCode
+                 AND s.category = g.category
+                 AND s.subcategory_key = COALESCE(g.subcategory, '')
+                 AND s.appleid = f.appleid
+                 AND s.chart_rank = f.chart_rank
+                SET f.old_rank = s.old_rank
+                WHERE f.snapshot_id = %s AND f.country_id = %s
+                  AND NOT (f.old_rank <=> s.old_rank)
+            """,
+                (self.snapshot_id, country_id),
+            )
+            changed += cursor.rowcount
+            db.commit()
+        return changed
+
+    def summary(self):
+        return (
+            f"{self.facts_written} fact rows, {self.podcasts_upserted} podcast rows "
+            f"changed of {len(self.podcasts)} seen"
+        )
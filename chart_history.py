@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+import mysql.connector
+import datetime
+import argparse
+import logging
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# ===============================
+# CONFIG
+# ===============================
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",
+    "database": "podcast_169",
+}
+
+HISTORY_TABLE = "chart_history"
+# staging_ prefix: a snapshot still loading (see chart_log.publish_snapshot)
+SNAPSHOT_TABLE_RE = re.compile(r"^(?:staging_)?apple_chart_(\d{8})_(\d{6})$")
+MIGRATE_WORKERS = 4
+MIGRATE_CHUNK_ROWS = 100000  # id range copied per INSERT ... SELECT
+PARTITION_DAYS_AHEAD = 7  # keep this many empty daily partitions ready
+
+HISTORY_COLUMNS = (
+    "snapshot_date, snapshot_id, countryCode, category, subcategory, chart_rank, "
+    "appleid, podcast_url, title, img_url, countryName, old_rank, movement, createdTime"
+)
+
+
+def snapshot_id_for_table(table_name):
+    """apple_chart_20250825_103954 -> 20250825103954 (None for non-snapshot tables)"""
+    m = SNAPSHOT_TABLE_RE.match(table_name)
+    return int(m.group(1) + m.group(2)) if m else None
+
+
+def snapshot_date_for_id(snapshot_id):
+    return datetime.datetime.strptime(str(snapshot_id)[:8], "%Y%m%d").date()
+
+
+def partition_name(day):
+    return f"p{day.strftime('%Y%m%d')}"
+
+
+def create_history_table(cursor, first_day=None):
+    """Create chart_history, RANGE-partitioned by snapshot_date (one partition per day).
+
+    subcategory is stored as '' rather than NULL so it can be part of the
+    primary key; every unique key must include snapshot_date to allow
+    partitioning.
+    """
+    first_day = first_day or datetime.date.today()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (
+            snapshot_date date NOT NULL,
+            snapshot_id bigint unsigned NOT NULL,
+            countryCode varchar(10) NOT NULL,
+            category varchar(50) NOT NULL,
+            subcategory varchar(255) NOT NULL DEFAULT '',
+            chart_rank smallint unsigned NOT NULL,
+            appleid bigint unsigned NOT NULL,
+            podcast_url varchar(255) DEFAULT NULL,
+            title varchar(255) DEFAULT NULL,
+            img_url varchar(255) DEFAULT NULL,
+            countryName varchar(100) DEFAULT NULL,
+            old_rank int DEFAULT NULL,
+            movement varchar(10) DEFAULT NULL,
+            createdTime datetime DEFAULT NULL,
+            PRIMARY KEY (snapshot_date, snapshot_id, countryCode, category, subcategory, chart_rank),
+            INDEX idx_appleid (appleid, snapshot_date)
+        ) ENGINE=InnoDB
+        PARTITION BY RANGE COLUMNS (snapshot_date) (
+            PARTITION {partition_name(first_day)}
+                VALUES LESS THAN ('{first_day + datetime.timedelta(days=1)}'),
+            PARTITION pmax VALUES LESS THAN (MAXVALUE)
+        )
+    """)
+
+
+def get_partition_days(cursor):
+    """Dates that already have their own daily partition"""
+    cursor.execute(
+        """
+        SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME <> 'pmax'
+    """,
+        (HISTORY_TABLE,),
+    )
+    return {
+        datetime.datetime.strptime(row[0][1:], "%Y%m%d").date()
+        for row in cursor.fetchall()
+    }
+
+
+def partition_clause(day):
+    return f"PARTITION {partition_name(day)} VALUES LESS THAN ('{day + datetime.timedelta(days=1)}')"
+
+
+def ensure_partitions(cursor, days):
+    """Give every day its own partition by splitting the partition that covers it
+
+    Days newer than every daily partition come out of pmax. Older days (a
+    backfill into a table created later) come out of the nearest later daily
+    partition; REORGANIZE moves their rows, so nothing stays lumped into it.
+    """
+    existing = get_partition_days(cursor)
+    missing = sorted(d for d in set(days) if d not in existing)
+    if not missing:
+        return
+
+    splits = defaultdict(list)  # covering daily partition (None: pmax) -> new days
+    for d in missing:
+        splits[min((e for e in existing if e > d), default=None)].append(d)
+
+    for cover, new_days in splits.items():
+        parts = [partition_clause(d) for d in new_days]
+        if cover is None:
+            source = "pmax"
+            parts.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+        else:
+            source = partition_name(cover)
+            parts.append(partition_clause(cover))
+        cursor.execute(f"""
+            ALTER TABLE {HISTORY_TABLE} REORGANIZE PARTITION {source} INTO (
+                {", ".join(parts)}
+            )
+        """)
+    logger.info(f"Added {len(missing)} daily partitions to {HISTORY_TABLE}")
+
+
+def insert_select_sql(source_table, snapshot_id, where=""):
+    snapshot_date = snapshot_date_for_id(snapshot_id)
+    return f"""
+        INSERT IGNORE INTO {HISTORY_TABLE} ({HISTORY_COLUMNS})
+        SELECT '{snapshot_date}', {snapshot_id}, countryCode, category,
+               COALESCE(subcategory, ''), chart_rank, appleid, podcast_url, title,
+               img_url, countryName, old_rank, movement, createdTime
+        FROM {source_table}
+        WHERE appleid IS NOT NULL AND chart_rank IS NOT NULL {where}
+    """
+
+
+def publish_snapshot_to_history(cursor, table_name):
+    """Copy a finished per-run snapshot table into chart_history (replacing any earlier copy)"""
+    snapshot_id = snapshot_id_for_table(table_name)
+    if snapshot_id is None:
+        raise ValueError(f"{table_name} is not a snapshot table")
+    snapshot_date = snapshot_date_for_id(snapshot_id)
+
+    create_history_table(cursor, snapshot_date)
+    ensure_partitions(
+        cursor,
+        [
+            snapshot_date + datetime.timedelta(days=i)
+            for i in range(PARTITION_DAYS_AHEAD + 1)
+        ],
+    )
+    cursor.execute(
+        f"DELETE FROM {HISTORY_TABLE} WHERE snapshot_date = %s AND snapshot_id = %s",
+        (snapshot_date, snapshot_id),
+    )
+    cursor.execute(insert_select_sql(table_name, snapshot_id))
+    logger.info(f"Published {cursor.rowcount} rows of {table_name} to {HISTORY_TABLE}")
+    return cursor.rowcount
+
+
+def list_snapshot_tables(cursor):
+    cursor.execute("""
+        SELECT TABLE_NAME FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE 'apple_chart_%'
+    """)
+    return sorted(row[0] for row in cursor.fetchall() if snapshot_id_for_table(row[0]))
+
+
+def copy_chunk(table_name, snapshot_id, low, high):
+    """Worker: copy one id range of a snapshot table on its own connection"""
+    db = mysql.connector.connect(**DB_CONFIG)
+    cursor = db.cursor()
+    try:
+        cursor.execute(
+            insert_select_sql(
+                table_name, snapshot_id, f"AND id BETWEEN {low} AND {high}"
+            )
+        )
+        db.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        db.close()
+
+
+def migrate(workers=MIGRATE_WORKERS, chunk_rows=MIGRATE_CHUNK_ROWS):
+    """Backfill every apple_chart_YYYYMMDD_HHMMSS table into chart_history in parallel chunks.
+
+    INSERT IGNORE on the primary key makes reruns safe: chunks copied by an
+    interrupted migration are simply skipped.
+    """
+    db = mysql.connector.connect(**DB_CONFIG)
+    cursor = db.cursor(buffered=True)
+
+    tables = list_snapshot_tables(cursor)
+    if not tables:
+        logger.info("No snapshot tables to migrate")
+        return 0
+
+    days = sorted({snapshot_date_for_id(snapshot_id_for_table(t)) for t in tables})
+    create_history_table(cursor, days[0])
+    ensure_partitions(cursor, days)
+    db.commit()
+
+    jobs = []
+    for table_name in tables:
+        cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table_name}")
+        low, high = cursor.fetchone()
+        if low is None:
+            continue
+        snapshot_id = snapshot_id_for_table(table_name)
+        for start in range(low, high + 1, chunk_rows):
+            jobs.append((table_name, snapshot_id, start, start + chunk_rows - 1))
+    cursor.close()
+    db.close()
+
+    logger.info(
+        f"Migrating {len(tables)} tables in {len(jobs)} chunks with {workers} workers"
+    )
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(copy_chunk, *job): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), start=1):
+            table_name, _, low, high = futures[future]
+            try:
+                total += future.result()
+            except mysql.connector.Error as e:
+                logger.error(f"Chunk {table_name} [{low}-{high}] failed: {e}")
+            if done % 50 == 0:
+                logger.info(f"{done}/{len(jobs)} chunks done, {total} rows copied")
+
+    logger.info(f"Migration finished: {total} rows copied into {HISTORY_TABLE}")
+    return total
+
+
+def partitions_before(cursor, day):
+    return sorted(d for d in get_partition_days(cursor) if d < day)
+
+
+def drop_before(day):
+    """Drop whole daily partitions older than day (instant, no row-by-row DELETE)"""
+    db = mysql.connector.connect(**DB_CONFIG)
+    cursor = db.cursor()
+    old = partitions_before(cursor, day)
+    if old:
+        cursor.execute(
+            f"ALTER TABLE {HISTORY_TABLE} DROP PARTITION "
+            + ", ".join(partition_name(d) for d in old)
+        )
+    logger.info(f"Dropped {len(old)} partitions older than {day}")
+    cursor.close()
+    db.close()
+
+
+def archive_before(day):
+    """Move each daily partition older than day into its own plain table, then drop it"""
+    db = mysql.connector.connect(**DB_CONFIG)
+    cursor = db.cursor()
+    for d in partitions_before(cursor, day):
+        archive = f"{HISTORY_TABLE}_archive_{d.strftime('%Y%m%d')}"
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {archive} LIKE {HISTORY_TABLE}")
+        cursor.execute(f"ALTER TABLE {archive} REMOVE PARTITIONING")
+        cursor.execute(
+            f"ALTER TABLE {HISTORY_TABLE} EXCHANGE PARTITION {partition_name(d)} WITH TABLE {archive}"
+        )
+        cursor.execute(
+            f"ALTER TABLE {HISTORY_TABLE} DROP PARTITION {partition_name(d)}"
+        )
+        logger.info(f"Archived partition {partition_name(d)} to {archive}")
+    cursor.close()
+    db.close()
+
+
+# ===============================
+# MAIN
+# ===============================
+def main():
+    parser = argparse.ArgumentParser(description="Maintain chart_history")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_migrate = sub.add_parser("migrate", help="backfill per-run tables into history")
+    p_migrate.add_argument("--workers", type=int, default=MIGRATE_WORKERS)
+    p_migrate.add_argument("--chunk-rows", type=int, default=MIGRATE_CHUNK_ROWS)
+
+    p_drop = sub.add_parser("drop-before", help="drop daily partitions before DATE")
+    p_drop.add_argument("date", type=datetime.date.fromisoformat)
+
+    p_archive = sub.add_parser("archive-before", help="archive partitions before DATE")
+    p_archive.add_argument("date", type=datetime.date.fromisoformat)
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate(args.workers, args.chunk_rows)
+    elif args.command == "drop-before":
+        drop_before(args.date)
+    elif args.command == "archive-before":
+        archive_before(args.date)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s | %(levelname)-8s | %(message)s"
+    )
+    main()
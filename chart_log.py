@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
+import asyncio
+import aiohttp
 import requests
 import mysql.connector
+from mysql.connector import errorcode, pooling
 import datetime
 import os
 import csv
@@ -8,10 +11,43 @@ import time
 import random
 import logging
 import sys
+import threading
+import queue
+import hashlib
+import json
+import gzip
+import io
 from typing import Dict, List, Tuple
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
+from urllib.parse import urlparse
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+from metadata_cache import MetadataCache
+from chart_history import publish_snapshot_to_history, snapshot_id_for_table
+from chart_dimensions import ChartDimensions, create_dimension_tables
+from chart_db import (
+    batch_insert_podcasts,
+    build_insert_sql,
+    build_secondary_indexes,
+    compute_movement,
+    create_new_table,
+    ensure_subcategory_key,
+    load_data_rows,
+    movement_bucket,
+    optimize_session,
+    session_config,
+)
+
+try:
+    import zstandard
+except ImportError:  # optional, spool falls back to gzip
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, only needed for COMPARISON_PARQUET
+    pyarrow = None
 
 
 # ===============================
@@ -75,6 +111,7 @@ logger, main_log_file = setup_logging()
 GENRE_LOOKUP_URL = "https://itunes.apple.com/WebObjects/MZStoreServices.woa/ws/genres"
 CHARTS_URL_TPL = "https://itunes.apple.com/WebObjects/MZStoreServices.woa/ws/charts?cc={cc}&g={genre_id}&name=Podcasts&limit={limit}"
 LOOKUP_URL_TPL = "https://itunes.apple.com/lookup?id={ids}&country={country}"
+STOREFRONT_GENRES_URL_TPL = GENRE_LOOKUP_URL + "?id=26&cc={cc}"
 
 # Set this to 250 to fetch 250 ranks per genre (if available from charts API)
 CHART_LIMIT = 250
@@ -86,12 +123,104 @@ RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
 REQUEST_TIMEOUT = (10, 30)  # (connect timeout, read timeout)
 MAX_CONSECUTIVE_FAILURES = 10
 
-DB_CONFIG = {
-    "host": "localhost",
-    "user": "root",
-    "password": "",
-    "database": "podcast_169",
-}
+# Async crawl engine: fan out (region, genre) fetches instead of walking them one by one
+USE_ASYNC_CRAWL = True
+MAX_CONCURRENCY = 32  # global cap on in-flight iTunes requests
+ENDPOINT_CONCURRENCY = {"charts": 16, "lookup": 8, "genres": 1}
+REGION_PIPELINE_DEPTH = 3  # regions crawled concurrently ahead of the DB stage
+
+# Adaptive AIMD rate limiting shared by every iTunes request (per host + endpoint)
+USE_ADAPTIVE_RATE_LIMIT = True
+RATE_LIMIT_INITIAL = {"charts": 5.0, "lookup": 3.0, "genres": 1.0}  # requests/sec
+RATE_LIMIT_MAX = {"charts": 40.0, "lookup": 20.0, "genres": 2.0}
+RATE_LIMIT_MIN = 0.2  # never go slower than one request every 5s
+RATE_LIMIT_INCREASE = 0.5  # additive increase, ~req/sec gained per second of success
+RATE_LIMIT_DECREASE = 0.5  # multiplicative cut on 429 / soft-block 404 / timeout
+RATE_LIMIT_BURST = 5  # bucket capacity
+
+# Persistent (country, appleid) -> metadata cache in front of LOOKUP_URL_TPL
+USE_METADATA_CACHE = True
+METADATA_CACHE_OFFLINE = False  # True: serve from cache only, never call the Lookup API
+
+# Skip lookups and copy rows forward for charts whose resultIds did not change
+USE_CHART_FINGERPRINTS = True
+FINGERPRINT_TABLE = "chart_fingerprints"
+
+# Negative cache: skip (region, genre) charts that keep coming back empty / 404
+USE_NEGATIVE_CACHE = True
+AVAILABILITY_TABLE = "chart_availability"
+NEGATIVE_CACHE_STREAK = 2  # consecutive empty runs before a chart is skipped
+NEGATIVE_CACHE_REPROBE_DAYS = 7  # re-probe skipped charts this often
+NEGATIVE_CACHE_404_STREAK = (
+    3  # consecutive runs ending in 404 before a chart is skipped
+)
+NEGATIVE_CACHE_404_REPROBE_DAYS = 3  # 404s may be throttling: re-probe sooner
+CHART_PROBE_ATTEMPTS = 2  # attempts for a re-probe (instead of MAX_RETRIES)
+
+# Per-chart resume bookkeeping: one row per committed (snapshot, region, genre)
+CHECKPOINT_TABLE = "chart_checkpoints"
+# Charts each region is expected to produce; a region is done when all have a checkpoint
+PLAN_TABLE = "chart_plan"
+# Catalog of snapshots (status, progress, baseline): replaces information_schema scans
+SNAPSHOT_CATALOG = "chart_snapshots"
+
+# Load into staging_apple_chart_* and RENAME it into place once complete
+LOAD_VIA_STAGING = True
+STAGING_PREFIX = "staging_"
+LATEST_VIEW = "chart_latest"  # always points at the newest published snapshot
+EXITS_TABLE = "chart_exits"  # podcasts that dropped off a chart, per snapshot
+
+# Write-ahead spool of fetched charts/lookups, replayed on restart without network
+USE_SPOOL = True
+SPOOL_COMPRESSION = "zstd" if zstandard is not None else "gzip"
+
+# Rank comparison output: streamed, compressed ("gzip", "zstd" or "none"), optionally
+# one file per region plus a manifest.json, and optionally Parquet next to the CSV
+COMPARISON_COMPRESSION = "gzip"
+COMPARISON_PER_REGION = False  # True writes one file per region plus manifest.json
+COMPARISON_PARQUET = False
+PARQUET_ROW_GROUP = 50000  # rows buffered per region before a Parquet row group
+PARQUET_BUFFER_ROWS = (
+    200000  # rows buffered across regions before the largest is flushed
+)
+
+# Producer/consumer pipeline: a writer thread commits charts while the crawl continues
+USE_DB_WRITER_THREAD = True
+WRITER_QUEUE_SIZE = 500  # charts buffered between fetch and DB stages (backpressure)
+DB_WRITER_THREADS = 4  # writer threads, each committing charts on its own connection
+DB_POOL_SIZE = min(
+    DB_WRITER_THREADS + 2, 32
+)  # + main and comparison; 32 is the pool max
+DB_CONNECT_ATTEMPTS = 3  # health check / reconnect attempts per checkout
+DB_RETRY_DELAY = 2  # seconds between reconnects and deadlock retries
+DB_RETRYABLE_ERRORS = (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT)
+
+# Append each completed snapshot to the partitioned chart_history table
+WRITE_HISTORY_TABLE = True
+
+# "insert": old_rank/movement computed while building rows from a per-region index
+#           of the previous snapshot (no post-run UPDATE pass)
+# "sql":    one UPDATE ... LEFT JOIN previous per region, run entirely in MySQL
+# "merge":  stream both tables in key order and merge-join them (O(chunk) memory)
+# "dict":   legacy bulk_rank_comparison (load both tables, UPDATE every row)
+RANK_COMPARISON_MODE = "insert"
+MERGE_CHUNK_ROWS = 5000  # rows fetched / updates flushed per round trip in "merge"
+
+# "executemany": 500-row INSERT batches (row-by-row retry on error)
+# "load_data":   stream rows to a temp TSV and LOAD DATA LOCAL INFILE it
+#                (needs local_infile=ON on the server; falls back to executemany)
+INSERT_METHOD = "executemany"
+
+# Create snapshot tables with only the primary key and build the secondary
+# indexes in one ALTER TABLE after the last region commits
+DEFER_SECONDARY_INDEXES = True
+
+# Also write each chart to the normalized podcast/country/genre + chart_fact
+# schema (chart_wide view keeps the per-run table's layout)
+USE_NORMALIZED_SCHEMA = False
+
+# Per-storefront genre trees, cached on disk until the global genre tree changes
+USE_STOREFRONT_GENRES = True
 
 OUTPUT_DIR = "./documents"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -99,6 +228,35 @@ OUTPUT_IDS = os.path.join(OUTPUT_DIR, "apple_ids_from_all_genres_regions_charts.
 FAILED_REQ_LOG = os.path.join(OUTPUT_DIR, "failed_requests_charts.txt")
 FAILED_INSERTS_LOG = os.path.join(OUTPUT_DIR, "failed_inserts_charts.txt")
 CSV_OUTPUT = os.path.join(OUTPUT_DIR, "rank_comparison_charts.csv")
+COMPARISON_DIR = os.path.join(OUTPUT_DIR, "rank_comparison")
+CSV_HEADER = [
+    "appleid",
+    "title",
+    "country_code",
+    "country_name",
+    "category",
+    "subcategory",
+    "current_rank",
+    "old_rank",
+    "movement",
+]
+PARQUET_TYPES = (
+    {
+        "appleid": pyarrow.int64(),
+        "title": pyarrow.string(),
+        "country_code": pyarrow.string(),
+        "country_name": pyarrow.string(),
+        "category": pyarrow.string(),
+        "subcategory": pyarrow.string(),
+        "current_rank": pyarrow.int32(),
+        "old_rank": pyarrow.int32(),
+        "movement": pyarrow.string(),
+    }
+    if pyarrow is not None
+    else {}
+)
+GENRE_TREE_CACHE = os.path.join(OUTPUT_DIR, "storefront_genre_trees.json")
+SPOOL_DIR = os.path.join(OUTPUT_DIR, "spool")
 
 REGIONS = [
     "dz",
@@ -445,6 +603,139 @@ COUNTRY_NAMES = {
 }
 
 
+# Default headers to appear more like a regular browser
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "application/json, text/plain, */*",
+    "Referer": "https://itunes.apple.com/",
+    "Origin": "https://itunes.apple.com",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+
+# ===============================
+# ADAPTIVE RATE LIMITING
+# ===============================
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate follows AIMD (additive increase, multiplicative decrease).
+
+    Every success raises the rate by RATE_LIMIT_INCREASE / rate, i.e. roughly
+    RATE_LIMIT_INCREASE requests/sec per second of clean traffic. A throttle
+    signal (429, soft-block 404, timeout) cuts the rate by RATE_LIMIT_DECREASE,
+    at most once per refill interval so one burst of rejections counts once.
+    Waits are handed out as reservations, so the same limiter paces threads
+    (time.sleep) and asyncio tasks (asyncio.sleep) alike.
+    """
+
+    def __init__(
+        self, name, rate, max_rate, min_rate=RATE_LIMIT_MIN, burst=RATE_LIMIT_BURST
+    ):
+        self.name = name
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_cut = 0.0
+        self.successes = 0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take one token and return how long the caller must wait before sending."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + RATE_LIMIT_INCREASE / self.rate)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self.throttles += 1
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if now - self.last_cut < 1.0 / self.rate:
+                return
+            self.last_cut = now
+            old_rate = self.rate
+            self.rate = max(self.min_rate, self.rate * RATE_LIMIT_DECREASE)
+            self._refill(now)
+            self.tokens = min(self.tokens, 0.0)
+        logger.warning(
+            f"Throttled on {self.name}: rate {old_rate:.2f} -> {self.rate:.2f} req/s"
+        )
+
+
+RATE_LIMITERS = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def endpoint_class_for_url(url):
+    """Map an iTunes URL to its endpoint class: charts, lookup, genres or other."""
+    path = urlparse(url).path
+    if path.endswith("/ws/charts"):
+        return "charts"
+    if path.endswith("/ws/genres"):
+        return "genres"
+    if path.startswith("/lookup"):
+        return "lookup"
+    return "other"
+
+
+def get_rate_limiter(url):
+    """Return the shared limiter for this URL's (host, endpoint class), or None if disabled."""
+    if not USE_ADAPTIVE_RATE_LIMIT:
+        return None
+
+    endpoint = endpoint_class_for_url(url)
+    key = (urlparse(url).netloc, endpoint)
+    with _rate_limiters_lock:
+        limiter = RATE_LIMITERS.get(key)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(
+                f"{key[0]}/{endpoint}",
+                RATE_LIMIT_INITIAL.get(endpoint, 1.0),
+                RATE_LIMIT_MAX.get(endpoint, 2.0),
+            )
+            RATE_LIMITERS[key] = limiter
+        return limiter
+
+
+def log_rate_limiter_summary():
+    """Log the rate each limiter settled at"""
+    for limiter in RATE_LIMITERS.values():
+        logger.info(
+            f"Rate limiter {limiter.name}: settled at {limiter.rate:.2f} req/s "
+            f"({limiter.successes} ok, {limiter.throttles} throttled)"
+        )
+
+
 def create_robust_session():
     """Create a requests session with robust retry strategy and connection pooling."""
     logger.info("Creating robust HTTP session")
@@ -454,7 +745,12 @@ def create_robust_session():
     # Configure retry strategy
     retry_strategy = Retry(
         total=MAX_RETRIES,
-        status_forcelist=RETRY_STATUS_CODES,
+        # 429 must reach the adaptive limiter instead of being slept on inside urllib3
+        status_forcelist=(
+            [c for c in RETRY_STATUS_CODES if c != 429]
+            if USE_ADAPTIVE_RATE_LIMIT
+            else RETRY_STATUS_CODES
+        ),
         allowed_methods=["HEAD", "GET", "OPTIONS"],
         backoff_factor=BACKOFF_FACTOR,
         raise_on_status=False,
@@ -472,18 +768,7 @@ def create_robust_session():
     session.mount("https://", adapter)
 
     # Set default headers to appear more like a regular browser
-    session.headers.update(
-        {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Accept": "application/json, text/plain, */*",
-            "Referer": "https://itunes.apple.com/",
-            "Origin": "https://itunes.apple.com",
-            "Accept-Language": "en-US,en;q=0.9",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive",
-            "Upgrade-Insecure-Requests": "1",
-        }
-    )
+    session.headers.update(DEFAULT_HEADERS)
 
     logger.debug(f"HTTP session configured with {MAX_RETRIES} max retries")
     return session
@@ -496,11 +781,12 @@ def safe_request_with_backoff(session, url, context="", max_attempts=None):
 
     logger.debug(f"Starting request for {context}: {url}")
     last_exception = None
+    limiter = get_rate_limiter(url)
 
     for attempt in range(max_attempts):
         try:
-            # Add jitter to prevent thundering herd
-            if attempt > 0:
+            # Add jitter to prevent thundering herd (the adaptive limiter paces retries itself)
+            if attempt > 0 and limiter is None:
                 jitter = random.uniform(0.5, 1.5)
                 sleep_time = (BACKOFF_FACTOR**attempt) * jitter * 3
                 logger.warning(
@@ -508,6 +794,9 @@ def safe_request_with_backoff(session, url, context="", max_attempts=None):
                 )
                 time.sleep(sleep_time)
 
+            if limiter is not None:
+                limiter.acquire()
+
             response = session.get(url, timeout=REQUEST_TIMEOUT)
             logger.debug(f"Got response {response.status_code} for {context}")
 
@@ -516,6 +805,8 @@ def safe_request_with_backoff(session, url, context="", max_attempts=None):
                 try:
                     data = response.json()
                     logger.debug(f"Successfully parsed JSON response for {context}")
+                    if limiter is not None:
+                        limiter.on_success()
                     return data
                 except ValueError as e:
                     logger.error(f"Invalid JSON response for {context}: {e}")
@@ -524,6 +815,14 @@ def safe_request_with_backoff(session, url, context="", max_attempts=None):
                     )
 
             elif response.status_code == 429:
+                if limiter is not None:
+                    # Shared slowdown for every worker instead of a blind sleep here
+                    retry_after = response.headers.get("Retry-After")
+                    logger.warning(f"Rate limited for {context} - cutting request rate")
+                    limiter.on_throttle(int(retry_after) if retry_after else None)
+                    last_exception = requests.exceptions.HTTPError("HTTP 429")
+                    continue
+
                 # Rate limited - longer backoff
                 retry_after = int(response.headers.get("Retry-After", 60))
                 logger.warning(f"Rate limited for {context} - waiting {retry_after}s")
@@ -543,6 +842,8 @@ def safe_request_with_backoff(session, url, context="", max_attempts=None):
                 logger.warning(
                     f"Got 404 for {context}, treating as transient error (possible throttling)"
                 )
+                # Not a throttle signal: charts that do not exist answer 404 too,
+                # and slowing the shared limiter for them hurts every healthy chart
                 last_exception = requests.exceptions.HTTPError("HTTP 404 (transient)")
                 continue
 
@@ -570,6 +871,8 @@ def safe_request_with_backoff(session, url, context="", max_attempts=None):
                 f"Timeout for {context} (attempt {attempt + 1}/{max_attempts})"
             )
             last_exception = e
+            if limiter is not None:
+                limiter.on_throttle()
 
         except requests.exceptions.ConnectionError as e:
             logger.warning(
@@ -639,35 +942,108 @@ def sort_genres_with_podcasts_first(genres_list):
     return sorted_list
 
 
-def get_genres_for_region(all_genres_info, region):
-    """Get genre list for a region. Always include genre 26 (Podcasts) for all regions."""
-    genre_list = sort_genres_with_podcasts_first(list(all_genres_info.items()))
+def get_genres_for_region(all_genres_info, region, storefront_genre_ids=None):
+    """Get genre list for a region. Always include genre 26 (Podcasts) for all regions.
+
+    When the storefront's own genre IDs are known, only those genres are kept.
+    Names always come from the global tree so category/subcategory values stay
+    identical across regions.
+    """
+    genres = all_genres_info.items()
+    if storefront_genre_ids is not None:
+        offered = set(storefront_genre_ids) | {26}
+        genres = [(gid, info) for gid, info in genres if gid in offered]
+    genre_list = sort_genres_with_podcasts_first(list(genres))
     logger.debug(f"Generated {len(genre_list)} genres for region {region}")
     return genre_list
 
 
-def fetch_chart_ids(session, region: str, genre_id: int, limit: int) -> List[int]:
-    """Call ws/charts and return the ranked Apple IDs for the given genre."""
+def genre_tree_version(genres_data):
+    """Version of the global genre tree; storefront trees are refetched when it changes"""
+    payload = json.dumps(genres_data.get("26", {}), sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def load_genre_tree_cache(version):
+    """Load cached {region: [genre_id, ...]} storefront trees for this tree version"""
+    try:
+        with open(GENRE_TREE_CACHE, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if cache.get("version") != version:
+        logger.info("Global genre tree changed - discarding cached storefront trees")
+        return {}
+
+    trees = cache.get("trees", {})
+    logger.info(f"Loaded cached genre trees for {len(trees)} storefronts")
+    return trees
+
+
+def save_genre_tree_cache(version, trees):
+    tmp_path = GENRE_TREE_CACHE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "trees": trees}, f)
+    os.replace(tmp_path, GENRE_TREE_CACHE)
+
+
+def get_storefront_genre_ids(session, region, trees, version):
+    """Genre IDs a storefront offers, fetched once and cached; None falls back to the global tree"""
+    if region in trees:
+        return trees[region]
+
+    url = STOREFRONT_GENRES_URL_TPL.format(cc=region)
+    try:
+        data = safe_request_with_backoff(session, url, f"genres {region.upper()}")
+    except Exception as e:
+        logger.warning(f"Storefront genre tree unavailable for {region.upper()}: {e}")
+        return None
+    if not data or "26" not in data:
+        logger.warning(f"Storefront genre tree empty for {region.upper()}")
+        return None
+
+    genre_ids = sorted(collect_genre_info({"26": data["26"]}))
+    trees[region] = genre_ids
+    try:
+        save_genre_tree_cache(version, trees)
+    except OSError as e:
+        logger.warning(f"Could not save genre tree cache: {e}")
+    logger.info(f"Storefront {region.upper()} offers {len(genre_ids)} genres")
+    return genre_ids
+
+
+def chart_fetch_status(valid_ids, error=None):
+    """Classify a chart fetch as ok, empty, 404 or error for the availability matrix"""
+    if error is not None:
+        return "404" if "404" in str(error) else "error"
+    return "ok" if valid_ids else "empty"
+
+
+def fetch_chart_result(
+    session, region: str, genre_id: int, limit: int, max_attempts=None
+) -> Tuple[List[int], str]:
+    """Call ws/charts and return (ranked Apple IDs, fetch status) for the given genre."""
     url = CHARTS_URL_TPL.format(cc=region, genre_id=genre_id, limit=limit)
     context = f"charts {region.upper()}/{genre_id}"
 
     logger.debug(f"Fetching chart IDs for {context}")
 
     try:
-        data = safe_request_with_backoff(session, url, context)
+        data = safe_request_with_backoff(session, url, context, max_attempts)
         if data is None:
             logger.warning(f"No data returned for {context}")
-            return []
+            return [], "empty"
 
         ids = data.get("resultIds", [])
         valid_ids = [int(x) for x in ids if str(x).isdigit()]
 
         logger.info(f"Retrieved {len(valid_ids)} chart IDs for {context}")
-        return valid_ids
+        return valid_ids, chart_fetch_status(valid_ids)
 
     except Exception as e:
         logger.error(f"Charts fetch failed for {context}: {e}")
-        return []
+        return [], chart_fetch_status([], e)
 
 
 def batched(iterable, n):
@@ -682,13 +1058,55 @@ def batched(iterable, n):
         yield batch
 
 
+def parse_lookup_results(data) -> Dict[int, dict]:
+    """Extract title/artwork/podcast_url per Apple ID from a Lookup API response"""
+    out = {}
+    for item in data.get("results", []):
+        aid = item.get("trackId") or item.get("collectionId")
+        if not aid:
+            continue
+
+        title = (
+            item.get("collectionName")
+            or item.get("trackName")
+            or item.get("collectionCensoredName")
+            or item.get("trackCensoredName")
+            or ""
+        ).strip()
+        artwork = item.get("artworkUrl600") or item.get("artworkUrl100") or ""
+        podcast_url = item.get("trackViewUrl") or item.get("collectionViewUrl") or ""
+
+        out[int(aid)] = {
+            "title": title,
+            "artwork": artwork,
+            "podcast_url": podcast_url,
+        }
+    return out
+
+
+def split_cached_ids(cache, apple_ids, country):
+    """Return (cached metadata, IDs still to fetch) for a lookup request"""
+    if cache is None:
+        return {}, list(apple_ids)
+
+    cached = cache.get_many(country, apple_ids)
+    if METADATA_CACHE_OFFLINE:
+        to_fetch = []
+    else:
+        to_fetch = [aid for aid in apple_ids if aid not in cached]
+    logger.debug(
+        f"Metadata cache for {country}: {len(cached)} cached, {len(to_fetch)} to fetch"
+    )
+    return cached, to_fetch
+
+
 def lookup_metadata(
-    session, apple_ids: List[int], country: str, missing_ids_set: set
+    session, apple_ids: List[int], country: str, missing_ids_set: set, cache=None
 ) -> Dict[int, dict]:
-    """Lookup metadata for Apple IDs in batches"""
+    """Lookup metadata for Apple IDs in batches, serving what we can from the cache"""
     logger.debug(f"Looking up metadata for {len(apple_ids)} IDs in {country}")
 
-    out = {}
+    out, apple_ids = split_cached_ids(cache, apple_ids, country)
     consecutive_failures = 0
 
     for chunk_idx, chunk in enumerate(batched(apple_ids, 100)):
@@ -715,33 +1133,12 @@ def lookup_metadata(
             # Reset failure counter on success
             consecutive_failures = 0
 
-            found_ids = set()
-            results = data.get("results", [])
-            logger.debug(f"Got {len(results)} results for {context}")
-
-            for item in results:
-                aid = item.get("trackId") or item.get("collectionId")
-                if not aid:
-                    continue
-
-                title = (
-                    item.get("collectionName")
-                    or item.get("trackName")
-                    or item.get("collectionCensoredName")
-                    or item.get("trackCensoredName")
-                    or ""
-                ).strip()
-                artwork = item.get("artworkUrl600") or item.get("artworkUrl100") or ""
-                podcast_url = (
-                    item.get("trackViewUrl") or item.get("collectionViewUrl") or ""
-                )
-
-                out[int(aid)] = {
-                    "title": title,
-                    "artwork": artwork,
-                    "podcast_url": podcast_url,
-                }
-                found_ids.add(int(aid))
+            found = parse_lookup_results(data)
+            logger.debug(f"Got {len(found)} results for {context}")
+            out.update(found)
+            found_ids = set(found)
+            if cache is not None:
+                cache.put_many(country, found)
 
             # Track missing ones for investigation
             for aid in chunk:
@@ -762,252 +1159,2419 @@ def lookup_metadata(
     return out
 
 
-def get_last_table_name(cursor):
-    """Get the most recent chart table name"""
-    logger.debug("Fetching last table name")
-
-    cursor.execute("""
-        SELECT TABLE_NAME 
-        FROM information_schema.TABLES 
-        WHERE TABLE_SCHEMA = 'podcast_169' 
-        AND TABLE_NAME LIKE 'apple_chart_%'
-        ORDER BY TABLE_NAME DESC 
-        LIMIT 1
-    """)
-    result = cursor.fetchone()
-
-    if result:
-        logger.info(f"Found last table: {result[0]}")
-        return result[0]
-    else:
-        logger.info("No previous table found")
-        return None
-
-
-def get_previous_table_name(cursor, exclude_table):
-    """Get the previous chart table name excluding a specific table (used when resuming)."""
-    logger.debug(f"Fetching previous table name excluding {exclude_table}")
-
-    cursor.execute(
-        """
-        SELECT TABLE_NAME 
-        FROM information_schema.TABLES
-        WHERE TABLE_SCHEMA = %s
-          AND TABLE_NAME LIKE 'apple_chart_%%'
-          AND TABLE_NAME <> %s
-        ORDER BY TABLE_NAME DESC
-        LIMIT 1
-    """,
-        ("podcast_169", exclude_table),
-    )
-    row = cursor.fetchone()
-
-    if row:
-        logger.info(f"Found previous table: {row[0]}")
-        return row[0]
-    else:
-        logger.info("No previous table found")
-        return None
+# One fetched chart; unchanged=True means resultIds match the previous snapshot,
+# status is the chart_fetch_status used by the availability matrix
+ChartResult = namedtuple(
+    "ChartResult",
+    "genre_id category subcategory ids_ranked meta_map error unchanged status",
+    defaults=(False, "ok"),
+)
 
 
-def create_new_table(cursor, table_name):
-    """Create a new chart table with timestamp and optimized indexes"""
-    logger.info(f"Creating new table: {table_name}")
+def chart_fingerprint(ids_ranked) -> str:
+    """Stable fingerprint of a chart's ordered resultIds"""
+    return hashlib.sha1(",".join(str(x) for x in ids_ranked).encode()).hexdigest()
 
-    cursor.execute(f"""
-        CREATE TABLE {table_name} (
-            id int NOT NULL AUTO_INCREMENT,
-            chart_rank int DEFAULT NULL,
-            podcast_url varchar(255) DEFAULT NULL,
-            appleid BIGINT UNSIGNED DEFAULT NULL,
-            title varchar(255) DEFAULT NULL,
-            img_url varchar(255) DEFAULT NULL,
-            countryCode varchar(10) DEFAULT NULL,
-            countryName varchar(100) DEFAULT NULL,
-            category varchar(50) DEFAULT NULL,
-            subcategory varchar(255) DEFAULT NULL,
-            old_rank int DEFAULT NULL,
-            movement varchar(10) DEFAULT NULL,
-            createdTime datetime DEFAULT NULL,
-            updatedTime datetime DEFAULT NULL,
-            PRIMARY KEY (id),
-            INDEX idx_comparison (appleid, countryCode, category, subcategory),
-            INDEX idx_country (countryCode)
-        ) ENGINE=InnoDB
-    """)
 
-    logger.info(f"Successfully created table {table_name}")
+def mark_unchanged_charts(region, chart_results, prev_fingerprints):
+    """Flag charts whose fingerprint equals the previous snapshot's for the same genre"""
+    if not prev_fingerprints:
+        return chart_results
 
+    out = []
+    for res in chart_results:
+        if res.ids_ranked and prev_fingerprints.get(res.genre_id) == chart_fingerprint(
+            res.ids_ranked
+        ):
+            res = res._replace(unchanged=True)
+        out.append(res)
 
-def load_all_table_data(cursor, table):
-    """Load all data from table at once and return as dictionary"""
-    logger.info(f"Loading all data from table {table}")
+    unchanged = sum(1 for r in out if r.unchanged)
+    if unchanged:
+        logger.info(
+            f"Region {region.upper()}: {unchanged}/{len(out)} charts unchanged since last snapshot"
+        )
+    return out
 
-    cursor.execute(f"""
-        SELECT appleid, chart_rank, title, countryCode, countryName, category, 
-               COALESCE(subcategory, '') as subcategory
-        FROM {table}
-    """)
 
-    data = defaultdict(dict)
-    row_count = 0
+def dedup_region_ids(chart_results) -> List[int]:
+    """Unique Apple IDs across the region's charts that still need metadata, in first-seen order"""
+    seen = set()
+    unique_ids = []
+    for res in chart_results:
+        if res.unchanged:
+            continue
+        for aid in res.ids_ranked:
+            if aid not in seen:
+                seen.add(aid)
+                unique_ids.append(aid)
+    return unique_ids
 
-    for row in cursor.fetchall():
-        appleid, rank, title, country, country_name, category, subcategory = row
-        key = (appleid, country, category, subcategory)
-        data[key] = {"rank": rank, "title": title, "country_name": country_name}
-        row_count += 1
 
-    logger.info(f"Loaded {row_count} records from {table}")
-    return data
+def attach_region_metadata(region, chart_results, region_meta):
+    """Give each chart the slice of the region-wide lookup result it would have fetched itself"""
+    total_refs = sum(len(r.ids_ranked) for r in chart_results if not r.unchanged)
+    logger.info(
+        f"Region {region.upper()} lookup packing: {len(region_meta)} metadata rows "
+        f"served {total_refs} chart entries"
+    )
+    return [
+        res._replace(
+            meta_map={
+                aid: region_meta[aid] for aid in res.ids_ranked if aid in region_meta
+            }
+        )
+        for res in chart_results
+    ]
+
+
+def crawl_region_sync(
+    session,
+    region,
+    genre_list,
+    missing_ids_set,
+    cache=None,
+    prev_fingerprints=None,
+    probe_genres=(),
+):
+    """Fetch every chart of a region, then look up the region's deduped IDs in full batches.
+
+    Returns one ChartResult per genre, in genre_list order. Charts matching
+    prev_fingerprints ({genre_id: fingerprint}) are marked unchanged and get
+    no lookups. Genres in probe_genres are negative-cache re-probes and only
+    get CHART_PROBE_ATTEMPTS tries.
+    """
+    results = []
+    for idx, (genre_id, (category_name, subcategory_name)) in enumerate(
+        genre_list, start=1
+    ):
+        display_name = subcategory_name if subcategory_name else category_name
+        logger.debug(
+            f"[{idx}/{len(genre_list)}] {region.upper()} | {genre_id} - {display_name}"
+        )
 
+        # 1) Get ranked IDs from charts
+        attempts = CHART_PROBE_ATTEMPTS if genre_id in probe_genres else None
+        try:
+            ids_ranked, status = fetch_chart_result(
+                session, region, genre_id, CHART_LIMIT, attempts
+            )
+        except Exception as e:
+            logger.error(f"Charts error for {region}/{genre_id}: {e}")
+            results.append(
+                ChartResult(
+                    genre_id,
+                    category_name,
+                    subcategory_name,
+                    [],
+                    {},
+                    str(e),
+                    status="error",
+                )
+            )
+            continue
+
+        if not ids_ranked:
+            logger.debug(f"No chart IDs found for {region}/{genre_id}")
+
+        results.append(
+            ChartResult(
+                genre_id,
+                category_name,
+                subcategory_name,
+                ids_ranked,
+                {},
+                None,
+                status=status,
+            )
+        )
 
-def bulk_rank_comparison(cursor, last_table, current_table):
-    """Compare all ranks at once using bulk operations"""
-    logger.info("Starting bulk rank comparison")
+    results = mark_unchanged_charts(region, results, prev_fingerprints)
 
-    logger.info("Loading previous rankings...")
-    old_data = load_all_table_data(cursor, last_table)
+    # 2) Enrich with Lookup metadata: one pass over the region's unique IDs
+    unique_ids = dedup_region_ids(results)
+    try:
+        region_meta = lookup_metadata(
+            session, unique_ids, region, missing_ids_set, cache
+        )
+    except Exception as e:
+        logger.error(f"Metadata lookup error for {region}: {e}")
+        region_meta = {}
+
+    return attach_region_metadata(region, results, region_meta)
+
+
+def build_chart_rows(
+    region, category_name, subcategory_name, ids_ranked, meta_map, now, prev_ranks=None
+):
+    """Build insert tuples for one chart in the column order of insert_sql
+
+    prev_ranks is the previous snapshot's {(appleid, category, subcategory or ''): rank}
+    index for this region; without it old_rank/movement stay NULL.
+    """
+    rows = []
+    subcat_value = subcategory_name if subcategory_name else None
+    subcat_key = subcategory_name or ""
+    country_name = COUNTRY_NAMES.get(region, region.upper())
+
+    for rank, aid in enumerate(ids_ranked, start=1):
+        meta = meta_map.get(aid, {})
+        podcast_url = meta.get(
+            "podcast_url",
+            f"https://podcasts.apple.com/{region}/podcast/id{aid}",
+        )
+        title = meta.get("title", "")
+        img_url = meta.get("artwork", "")
 
-    logger.info("Loading current rankings...")
-    new_data = load_all_table_data(cursor, current_table)
+        old_rank = movement = None
+        if prev_ranks is not None:
+            old_rank = prev_ranks.get((int(aid), category_name, subcat_key))
+            movement = compute_movement(old_rank, rank)
 
-    logger.info("Computing rank changes...")
+        rows.append(
+            (
+                rank,
+                podcast_url,
+                int(aid),
+                title,
+                img_url,
+                region,
+                country_name,
+                category_name,
+                subcat_value,
+                old_rank,
+                movement,
+                now,
+                now,
+            )
+        )
+    return rows
 
-    # Prepare bulk updates and CSV data
-    bulk_updates = []
-    csv_data = []
-    stats = {"new": 0, "up": 0, "down": 0, "same": 0}
 
-    for key, new_info in new_data.items():
-        appleid, country, category, subcategory = key
-        new_rank = new_info["rank"]
-        title = new_info["title"]
-        country_name = new_info["country_name"]
+# ===============================
+# WRITE-AHEAD SPOOL
+# ===============================
+class ChartSpool:
+    """Append-only compressed JSONL spool of fetched charts and lookup results.
+
+    Each append is one gzip member / zstd frame written and fsynced in one go,
+    so a crash can at worst leave a truncated last batch, which read() skips.
+    Callers keep every batch to a single record so that a cut never separates
+    data that only makes sense together.
+    """
+
+    def __init__(self, table, directory=SPOOL_DIR, compression=SPOOL_COMPRESSION):
+        if compression == "zstd" and zstandard is None:
+            compression = "gzip"
+        self.compression = compression
+        ext = ".jsonl.zst" if compression == "zstd" else ".jsonl.gz"
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, table + ext)
+
+    def append(self, records):
+        payload = "".join(
+            json.dumps(r, separators=(",", ":"), ensure_ascii=False) + "\n"
+            for r in records
+        ).encode("utf-8")
+        if self.compression == "zstd":
+            data = zstandard.ZstdCompressor(level=3).compress(payload)
+        else:
+            data = gzip.compress(payload, compresslevel=5)
 
-        old_info = old_data.get(key)
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
 
-        if old_info is None:
-            old_rank = None
-            movement = "NEW"
-            stats["new"] += 1
+    def _open_text(self, raw):
+        if self.compression == "zstd":
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                raw, read_across_frames=True
+            )
         else:
-            old_rank = old_info["rank"]
-            diff = old_rank - new_rank
-            if diff > 0:
-                movement = f"+{diff}"
-                stats["up"] += 1
-            elif diff < 0:
-                movement = str(diff)
-                stats["down"] += 1
-            else:
-                movement = "0"
-                stats["same"] += 1
+            reader = gzip.GzipFile(fileobj=raw)
+        return io.TextIOWrapper(reader, encoding="utf-8")
 
-        # Prepare update tuple
-        subcat_for_update = subcategory if subcategory else None
-        bulk_updates.append(
-            (old_rank, movement, appleid, country, category, subcat_for_update)
+    def read(self):
+        """Yield spooled records in write order, stopping at a truncated tail"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as raw:
+            stream = self._open_text(raw)
+            try:
+                for line in stream:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping corrupt spool line in {self.path}")
+            except (EOFError, OSError) as e:
+                logger.warning(f"Spool {self.path} ends in a truncated batch: {e}")
+            except Exception as e:
+                if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                    logger.warning(f"Spool {self.path} ends in a truncated batch: {e}")
+                else:
+                    raise
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+            logger.info(f"Removed spool {self.path}")
+
+
+def spool_region(spool, region, chart_results):
+    """Spool a region's fetched charts and their lookup metadata as one record
+
+    Charts and metadata share a line, so a truncated tail drops the whole
+    batch rather than replaying charts without their titles and URLs.
+    """
+    charts = []
+    region_meta = {}
+    for res in chart_results:
+        if res.error:
+            continue
+        charts.append(
+            {
+                "genre_id": res.genre_id,
+                "category": res.category,
+                "subcategory": res.subcategory,
+                "ids": res.ids_ranked,
+                "unchanged": res.unchanged,
+                "status": res.status,
+            }
         )
+        region_meta.update(res.meta_map)
+    spool.append(
+        [{"type": "region", "region": region, "charts": charts, "meta": region_meta}]
+    )
 
-        # Prepare CSV data
-        csv_data.append(
-            (
-                appleid,
-                title,
-                country,
-                country_name,
-                category,
-                subcategory if subcategory else None,
-                new_rank,
-                old_rank,
-                movement,
+
+def load_spooled_charts(spool, checkpoints):
+    """Rebuild ChartResults from the spool for charts that never got committed"""
+    charts = {}
+    region_meta = defaultdict(dict)
+    for rec in spool.read():
+        if rec.get("type") != "region":
+            continue  # pre-batch spool format; those charts are simply refetched
+        region = rec["region"]
+        region_meta[region].update(
+            {int(aid): meta for aid, meta in rec["meta"].items()}
+        )
+        for chart in rec["charts"]:
+            if chart["genre_id"] not in checkpoints.get(region, ()):
+                charts[(region, chart["genre_id"])] = chart
+
+    pending = defaultdict(list)
+    for (region, genre_id), rec in charts.items():
+        meta = region_meta[region]
+        pending[region].append(
+            ChartResult(
+                genre_id,
+                rec["category"],
+                rec["subcategory"],
+                rec["ids"],
+                {aid: meta[aid] for aid in rec["ids"] if aid in meta},
+                None,
+                rec["unchanged"],
+                rec["status"],
             )
         )
+    return pending
 
-    logger.info(
-        f"Rank changes computed: NEW={stats['new']}, UP={stats['up']}, DOWN={stats['down']}, SAME={stats['same']}"
-    )
-
-    # OPTIMIZED: Single bulk update instead of many small ones
-    if bulk_updates:
-        logger.info(f"Updating {len(bulk_updates)} records...")
 
-        update_sql = f"""
-        UPDATE {current_table}
-        SET old_rank=%s, movement=%s
-        WHERE appleid=%s AND countryCode=%s AND category=%s
-          AND ((subcategory IS NULL AND %s IS NULL) OR subcategory=%s)
-        """
+# ===============================
+# ASYNC CRAWL ENGINE
+# ===============================
+async def async_request_with_backoff(
+    session, url, context="", max_attempts=None, slots=()
+):
+    """Async twin of safe_request_with_backoff with the same retry semantics.
+
+    `slots` are semaphores held only while the HTTP call is in flight, so
+    backoff sleeps never occupy a concurrency slot. They are acquired in the
+    order given and released in reverse; pass the per-endpoint slot before
+    the global one so requests queued on a busy endpoint hold no global slot.
+    """
+    if max_attempts is None:
+        max_attempts = MAX_RETRIES
 
-        # Process in chunks to avoid memory issues
-        chunk_size = 1000
-        total_updated = 0
+    logger.debug(f"Starting async request for {context}: {url}")
+    last_exception = None
+    limiter = get_rate_limiter(url)
 
-        for i in range(0, len(bulk_updates), chunk_size):
-            chunk = bulk_updates[i : i + chunk_size]
-            # Add subcategory twice for the SQL condition
-            chunk_with_double_subcat = []
-            for old_rank, movement, appleid, country, category, subcategory in chunk:
-                chunk_with_double_subcat.append(
-                    (
-                        old_rank,
-                        movement,
-                        appleid,
-                        country,
-                        category,
-                        subcategory,
-                        subcategory,
-                    )
+    for attempt in range(max_attempts):
+        try:
+            # Add jitter to prevent thundering herd (the adaptive limiter paces retries itself)
+            if attempt > 0 and limiter is None:
+                jitter = random.uniform(0.5, 1.5)
+                sleep_time = (BACKOFF_FACTOR**attempt) * jitter * 3
+                logger.warning(
+                    f"Retry {attempt + 1}/{max_attempts} for {context} - sleeping {sleep_time:.1f}s"
                 )
+                await asyncio.sleep(sleep_time)
 
-            cursor.executemany(update_sql, chunk_with_double_subcat)
-            total_updated += len(chunk)
+            if limiter is not None:
+                await limiter.acquire_async()
 
-            if i % 5000 == 0:
-                logger.info(
-                    f"Processed {min(i + chunk_size, len(bulk_updates))}/{len(bulk_updates)} updates"
-                )
+            held = []
+            try:
+                for slot in slots:
+                    await slot.acquire()
+                    held.append(slot)
+                async with session.get(url) as response:
+                    status = response.status
+                    logger.debug(f"Got response {status} for {context}")
+
+                    if status == 200:
+                        try:
+                            data = await response.json(content_type=None)
+                            logger.debug(
+                                f"Successfully parsed JSON response for {context}"
+                            )
+                            if limiter is not None:
+                                limiter.on_success()
+                            return data
+                        except ValueError as e:
+                            logger.error(f"Invalid JSON response for {context}: {e}")
+                            raise requests.exceptions.JSONDecodeError(
+                                f"Invalid JSON response: {e}"
+                            )
+
+                    retry_after = response.headers.get("Retry-After")
+                    body = (
+                        (await response.text())[:200]
+                        if status in [400, 401, 403]
+                        else ""
+                    )
+            finally:
+                for slot in reversed(held):
+                    slot.release()
+
+            if status == 429:
+                if limiter is not None:
+                    # Shared slowdown for every task instead of a blind sleep here
+                    logger.warning(f"Rate limited for {context} - cutting request rate")
+                    limiter.on_throttle(int(retry_after) if retry_after else None)
+                    last_exception = requests.exceptions.HTTPError("HTTP 429")
+                    continue
 
-        logger.info(f"Successfully updated {total_updated} records")
+                # Rate limited - longer backoff
+                retry_after = int(retry_after or 60)
+                logger.warning(f"Rate limited for {context} - waiting {retry_after}s")
+                await asyncio.sleep(retry_after)
+                continue
 
-    return csv_data
+            elif status in [500, 502, 503, 504]:
+                # Server errors - retry with backoff
+                logger.warning(f"Server error {status} for {context}")
+                last_exception = requests.exceptions.HTTPError(f"HTTP {status}")
+                continue
 
+            elif status == 404:
+                # Apple sometimes sends 404 instead of 429 (soft block)
+                logger.warning(
+                    f"Got 404 for {context}, treating as transient error (possible throttling)"
+                )
+                # Not a throttle signal: charts that do not exist answer 404 too,
+                # and slowing the shared limiter for them hurts every healthy chart
+                last_exception = requests.exceptions.HTTPError("HTTP 404 (transient)")
+                continue
 
-def batch_insert_podcasts(cursor, insert_sql, batch_data, failed_inserts):
-    """Insert podcast data in batches for better performance"""
-    logger.info(f"Starting batch insert of {len(batch_data)} records")
+            elif status in [400, 401, 403]:
+                # Client errors - don't retry
+                logger.error(f"Client error {status} for {context}: {body}")
+                raise requests.exceptions.HTTPError(f"HTTP {status}: {body}")
 
-    chunk_size = 500
-    total_inserted = 0
+            else:
+                # Other status codes
+                logger.warning(f"Unexpected status {status} for {context}")
+                last_exception = requests.exceptions.HTTPError(f"HTTP {status}")
+                continue
 
-    for i in range(0, len(batch_data), chunk_size):
-        chunk = batch_data[i : i + chunk_size]
-        try:
-            cursor.executemany(insert_sql, chunk)
-            total_inserted += len(chunk)
+        except asyncio.TimeoutError as e:
+            logger.warning(
+                f"Timeout for {context} (attempt {attempt + 1}/{max_attempts})"
+            )
+            last_exception = requests.exceptions.Timeout(str(e) or "timeout")
+            if limiter is not None:
+                limiter.on_throttle()
 
-            if i % 2000 == 0 and i > 0:
-                logger.info(f"Inserted {total_inserted} records so far...")
+        except aiohttp.ClientConnectionError as e:
+            logger.warning(
+                f"Connection error for {context} (attempt {attempt + 1}/{max_attempts}): {str(e)[:100]}"
+            )
+            last_exception = requests.exceptions.ConnectionError(str(e))
 
-        except mysql.connector.Error as err:
-            logger.error(f"Batch insert failed: {err}")
-            # Handle individual failures if needed
-            for single_record in chunk:
-                try:
-                    cursor.execute(insert_sql, single_record)
-                    total_inserted += 1
-                except mysql.connector.Error as single_err:
-                    logger.error(f"Individual insert failed: {single_err}")
-                    failed_inserts.append(f"Individual insert failed: {single_err}")
+        except requests.exceptions.HTTPError as e:
+            logger.error(
+                f"HTTP error for {context} (attempt {attempt + 1}/{max_attempts}): {e}"
+            )
+            last_exception = e
 
-    logger.info(f"Batch insert completed: {total_inserted} records inserted")
-    return total_inserted
+        except (aiohttp.ClientError, requests.exceptions.RequestException) as e:
+            logger.error(
+                f"Request error for {context} (attempt {attempt + 1}/{max_attempts}): {e}"
+            )
+            last_exception = e
 
+        except Exception as e:
+            logger.error(
+                f"Unexpected error for {context} (attempt {attempt + 1}/{max_attempts}): {e}"
+            )
+            last_exception = e
 
-# ===============================
-# MAIN
-# ===============================
+    # All attempts failed
+    logger.error(f"All {max_attempts} attempts failed for {context}")
+    if last_exception:
+        raise last_exception
+    else:
+        raise requests.exceptions.RequestException(
+            f"All {max_attempts} attempts failed for {context}"
+        )
+
+
+class AsyncChartCrawler:
+    """Fan out a region's chart fetches, then its packed lookup batches, on one event loop.
+
+    A global semaphore caps all in-flight requests and one semaphore per
+    endpoint ("charts", "lookup", "genres") caps each API separately. The
+    loop and aiohttp session live for the whole run so connections are reused
+    across regions.
+    """
+
+    def __init__(
+        self, max_concurrency=MAX_CONCURRENCY, endpoint_limits=None, cache=None
+    ):
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.endpoint_limits = dict(endpoint_limits or ENDPOINT_CONCURRENCY)
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        self._global_slot = None
+        self._endpoint_slots = {}
+
+    async def _ensure_session(self):
+        if self.session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=REQUEST_TIMEOUT[0], sock_read=REQUEST_TIMEOUT[1]
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=timeout, headers=DEFAULT_HEADERS
+        )
+        self._global_slot = asyncio.Semaphore(self.max_concurrency)
+        self._endpoint_slots = {
+            name: asyncio.Semaphore(limit)
+            for name, limit in self.endpoint_limits.items()
+        }
+        logger.info(
+            f"Async crawler ready: {self.max_concurrency} global slots, "
+            f"per-endpoint {self.endpoint_limits}"
+        )
+
+    async def _get_json(self, endpoint, url, context, max_attempts=None):
+        # Endpoint slot first: a chart backlog must not sit on global slots
+        # that lookups need
+        slots = [self._global_slot]
+        if endpoint in self._endpoint_slots:
+            slots.insert(0, self._endpoint_slots[endpoint])
+        return await async_request_with_backoff(
+            self.session, url, context, max_attempts, slots=slots
+        )
+
+    async def fetch_chart_result(self, region, genre_id, limit, max_attempts=None):
+        """Async fetch_chart_result: (ranked Apple IDs, fetch status) for one chart."""
+        url = CHARTS_URL_TPL.format(cc=region, genre_id=genre_id, limit=limit)
+        context = f"charts {region.upper()}/{genre_id}"
+
+        try:
+            data = await self._get_json("charts", url, context, max_attempts)
+            if data is None:
+                logger.warning(f"No data returned for {context}")
+                return [], "empty"
+
+            ids = data.get("resultIds", [])
+            valid_ids = [int(x) for x in ids if str(x).isdigit()]
+
+            logger.info(f"Retrieved {len(valid_ids)} chart IDs for {context}")
+            return valid_ids, chart_fetch_status(valid_ids)
+
+        except Exception as e:
+            logger.error(f"Charts fetch failed for {context}: {e}")
+            return [], chart_fetch_status([], e)
+
+    async def _lookup_chunk(self, chunk, country):
+        ids_str = ",".join(str(x) for x in chunk)
+        url = LOOKUP_URL_TPL.format(ids=ids_str, country=country)
+        context = f"lookup {country}/{len(chunk)} IDs"
+        try:
+            data = await self._get_json("lookup", url, context)
+        except Exception as e:
+            logger.error(f"Lookup failed for {context}: {e}")
+            return chunk, None
+        return chunk, parse_lookup_results(data) if data is not None else None
+
+    async def lookup_metadata(self, apple_ids, country, missing_ids_set):
+        """Async lookup_metadata: all 100-ID batches of a list run concurrently."""
+        out, apple_ids = split_cached_ids(self.cache, apple_ids, country)
+        failures = 0
+        chunks = list(batched(apple_ids, 100))
+        results = await asyncio.gather(
+            *(self._lookup_chunk(chunk, country) for chunk in chunks)
+        )
+
+        for chunk, found in results:
+            if found is None:
+                failures += 1
+                continue
+            out.update(found)
+            if self.cache is not None:
+                self.cache.put_many(country, found)
+            for aid in chunk:
+                if aid not in found:
+                    missing_ids_set.add((country, aid))
+                    logger.debug(f"Missing metadata for ID {aid} in {country}")
+
+        if failures:
+            logger.warning(
+                f"{failures}/{len(chunks)} lookup batches failed for {country}"
+            )
+        logger.info(f"Total metadata retrieved for {country}: {len(out)} items")
+        return out
+
+    async def _crawl_region(
+        self, region, genre_list, missing_ids_set, prev_fingerprints, probe_genres
+    ):
+        await self._ensure_session()
+        results = await asyncio.gather(
+            *(
+                self.fetch_chart_result(
+                    region,
+                    genre_id,
+                    CHART_LIMIT,
+                    CHART_PROBE_ATTEMPTS if genre_id in probe_genres else None,
+                )
+                for genre_id, _ in genre_list
+            ),
+            return_exceptions=True,
+        )
+
+        out = []
+        for (genre_id, (category_name, subcategory_name)), res in zip(
+            genre_list, results
+        ):
+            if isinstance(res, Exception):
+                logger.error(f"Charts error for {region}/{genre_id}: {res}")
+                out.append(
+                    ChartResult(
+                        genre_id,
+                        category_name,
+                        subcategory_name,
+                        [],
+                        {},
+                        str(res),
+                        status="error",
+                    )
+                )
+            else:
+                ids_ranked, status = res
+                if not ids_ranked:
+                    logger.debug(f"No chart IDs found for {region}/{genre_id}")
+                out.append(
+                    ChartResult(
+                        genre_id,
+                        category_name,
+                        subcategory_name,
+                        ids_ranked,
+                        {},
+                        None,
+                        status=status,
+                    )
+                )
+
+        out = mark_unchanged_charts(region, out, prev_fingerprints)
+
+        # Region-wide lookup stage: dedup across charts, pack into full batches
+        unique_ids = dedup_region_ids(out)
+        try:
+            region_meta = await self.lookup_metadata(
+                unique_ids, region, missing_ids_set
+            )
+        except Exception as e:
+            logger.error(f"Metadata lookup error for {region}: {e}")
+            region_meta = {}
+
+        return attach_region_metadata(region, out, region_meta)
+
+    def crawl_region(
+        self,
+        region,
+        genre_list,
+        missing_ids_set,
+        prev_fingerprints=None,
+        probe_genres=(),
+    ):
+        """Same contract as crawl_region_sync, but all genres run concurrently."""
+        return self.loop.run_until_complete(
+            self._crawl_region(
+                region, genre_list, missing_ids_set, prev_fingerprints, probe_genres
+            )
+        )
+
+    def crawl_regions(
+        self, planned, missing_ids_set, prev_fingerprints, depth=REGION_PIPELINE_DEPTH
+    ):
+        """Crawl (region, genre_list, probe_genres) plans with up to depth regions in flight
+
+        Yields (region, chart_results) in plan order. The regions share the
+        global and per-endpoint semaphores, so one region's lookup tail and
+        retries overlap the next regions' chart fetches instead of idling the
+        slots. The next plan is only pulled once a region has been handed
+        back, which bounds the crawl's lead over the caller.
+        """
+        self.loop.run_until_complete(self._ensure_session())
+        planned = iter(planned)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < depth:
+                    plan = next(planned, None)
+                    if plan is None:
+                        break
+                    region, genre_list, probe_genres = plan
+                    task = self.loop.create_task(
+                        self._crawl_region(
+                            region,
+                            genre_list,
+                            missing_ids_set,
+                            prev_fingerprints.get(region),
+                            probe_genres,
+                        )
+                    )
+                    pending.append((region, task))
+                if not pending:
+                    return
+                region, task = pending.popleft()
+                yield region, self.loop.run_until_complete(task)
+        finally:
+            for _, task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(
+                    asyncio.gather(
+                        *(task for _, task in pending), return_exceptions=True
+                    )
+                )
+
+    def close(self):
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+            self.session = None
+        self.loop.close()
+
+
+def create_fingerprint_table(cursor):
+    """Create the per-chart resultIds fingerprint table if it does not exist"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} (
+            snapshot_table varchar(64) NOT NULL,
+            countryCode varchar(10) NOT NULL,
+            genre_id int NOT NULL,
+            fingerprint char(40) NOT NULL,
+            id_count int NOT NULL,
+            PRIMARY KEY (snapshot_table, countryCode, genre_id)
+        ) ENGINE=InnoDB
+    """)
+
+
+def load_chart_fingerprints(cursor, table):
+    """Load {region: {genre_id: fingerprint}} stored with a snapshot table"""
+    cursor.execute(
+        f"""
+        SELECT countryCode, genre_id, fingerprint
+        FROM {FINGERPRINT_TABLE}
+        WHERE snapshot_table = %s
+    """,
+        (table,),
+    )
+    fingerprints = defaultdict(dict)
+    for region, genre_id, fingerprint in cursor.fetchall():
+        fingerprints[region][genre_id] = fingerprint
+
+    logger.info(
+        f"Loaded {sum(len(v) for v in fingerprints.values())} chart fingerprints from {table}"
+    )
+    return fingerprints
+
+
+def save_chart_fingerprints(cursor, table, region, chart_fingerprints):
+    """Store (genre_id, fingerprint, id_count) rows for one region of a snapshot"""
+    if not chart_fingerprints:
+        return
+    cursor.executemany(
+        f"""
+        REPLACE INTO {FINGERPRINT_TABLE}
+        (snapshot_table, countryCode, genre_id, fingerprint, id_count)
+        VALUES (%s,%s,%s,%s,%s)
+    """,
+        [
+            (table, region, genre_id, fingerprint, id_count)
+            for genre_id, fingerprint, id_count in chart_fingerprints
+        ],
+    )
+
+
+def copy_forward_chart(
+    cursor, previous_table, current_table, region, category, subcategory, now
+):
+    """Copy an unchanged chart's rows from the previous snapshot with movement '0'"""
+    cursor.execute(
+        f"""
+        INSERT INTO {current_table}
+        (chart_rank, podcast_url, appleid, title, img_url, countryCode, countryName,
+         category, subcategory, old_rank, movement, createdTime, updatedTime)
+        SELECT chart_rank, podcast_url, appleid, title, img_url, countryCode, countryName,
+               category, subcategory, chart_rank, '0', %s, %s
+        FROM {previous_table}
+        WHERE countryCode = %s AND category = %s AND subcategory_key = %s
+    """,
+        (now, now, region, category, subcategory or ""),
+    )
+    return cursor.rowcount
+
+
+def create_availability_table(cursor):
+    """Create the (region, genre) chart availability matrix if it does not exist"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {AVAILABILITY_TABLE} (
+            countryCode varchar(10) NOT NULL,
+            genre_id int NOT NULL,
+            empty_streak int NOT NULL DEFAULT 0,
+            missing_streak int NOT NULL DEFAULT 0,
+            last_status varchar(10) DEFAULT NULL,
+            last_checked datetime DEFAULT NULL,
+            last_nonempty datetime DEFAULT NULL,
+            PRIMARY KEY (countryCode, genre_id)
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+          AND COLUMN_NAME = 'missing_streak'
+    """,
+        (AVAILABILITY_TABLE,),
+    )
+    if not cursor.fetchone()[0]:
+        logger.info(f"Adding missing_streak to {AVAILABILITY_TABLE}")
+        cursor.execute(f"""
+            ALTER TABLE {AVAILABILITY_TABLE}
+            ADD COLUMN missing_streak int NOT NULL DEFAULT 0 AFTER empty_streak
+        """)
+
+
+def load_chart_availability(cursor):
+    """Load {(region, genre_id): (empty_streak, missing_streak, last_checked)} from the availability matrix"""
+    cursor.execute(f"""
+        SELECT countryCode, genre_id, empty_streak, missing_streak, last_checked
+        FROM {AVAILABILITY_TABLE}
+    """)
+    availability = {
+        (region, genre_id): (empty_streak, missing_streak, last_checked)
+        for region, genre_id, empty_streak, missing_streak, last_checked in cursor.fetchall()
+    }
+    known_empty = sum(
+        1 for streak, _, _ in availability.values() if streak >= NEGATIVE_CACHE_STREAK
+    )
+    known_missing = sum(
+        1
+        for _, streak, _ in availability.values()
+        if streak >= NEGATIVE_CACHE_404_STREAK
+    )
+    logger.info(
+        f"Loaded availability for {len(availability)} charts ({known_empty} known empty, "
+        f"{known_missing} known 404)"
+    )
+    return availability
+
+
+def plan_region_genres(region, genre_list, availability, now):
+    """Drop known-empty and known-404 charts from a region's genre list unless a re-probe is due.
+
+    Returns (genres to fetch, genre_ids being re-probed, genre_ids skipped).
+    """
+    to_fetch, probe_genres, skipped = [], set(), []
+
+    for genre in genre_list:
+        empty_streak, missing_streak, last_checked = availability.get(
+            (region, genre[0]), (0, 0, None)
+        )
+        if missing_streak >= NEGATIVE_CACHE_404_STREAK:
+            reprobe_after = datetime.timedelta(days=NEGATIVE_CACHE_404_REPROBE_DAYS)
+        elif empty_streak >= NEGATIVE_CACHE_STREAK:
+            reprobe_after = datetime.timedelta(days=NEGATIVE_CACHE_REPROBE_DAYS)
+        else:
+            to_fetch.append(genre)
+            continue
+        if last_checked is None or now - last_checked >= reprobe_after:
+            to_fetch.append(genre)
+            probe_genres.add(genre[0])
+        else:
+            skipped.append(genre[0])
+
+    if skipped or probe_genres:
+        logger.info(
+            f"Region {region.upper()}: skipping {len(skipped)} known-empty/404 charts, "
+            f"re-probing {len(probe_genres)}"
+        )
+    return to_fetch, probe_genres, skipped
+
+
+def record_chart_availability(cursor, region, chart_results, now):
+    """Update the availability matrix from this run's fetch statuses.
+
+    empty extends empty_streak (once per day, so same-day resumes do not
+    double count) and ok resets it. A 404 that survived the retries extends
+    missing_streak instead, on every run: a failed chart blocks the snapshot
+    and is retried by the next run, so a chart that really is gone must reach
+    NEGATIVE_CACHE_404_STREAK quickly. Any other outcome resets
+    missing_streak, and transient errors leave both untouched.
+    """
+    rows = [
+        (
+            region,
+            res.genre_id,
+            1 if res.status == "empty" else 0,
+            1 if res.status == "404" else 0,
+            res.status,
+            now,
+        )
+        for res in chart_results
+        if res.status in ("ok", "empty", "404")
+    ]
+    if not rows:
+        return
+
+    cursor.executemany(
+        f"""
+        INSERT INTO {AVAILABILITY_TABLE}
+        (countryCode, genre_id, empty_streak, missing_streak, last_status, last_checked)
+        VALUES (%s,%s,%s,%s,%s,%s)
+        ON DUPLICATE KEY UPDATE
+            empty_streak = CASE VALUES(last_status)
+                WHEN 'ok' THEN 0
+                WHEN 'empty' THEN IF(
+                    last_checked IS NULL OR DATE(last_checked) < DATE(VALUES(last_checked)),
+                    empty_streak + 1, empty_streak)
+                ELSE empty_streak END,
+            missing_streak = IF(VALUES(last_status) = '404', missing_streak + 1, 0),
+            last_nonempty = IF(VALUES(last_status) = 'ok', VALUES(last_checked), last_nonempty),
+            last_status = VALUES(last_status),
+            last_checked = VALUES(last_checked)
+    """,
+        rows,
+    )
+
+
+Snapshot = namedtuple(
+    "Snapshot", "snapshot_id table status regions_done baseline_snapshot_id"
+)
+
+
+def create_snapshot_catalog(cursor):
+    """Create chart_snapshots; every lookup on it is a primary key or (status, id) index probe"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SNAPSHOT_CATALOG} (
+            snapshot_id bigint unsigned NOT NULL,
+            table_or_partition varchar(64) NOT NULL,
+            started_at datetime NOT NULL,
+            completed_at datetime DEFAULT NULL,
+            regions_done smallint unsigned NOT NULL DEFAULT 0,
+            `rows` int unsigned NOT NULL DEFAULT 0,
+            status enum('running', 'complete', 'failed') NOT NULL DEFAULT 'running',
+            baseline_snapshot_id bigint unsigned DEFAULT NULL,
+            PRIMARY KEY (snapshot_id),
+            INDEX idx_status (status, snapshot_id)
+        ) ENGINE=InnoDB
+    """)
+
+
+def bootstrap_snapshot_catalog(cursor):
+    """Register existing apple_chart_* tables once, when the catalog is still empty"""
+    cursor.execute(f"SELECT 1 FROM {SNAPSHOT_CATALOG} LIMIT 1")
+    if cursor.fetchone():
+        return 0
+
+    cursor.execute("""
+        SELECT TABLE_NAME FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE 'apple_chart\\_%'
+    """)
+    tables = sorted(
+        row[0] for row in cursor.fetchall() if snapshot_id_for_table(row[0])
+    )
+    logger.info(f"Bootstrapping {SNAPSHOT_CATALOG} from {len(tables)} existing tables")
+    baseline = None
+    for table in tables:
+        cursor.execute(f"SELECT COUNT(DISTINCT countryCode), COUNT(*) FROM {table}")
+        regions_done, row_count = cursor.fetchone()
+        complete = regions_done == len(REGIONS)
+        snapshot_id = snapshot_id_for_table(table)
+        cursor.execute(
+            f"""
+            INSERT IGNORE INTO {SNAPSHOT_CATALOG}
+            (snapshot_id, table_or_partition, started_at, completed_at, regions_done,
+             `rows`, status, baseline_snapshot_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+            (
+                snapshot_id,
+                table,
+                datetime.datetime.strptime(str(snapshot_id), "%Y%m%d%H%M%S"),
+                (
+                    datetime.datetime.strptime(str(snapshot_id), "%Y%m%d%H%M%S")
+                    if complete
+                    else None
+                ),
+                regions_done,
+                row_count,
+                "complete" if complete else "running",
+                baseline,
+            ),
+        )
+        if complete:
+            baseline = snapshot_id
+    return len(tables)
+
+
+def _snapshot_row(cursor):
+    row = cursor.fetchone()
+    return Snapshot(*row) if row else None
+
+
+def get_latest_snapshot(cursor):
+    """Newest catalogued snapshot, whatever its status"""
+    cursor.execute(f"""
+        SELECT snapshot_id, table_or_partition, status, regions_done, baseline_snapshot_id
+        FROM {SNAPSHOT_CATALOG} ORDER BY snapshot_id DESC LIMIT 1
+    """)
+    return _snapshot_row(cursor)
+
+
+def get_baseline_snapshot(cursor, before_snapshot_id=None):
+    """Newest complete snapshot older than before_snapshot_id (the comparison baseline)"""
+    cursor.execute(
+        f"""
+        SELECT snapshot_id, table_or_partition, status, regions_done, baseline_snapshot_id
+        FROM {SNAPSHOT_CATALOG}
+        WHERE status = 'complete' AND snapshot_id < %s
+        ORDER BY snapshot_id DESC LIMIT 1
+    """,
+        (before_snapshot_id or 99999999999999,),
+    )
+    return _snapshot_row(cursor)
+
+
+def get_snapshot(cursor, snapshot_id):
+    cursor.execute(
+        f"""
+        SELECT snapshot_id, table_or_partition, status, regions_done, baseline_snapshot_id
+        FROM {SNAPSHOT_CATALOG} WHERE snapshot_id = %s
+    """,
+        (snapshot_id,),
+    )
+    return _snapshot_row(cursor)
+
+
+def register_snapshot(cursor, table, started_at, baseline_table=None):
+    """Catalog a new snapshot as running (idempotent, keeps progress when resuming)"""
+    baseline_id = snapshot_id_for_table(baseline_table) if baseline_table else None
+    cursor.execute(
+        f"""
+        INSERT INTO {SNAPSHOT_CATALOG}
+        (snapshot_id, table_or_partition, started_at, status, baseline_snapshot_id)
+        VALUES (%s, %s, %s, 'running', %s)
+        ON DUPLICATE KEY UPDATE baseline_snapshot_id = VALUES(baseline_snapshot_id)
+    """,
+        (snapshot_id_for_table(table), table, started_at, baseline_id),
+    )
+
+
+def refresh_snapshot_progress(cursor, table):
+    """Update regions_done/rows from the plan and checkpoints of this snapshot; returns regions_done
+
+    A region is done once it has a plan and every planned chart has a
+    checkpoint, so a chart that failed keeps the snapshot unpublished until a
+    rerun retries it. Reads only this snapshot's slice of the plan and
+    checkpoint primary keys, never the snapshot table itself.
+    """
+    cursor.execute(
+        f"""
+        SELECT COUNT(*) FROM (
+            SELECT p.countryCode
+            FROM {PLAN_TABLE} p
+            LEFT JOIN {CHECKPOINT_TABLE} c
+              ON c.snapshot_table = p.snapshot_table
+             AND c.countryCode = p.countryCode
+             AND c.genre_id = p.genre_id
+            WHERE p.snapshot_table = %s
+            GROUP BY p.countryCode
+            HAVING COUNT(c.genre_id) = COUNT(*)
+        ) done
+    """,
+        (table,),
+    )
+    regions_done = cursor.fetchone()[0]
+    cursor.execute(
+        f"SELECT COALESCE(SUM(row_count), 0) FROM {CHECKPOINT_TABLE} WHERE snapshot_table = %s",
+        (table,),
+    )
+    row_count = cursor.fetchone()[0]
+    cursor.execute(
+        f"""
+        UPDATE {SNAPSHOT_CATALOG} SET regions_done = %s, `rows` = %s
+        WHERE snapshot_id = %s
+    """,
+        (regions_done, row_count, snapshot_id_for_table(table)),
+    )
+    return regions_done
+
+
+def complete_snapshot(cursor, table):
+    cursor.execute(
+        f"""
+        UPDATE {SNAPSHOT_CATALOG} SET status = 'complete', completed_at = NOW()
+        WHERE snapshot_id = %s
+    """,
+        (snapshot_id_for_table(table),),
+    )
+
+
+def fail_stale_snapshots(cursor, keep_table=None):
+    """Fail abandoned snapshots and drop their staging tables; returns how many were dropped
+
+    A run that dies before publish_snapshot leaves a 'running' catalog row and
+    a staging_apple_chart_* table behind. Only keep_table (today's snapshot)
+    can still be resumed; every other running snapshot is marked failed, and
+    staging tables are dropped with their checkpoints and plan. Partially
+    loaded tables that were never staged stay in place.
+    """
+    cursor.execute(
+        f"""
+        SELECT snapshot_id, table_or_partition FROM {SNAPSHOT_CATALOG}
+        WHERE status = 'running' AND table_or_partition <> %s
+    """,
+        (keep_table or "",),
+    )
+    stale = cursor.fetchall()
+    cursor.execute("""
+        SELECT TABLE_NAME FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE 'staging\\_apple\\_chart\\_%'
+    """)
+    staging = {row[0] for row in cursor.fetchall()} - {keep_table}
+    staging.update(table for _, table in stale if table.startswith(STAGING_PREFIX))
+
+    bookkeeping = [CHECKPOINT_TABLE, PLAN_TABLE]
+    if USE_CHART_FINGERPRINTS and table_exists(cursor, FINGERPRINT_TABLE):
+        bookkeeping.append(FINGERPRINT_TABLE)
+    for table in sorted(staging):
+        logger.warning(f"Dropping abandoned staging table {table}")
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        for bk_table in bookkeeping:
+            cursor.execute(
+                f"DELETE FROM {bk_table} WHERE snapshot_table = %s", (table,)
+            )
+    for snapshot_id, table in stale:
+        logger.warning(f"Marking abandoned snapshot {table} as failed")
+        cursor.execute(
+            f"UPDATE {SNAPSHOT_CATALOG} SET status = 'failed' WHERE snapshot_id = %s",
+            (snapshot_id,),
+        )
+    return len(staging)
+
+
+def staging_table_name(table):
+    return f"{STAGING_PREFIX}{table}" if LOAD_VIA_STAGING else table
+
+
+def published_table_name(table):
+    return table[len(STAGING_PREFIX) :] if table.startswith(STAGING_PREFIX) else table
+
+
+def table_exists(cursor, table):
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """,
+        (table,),
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def publish_snapshot(cursor, load_table, table):
+    """Make a fully loaded snapshot visible under its apple_chart_* name and in chart_latest
+
+    RENAME TABLE swaps the staging table in atomically, so readers never see
+    a half-loaded snapshot. Bookkeeping written under the staging name is
+    re-keyed afterwards; rerunning this after a crash finishes the job.
+    """
+    if load_table != table:
+        if table_exists(cursor, load_table):
+            cursor.execute(f"RENAME TABLE {load_table} TO {table}")
+            logger.info(f"Published {load_table} as {table}")
+        bookkeeping = [CHECKPOINT_TABLE, PLAN_TABLE]
+        if USE_CHART_FINGERPRINTS:
+            bookkeeping.append(FINGERPRINT_TABLE)
+        for bk_table in bookkeeping:
+            cursor.execute(
+                f"UPDATE {bk_table} SET snapshot_table = %s WHERE snapshot_table = %s",
+                (table, load_table),
+            )
+    cursor.execute(
+        f"UPDATE {SNAPSHOT_CATALOG} SET table_or_partition = %s WHERE snapshot_id = %s",
+        (table, snapshot_id_for_table(table)),
+    )
+    complete_snapshot(cursor, table)
+    cursor.execute(f"CREATE OR REPLACE VIEW {LATEST_VIEW} AS SELECT * FROM {table}")
+
+
+def create_checkpoint_table(cursor):
+    """Create the per-chart checkpoint and plan tables if they do not exist"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+            snapshot_table varchar(64) NOT NULL,
+            countryCode varchar(10) NOT NULL,
+            genre_id int NOT NULL,
+            row_count int NOT NULL,
+            completed_at datetime NOT NULL,
+            PRIMARY KEY (snapshot_table, countryCode, genre_id)
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PLAN_TABLE} (
+            snapshot_table varchar(64) NOT NULL,
+            countryCode varchar(10) NOT NULL,
+            genre_id int NOT NULL,
+            PRIMARY KEY (snapshot_table, countryCode, genre_id)
+        ) ENGINE=InnoDB
+    """)
+
+
+def save_region_plan(cursor, table, region, genre_ids):
+    """Replace the set of charts a region is expected to produce in this snapshot"""
+    cursor.execute(
+        f"DELETE FROM {PLAN_TABLE} WHERE snapshot_table = %s AND countryCode = %s",
+        (table, region),
+    )
+    cursor.executemany(
+        f"INSERT INTO {PLAN_TABLE} (snapshot_table, countryCode, genre_id) VALUES (%s,%s,%s)",
+        [(table, region, genre_id) for genre_id in sorted(set(genre_ids))],
+    )
+
+
+def load_checkpoints(cursor, table):
+    """Load {region: {genre_id, ...}} of charts already committed into a snapshot"""
+    cursor.execute(
+        f"SELECT countryCode, genre_id FROM {CHECKPOINT_TABLE} WHERE snapshot_table = %s",
+        (table,),
+    )
+    checkpoints = defaultdict(set)
+    for region, genre_id in cursor.fetchall():
+        checkpoints[region].add(genre_id)
+    return checkpoints
+
+
+def chart_checkpoint_rows(cursor, table, region, genre_id):
+    """row_count of a chart's checkpoint, or None if the chart is not committed"""
+    cursor.execute(
+        f"""
+        SELECT row_count FROM {CHECKPOINT_TABLE}
+        WHERE snapshot_table = %s AND countryCode = %s AND genre_id = %s
+    """,
+        (table, region, genre_id),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def save_chart_checkpoint(cursor, table, region, genre_id, row_count):
+    cursor.execute(
+        f"""
+        REPLACE INTO {CHECKPOINT_TABLE}
+        (snapshot_table, countryCode, genre_id, row_count, completed_at)
+        VALUES (%s,%s,%s,%s,NOW())
+    """,
+        (table, region, genre_id, row_count),
+    )
+
+
+def write_chart(
+    cursor,
+    insert_sql,
+    current_table,
+    previous_table,
+    region,
+    res,
+    rows,
+    now,
+    failed_inserts,
+    dims=None,
+):
+    """Write one chart idempotently: replace its rows, fingerprint and checkpoint.
+
+    The caller commits, so the rows and the checkpoint land in one transaction
+    and a chart is either fully recorded or not at all.
+    """
+    min_id = 0
+    if DEFER_SECONDARY_INDEXES:
+        # No idx_chart_key yet, and nothing to replace: rows only ever commit
+        # with their checkpoint, and checkpointed charts are never rewritten.
+        # The fact fill below only scans rows above the current maximum id.
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {current_table}")
+        min_id = cursor.fetchone()[0]
+    else:
+        cursor.execute(
+            f"""
+            DELETE FROM {current_table}
+            WHERE countryCode = %s AND category = %s AND subcategory_key = %s
+        """,
+            (region, res.category, res.subcategory or ""),
+        )
+
+    if res.unchanged:
+        inserted = copy_forward_chart(
+            cursor,
+            previous_table,
+            current_table,
+            region,
+            res.category,
+            res.subcategory,
+            now,
+        )
+        if inserted != len(res.ids_ranked):
+            logger.warning(
+                f"Copy-forward for {region}/{res.genre_id} moved {inserted} rows, "
+                f"expected {len(res.ids_ranked)}"
+            )
+    elif rows:
+        inserted = insert_chart_rows(
+            cursor, insert_sql, current_table, rows, failed_inserts
+        )
+    else:
+        inserted = 0
+
+    if dims is not None:
+        dims.write_chart(
+            cursor,
+            current_table,
+            region,
+            COUNTRY_NAMES.get(region, region.upper()),
+            int(res.genre_id),
+            res.category,
+            res.subcategory,
+            [(row[2], row[3], row[4], row[1]) for row in rows],
+            now,
+            min_id,
+            replace=not DEFER_SECONDARY_INDEXES,
+        )
+
+    if USE_CHART_FINGERPRINTS and res.ids_ranked:
+        save_chart_fingerprints(
+            cursor,
+            current_table,
+            region,
+            [(res.genre_id, chart_fingerprint(res.ids_ranked), len(res.ids_ranked))],
+        )
+    save_chart_checkpoint(cursor, current_table, region, res.genre_id, inserted)
+    return inserted
+
+
+def commit_chart(
+    db,
+    cursor,
+    insert_sql,
+    current_table,
+    previous_table,
+    region,
+    res,
+    now,
+    failed_inserts,
+    prev_ranks=None,
+    dims=None,
+):
+    """Build a chart's rows, write it and commit; returns rows written or None on failure
+
+    Deadlocks and lock wait timeouts are retried. A lost connection is
+    re-raised (as OperationalError/InterfaceError) so the caller can
+    reconnect and resubmit the chart; the COMMIT may still have landed, so
+    check chart_checkpoint_rows() first.
+    """
+    rows = []
+    if not res.unchanged:
+        # Unchanged charts are copied forward in SQL instead
+        rows = build_chart_rows(
+            region,
+            res.category,
+            res.subcategory,
+            res.ids_ranked,
+            res.meta_map,
+            now,
+            prev_ranks,
+        )
+
+    for attempt in range(1, DB_CONNECT_ATTEMPTS + 1):
+        try:
+            inserted = write_chart(
+                cursor,
+                insert_sql,
+                current_table,
+                previous_table,
+                region,
+                res,
+                rows,
+                now,
+                failed_inserts,
+                dims,
+            )
+            db.commit()
+            if dims is not None:
+                dims.commit()
+            return inserted
+        except mysql.connector.Error as e:
+            if dims is not None:
+                dims.rollback()
+            if not db.is_connected():
+                raise
+            db.rollback()
+            if e.errno in DB_RETRYABLE_ERRORS and attempt < DB_CONNECT_ATTEMPTS:
+                logger.warning(
+                    f"Retrying {region.upper()}/{res.genre_id} after lock error: {e}"
+                )
+                time.sleep(DB_RETRY_DELAY * attempt)
+                continue
+            logger.error(f"Database error for {region.upper()}/{res.genre_id}: {e}")
+            failed_inserts.append(f"Chart {region.upper()}/{res.genre_id} failed: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error for {region.upper()}/{res.genre_id}: {e}")
+            db.rollback()
+            if dims is not None:
+                dims.rollback()
+            failed_inserts.append(
+                f"Chart {region.upper()}/{res.genre_id} unexpected error: {e}"
+            )
+        return None
+
+
+def load_previous_ranks(cursor, previous_table, region):
+    """Index one region of the previous snapshot as {(appleid, category, subcategory or ''): rank}"""
+    cursor.execute(
+        f"""
+        SELECT appleid, category, subcategory_key, chart_rank
+        FROM {previous_table}
+        WHERE countryCode = %s
+    """,
+        (region,),
+    )
+    prev_ranks = {
+        (appleid, category, subcategory): rank
+        for appleid, category, subcategory, rank in cursor.fetchall()
+    }
+    logger.debug(
+        f"Loaded {len(prev_ranks)} previous ranks for {region.upper()} from {previous_table}"
+    )
+    return prev_ranks
+
+
+def get_region_prev_ranks(cursor, previous_table, region):
+    """Previous-snapshot index for one region, or None when movement is computed after the run"""
+    if RANK_COMPARISON_MODE != "insert" or not previous_table:
+        return None
+    try:
+        return load_previous_ranks(cursor, previous_table, region)
+    except mysql.connector.Error as e:
+        logger.warning(
+            f"Could not load previous ranks for {region.upper()}, leaving movement empty: {e}"
+        )
+        return None
+
+
+def load_all_table_data(cursor, table):
+    """Load all data from table at once and return as dictionary"""
+    logger.info(f"Loading all data from table {table}")
+
+    cursor.execute(f"""
+        SELECT appleid, chart_rank, title, countryCode, countryName, category,
+               subcategory_key
+        FROM {table}
+    """)
+
+    data = defaultdict(dict)
+    row_count = 0
+
+    for row in cursor.fetchall():
+        appleid, rank, title, country, country_name, category, subcategory = row
+        key = (appleid, country, category, subcategory)
+        data[key] = {"rank": rank, "title": title, "country_name": country_name}
+        row_count += 1
+
+    logger.info(f"Loaded {row_count} records from {table}")
+    return data
+
+
+def bulk_rank_comparison(cursor, last_table, current_table, carried_charts=None):
+    """Compare all ranks at once using bulk operations; returns (csv_data, exits)
+
+    carried_charts is a set of (country, category, subcategory or '') charts
+    copied forward unchanged; their rows already hold old_rank/movement '0',
+    so they are only written to the CSV, not updated again.
+    """
+    carried_charts = carried_charts or set()
+    logger.info("Starting bulk rank comparison")
+
+    logger.info("Loading previous rankings...")
+    old_data = load_all_table_data(cursor, last_table)
+
+    logger.info("Loading current rankings...")
+    new_data = load_all_table_data(cursor, current_table)
+
+    logger.info("Computing rank changes...")
+
+    # Prepare bulk updates and CSV data
+    bulk_updates = []
+    csv_data = []
+    stats = {"new": 0, "up": 0, "down": 0, "same": 0}
+
+    for key, new_info in new_data.items():
+        appleid, country, category, subcategory = key
+        new_rank = new_info["rank"]
+        title = new_info["title"]
+        country_name = new_info["country_name"]
+
+        old_info = old_data.get(key)
+
+        old_rank = old_info["rank"] if old_info is not None else None
+        movement = compute_movement(old_rank, new_rank)
+        stats[movement_bucket(movement)] += 1
+
+        # Prepare update tuple
+        if (country, category, subcategory) not in carried_charts:
+            bulk_updates.append(
+                (old_rank, movement, appleid, country, category, subcategory)
+            )
+
+        # Prepare CSV data
+        csv_data.append(
+            (
+                appleid,
+                title,
+                country,
+                country_name,
+                category,
+                subcategory if subcategory else None,
+                new_rank,
+                old_rank,
+                movement,
+            )
+        )
+
+    # Exits: previous entries of charts present today whose key is gone (one pass)
+    new_charts = {key[1:] for key in new_data}
+    exits = [
+        (
+            appleid,
+            old_info["title"],
+            country,
+            old_info["country_name"],
+            category,
+            subcategory,
+            old_info["rank"],
+        )
+        for (appleid, country, category, subcategory), old_info in old_data.items()
+        if (country, category, subcategory) in new_charts
+        and (appleid, country, category, subcategory) not in new_data
+    ]
+
+    logger.info(
+        f"Rank changes computed: NEW={stats['new']}, UP={stats['up']}, DOWN={stats['down']}, SAME={stats['same']}, OUT={len(exits)}"
+    )
+
+    # OPTIMIZED: Single bulk update instead of many small ones
+    if bulk_updates:
+        logger.info(f"Updating {len(bulk_updates)} records...")
+
+        update_sql = f"""
+        UPDATE {current_table}
+        SET old_rank=%s, movement=%s
+        WHERE countryCode=%s AND category=%s AND subcategory_key=%s AND appleid=%s
+        """
+
+        # Process in chunks to avoid memory issues
+        chunk_size = 1000
+        total_updated = 0
+
+        for i in range(0, len(bulk_updates), chunk_size):
+            chunk = bulk_updates[i : i + chunk_size]
+            cursor.executemany(
+                update_sql,
+                [
+                    (old_rank, movement, country, category, subcategory, appleid)
+                    for old_rank, movement, appleid, country, category, subcategory in chunk
+                ],
+            )
+            total_updated += len(chunk)
+
+            if i % 5000 == 0:
+                logger.info(
+                    f"Processed {min(i + chunk_size, len(bulk_updates))}/{len(bulk_updates)} updates"
+                )
+
+        logger.info(f"Successfully updated {total_updated} records")
+
+    return csv_data, exits
+
+
+def create_exits_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {EXITS_TABLE} (
+            snapshot_id bigint unsigned NOT NULL,
+            countryCode varchar(10) NOT NULL,
+            countryName varchar(100) DEFAULT NULL,
+            category varchar(50) NOT NULL,
+            subcategory varchar(255) NOT NULL DEFAULT '',
+            appleid bigint unsigned NOT NULL,
+            title varchar(255) DEFAULT NULL,
+            old_rank int DEFAULT NULL,
+            PRIMARY KEY (snapshot_id, countryCode, category, subcategory, appleid)
+        ) ENGINE=InnoDB
+    """)
+
+
+def exit_csv_row(exit_row):
+    """(appleid, title, country, country_name, category, subcategory, old_rank) -> CSV row"""
+    appleid, title, country, country_name, category, subcategory, old_rank = exit_row
+    return (
+        appleid,
+        title,
+        country,
+        country_name,
+        category,
+        subcategory or None,
+        None,
+        old_rank,
+        "OUT",
+    )
+
+
+def clear_chart_exits(cursor, snapshot_id):
+    cursor.execute(f"DELETE FROM {EXITS_TABLE} WHERE snapshot_id = %s", (snapshot_id,))
+
+
+def insert_chart_exits(db, cursor, snapshot_id, exits):
+    """Store exit tuples (appleid, title, country, country_name, category, subcategory, old_rank)"""
+    for i in range(0, len(exits), 1000):
+        cursor.executemany(
+            f"""
+            INSERT IGNORE INTO {EXITS_TABLE}
+            (snapshot_id, appleid, title, countryCode, countryName, category, subcategory, old_rank)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+        """,
+            [
+                (snapshot_id, *row[:5], row[5] or "", row[6])
+                for row in exits[i : i + 1000]
+            ],
+        )
+    db.commit()
+
+
+def sql_chart_exits(db, cursor, last_table, current_table):
+    """Anti-join per region: previous entries of charts present today that are gone today"""
+    snapshot_id = snapshot_id_for_table(current_table)
+    clear_chart_exits(cursor, snapshot_id)
+    total = 0
+    for region in REGIONS:
+        cursor.execute(
+            f"""
+            INSERT IGNORE INTO {EXITS_TABLE}
+            (snapshot_id, appleid, title, countryCode, countryName, category, subcategory, old_rank)
+            SELECT %s, p.appleid, p.title, p.countryCode, p.countryName, p.category,
+                   p.subcategory_key, p.chart_rank
+            FROM {last_table} p
+            JOIN (
+                SELECT DISTINCT category, subcategory_key
+                FROM {current_table} WHERE countryCode = %s
+            ) charts ON charts.category = p.category
+                    AND charts.subcategory_key = p.subcategory_key
+            LEFT JOIN {current_table} c
+              ON c.countryCode = p.countryCode
+             AND c.category = p.category
+             AND c.subcategory_key = p.subcategory_key
+             AND c.appleid = p.appleid
+            WHERE p.countryCode = %s AND p.appleid IS NOT NULL AND c.id IS NULL
+        """,
+            (snapshot_id, region, region),
+        )
+        total += cursor.rowcount
+        db.commit()
+    logger.info(f"Recorded {total} chart exits in {EXITS_TABLE}")
+    return total
+
+
+def sql_rank_comparison(db, cursor, last_table, current_table):
+    """Set old_rank/movement inside MySQL with one UPDATE ... JOIN per region
+
+    Nothing is pulled into Python, and committing per region keeps each
+    transaction's undo log small.
+    """
+    logger.info(f"Starting set-based rank comparison against {last_table}")
+    total_updated = 0
+    for region in REGIONS:
+        cursor.execute(
+            f"""
+            UPDATE {current_table} c
+            LEFT JOIN {last_table} p
+              ON p.countryCode = c.countryCode
+             AND p.category = c.category
+             AND p.subcategory_key = c.subcategory_key
+             AND p.appleid = c.appleid
+            SET c.old_rank = p.chart_rank,
+                c.movement = CASE
+                    WHEN p.chart_rank IS NULL THEN 'NEW'
+                    WHEN p.chart_rank > c.chart_rank
+                        THEN CONCAT('+', p.chart_rank - c.chart_rank)
+                    ELSE CAST(p.chart_rank - c.chart_rank AS CHAR)
+                END
+            WHERE c.countryCode = %s
+        """,
+            (region,),
+        )
+        total_updated += cursor.rowcount
+        db.commit()
+        logger.debug(
+            f"Rank comparison {region.upper()}: {cursor.rowcount} rows changed"
+        )
+
+    logger.info(f"Set-based rank comparison updated {total_updated} records")
+    return total_updated
+
+
+def stream_ranked_rows(db, table, columns):
+    """Yield (countryCode, category, subcategory or '', appleid, *columns) in merge-key order
+
+    Rows come through an unbuffered cursor in MERGE_CHUNK_ROWS batches. The
+    ORDER BY compares bytes, which matches Python's str ordering, so the
+    merge never disagrees with MySQL's collation.
+    """
+    cursor = db.cursor()
+    cursor.execute(f"""
+        SELECT countryCode, category, subcategory_key, appleid, {columns}
+        FROM {table}
+        WHERE appleid IS NOT NULL AND countryCode IS NOT NULL AND category IS NOT NULL
+        ORDER BY CAST(countryCode AS BINARY), CAST(category AS BINARY),
+                 CAST(subcategory_key AS BINARY), appleid
+    """)
+    try:
+        while True:
+            rows = cursor.fetchmany(MERGE_CHUNK_ROWS)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def flush_rank_updates(db, cursor, current_table, updates):
+    """Apply (id, old_rank, movement) updates as one multi-row upsert on the primary key"""
+    if not updates:
+        return 0
+    cursor.executemany(
+        f"""
+        INSERT INTO {current_table} (id, old_rank, movement) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE old_rank = VALUES(old_rank), movement = VALUES(movement)
+    """,
+        updates,
+    )
+    db.commit()
+    return len(updates)
+
+
+def merge_rank_comparison(db, cursor, last_table, current_table, carried_charts=None):
+    """Merge-join both snapshots in key order, streaming updates and CSV rows
+
+    Each table is read on its own connection (an unbuffered result set ties
+    up its connection), updates go out through db every MERGE_CHUNK_ROWS, so
+    peak memory is one chunk instead of two whole snapshots.
+    """
+    carried_charts = carried_charts or set()
+    stats = {"new": 0, "up": 0, "down": 0, "same": 0, "out": 0}
+    snapshot_id = snapshot_id_for_table(current_table)
+    logger.info(f"Starting merge-join rank comparison against {last_table}")
+
+    old_db, old_cursor = connect_db()
+    new_db, new_cursor = connect_db()
+    old_cursor.close()
+    new_cursor.close()
+    updates = []
+    exits = []
+    total_updated = 0
+    try:
+        clear_chart_exits(cursor, snapshot_id)
+        old_rows = stream_ranked_rows(
+            old_db, last_table, "chart_rank, title, countryName"
+        )
+        new_rows = stream_ranked_rows(
+            new_db, current_table, "chart_rank, id, title, countryName"
+        )
+        old = next(old_rows, None)
+
+        def skip_old(charts):
+            """Advance past an unmatched previous row; it is an exit if its chart exists today"""
+            if old[:4] != matched and old[:3] in charts:
+                exit_row = (old[3], old[5], old[0], old[6], old[1], old[2], old[4])
+                exits.append(exit_row)
+                writer.writerow(exit_csv_row(exit_row))
+                stats["out"] += 1
+            return next(old_rows, None)
+
+        with ComparisonWriter(current_table) as writer:
+            matched = prev_chart = None
+            for row in new_rows:
+                key = row[:4]
+                country, category, subcategory, appleid = key
+                new_rank, row_id, title, country_name = row[4:]
+
+                while old is not None and old[:4] < key:
+                    old = skip_old((key[:3], prev_chart))
+                if old is not None and old[:4] == key:
+                    matched = key
+                    old_rank = old[4]
+                else:
+                    old_rank = None
+                prev_chart = key[:3]
+                movement = compute_movement(old_rank, new_rank)
+                stats[movement_bucket(movement)] += 1
+
+                if (country, category, subcategory) not in carried_charts:
+                    updates.append((row_id, old_rank, movement))
+                    if len(updates) >= MERGE_CHUNK_ROWS:
+                        total_updated += flush_rank_updates(
+                            db, cursor, current_table, updates
+                        )
+                        updates = []
+                if len(exits) >= MERGE_CHUNK_ROWS:
+                    insert_chart_exits(db, cursor, snapshot_id, exits)
+                    exits = []
+
+                writer.writerow(
+                    (
+                        appleid,
+                        title,
+                        country,
+                        country_name,
+                        category,
+                        subcategory or None,
+                        new_rank,
+                        old_rank,
+                        movement,
+                    )
+                )
+
+            # Rest of the previous snapshot: only the last chart can still have exits
+            while old is not None:
+                old = skip_old((prev_chart,))
+
+        total_updated += flush_rank_updates(db, cursor, current_table, updates)
+        insert_chart_exits(db, cursor, snapshot_id, exits)
+    finally:
+        old_db.close()
+        new_db.close()
+
+    logger.info(
+        f"Rank changes computed: NEW={stats['new']}, UP={stats['up']}, DOWN={stats['down']}, SAME={stats['same']}, OUT={stats['out']}"
+    )
+    logger.info(f"Merge-join rank comparison updated {total_updated} records")
+    return total_updated
+
+
+class ComparisonWriter:
+    """Streams rank comparison rows (CSV_HEADER order) into compressed output files.
+
+    With per_region, every country gets its own file under
+    documents/rank_comparison/<snapshot>/ so consumers read only the regions
+    they need; otherwise everything goes to CSV_OUTPUT (plus extension).
+    Files are opened lazily as rows arrive. Parquet rows are buffered per
+    region up to one row group, and at most PARQUET_BUFFER_ROWS in total: past
+    that the largest buffer is written out early as a smaller row group.
+    close() writes manifest.json listing every file with its row count.
+    """
+
+    def __init__(
+        self,
+        snapshot,
+        compression=COMPARISON_COMPRESSION,
+        per_region=COMPARISON_PER_REGION,
+        parquet=COMPARISON_PARQUET,
+    ):
+        if compression == "zstd" and zstandard is None:
+            compression = "gzip"
+        if parquet and pyarrow is None:
+            logger.warning("pyarrow not installed, skipping Parquet output")
+            parquet = False
+        snapshot = published_table_name(snapshot)
+        self.snapshot = snapshot
+        self.compression = compression
+        self.per_region = per_region
+        self.parquet = parquet
+        self.ext = {"gzip": ".csv.gz", "zstd": ".csv.zst"}.get(compression, ".csv")
+        if per_region:
+            self.directory = os.path.join(COMPARISON_DIR, snapshot)
+        else:
+            self.directory = os.path.dirname(CSV_OUTPUT)
+        os.makedirs(self.directory, exist_ok=True)
+        self.parts = {}  # part name -> open file state
+        self.rows = 0
+        self.buffered = 0  # Parquet rows buffered across all parts
+
+    def _part_path(self, part, ext):
+        if self.per_region:
+            return os.path.join(self.directory, part + ext)
+        return os.path.splitext(CSV_OUTPUT)[0] + ext
+
+    def _open_text(self, path):
+        if self.compression == "gzip":
+            return gzip.open(path, "wt", newline="", encoding="utf-8", compresslevel=6)
+        if self.compression == "zstd":
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"))
+            return io.TextIOWrapper(stream, newline="", encoding="utf-8")
+        return open(path, "w", newline="", encoding="utf-8")
+
+    def _open_part(self, part):
+        path = self._part_path(part, self.ext)
+        f = self._open_text(path)
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        state = {"path": path, "file": f, "csv": writer, "rows": 0}
+        if self.parquet:
+            state["parquet_path"] = self._part_path(part, ".parquet")
+            state["parquet"] = None
+            state["buffer"] = []
+        self.parts[part] = state
+        return state
+
+    def writerow(self, row):
+        part = row[2] if self.per_region else "all"
+        state = self.parts.get(part) or self._open_part(part)
+        state["csv"].writerow(row)
+        state["rows"] += 1
+        self.rows += 1
+        if self.parquet:
+            state["buffer"].append(row)
+            self.buffered += 1
+            if len(state["buffer"]) >= PARQUET_ROW_GROUP:
+                self._flush_parquet(state)
+            elif self.buffered >= PARQUET_BUFFER_ROWS:
+                self._flush_parquet(
+                    max(self.parts.values(), key=lambda s: len(s["buffer"]))
+                )
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+        return self.rows
+
+    def _flush_parquet(self, state):
+        if not state["buffer"]:
+            return
+        columns = list(zip(*state["buffer"]))
+        table = pyarrow.table(
+            {
+                name: pyarrow.array(values, type=PARQUET_TYPES[name])
+                for name, values in zip(CSV_HEADER, columns)
+            }
+        )
+        if state["parquet"] is None:
+            state["parquet"] = pyarrow.parquet.ParquetWriter(
+                state["parquet_path"], table.schema, compression="zstd"
+            )
+        state["parquet"].write_table(table)
+        self.buffered -= len(state["buffer"])
+        state["buffer"] = []
+
+    def close(self):
+        """Finish every file and write the manifest; returns the manifest path"""
+        files = []
+        for part, state in sorted(self.parts.items()):
+            state["file"].close()
+            entry = {
+                "region": part,
+                "path": os.path.basename(state["path"]),
+                "format": "csv",
+                "compression": self.compression,
+                "rows": state["rows"],
+                "bytes": os.path.getsize(state["path"]),
+            }
+            files.append(entry)
+            if self.parquet:
+                self._flush_parquet(state)
+                state["parquet"].close()
+                files.append(
+                    dict(
+                        entry,
+                        path=os.path.basename(state["parquet_path"]),
+                        format="parquet",
+                        compression="zstd",
+                        bytes=os.path.getsize(state["parquet_path"]),
+                    )
+                )
+
+        manifest = {
+            "snapshot": self.snapshot,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "columns": CSV_HEADER,
+            "total_rows": self.rows,
+            "files": files,
+        }
+        if self.per_region:
+            manifest_path = os.path.join(self.directory, "manifest.json")
+        else:
+            manifest_path = os.path.splitext(CSV_OUTPUT)[0] + ".manifest.json"
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        logger.info(
+            f"Rank comparison: {self.rows} rows in {len(self.parts)} files, manifest {manifest_path}"
+        )
+        return manifest_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_comparison(rows, snapshot):
+    """Stream rank comparison rows from any iterable to the output files; returns rows written"""
+    with ComparisonWriter(snapshot) as writer:
+        return writer.writerows(rows)
+
+
+def export_rank_comparison(db, current_table):
+    """Stream stored old_rank/movement, then the snapshot's exits, into the comparison CSV
+
+    Uses an unbuffered cursor so the snapshot is never held in memory.
+    """
+    stats = {"new": 0, "up": 0, "down": 0, "same": 0, "out": 0}
+
+    def comparison_rows(cursor):
+        cursor.execute(f"""
+            SELECT appleid, title, countryCode, countryName, category, subcategory,
+                   chart_rank, old_rank, movement
+            FROM {current_table}
+        """)
+        for row in cursor:
+            if row[8] is not None:
+                stats[movement_bucket(row[8])] += 1
+            yield row
+
+        cursor.execute(
+            f"""
+            SELECT appleid, title, countryCode, countryName, category, subcategory, old_rank
+            FROM {EXITS_TABLE} WHERE snapshot_id = %s
+        """,
+            (snapshot_id_for_table(current_table),),
+        )
+        for row in cursor:
+            stats["out"] += 1
+            yield exit_csv_row(row)
+
+    cursor = db.cursor()
+    try:
+        count = write_comparison(comparison_rows(cursor), current_table)
+    finally:
+        cursor.close()
+
+    logger.info(
+        f"Rank changes: NEW={stats['new']}, UP={stats['up']}, DOWN={stats['down']}, SAME={stats['same']}, OUT={stats['out']}"
+    )
+    return count
+
+
+# Errors meaning LOAD DATA LOCAL is disabled on the server or the client
+LOAD_DATA_UNAVAILABLE_ERRORS = (
+    errorcode.ER_NOT_ALLOWED_COMMAND,
+    errorcode.ER_CLIENT_LOCAL_FILES_DISABLED,
+    errorcode.CR_LOAD_DATA_LOCAL_INFILE_REJECTED,
+)
+
+
+def insert_chart_rows(cursor, insert_sql, table, rows, failed_inserts):
+    """Insert one chart's rows with the configured INSERT_METHOD"""
+    global INSERT_METHOD
+    if INSERT_METHOD == "load_data":
+        try:
+            loaded = load_data_rows(cursor, table, rows)
+            if loaded is not None:
+                return loaded
+        except mysql.connector.Error as e:
+            if e.errno not in LOAD_DATA_UNAVAILABLE_ERRORS:
+                raise
+            logger.warning(
+                f"LOAD DATA LOCAL INFILE unavailable, switching to executemany: {e}"
+            )
+            INSERT_METHOD = "executemany"
+    return batch_insert_podcasts(cursor, insert_sql, rows, failed_inserts)
+
+
+def db_session_config():
+    return session_config(local_infile=INSERT_METHOD == "load_data")
+
+
+def connect_db():
+    """Open a connection with bulk-load session settings; returns (db, cursor)"""
+    db = mysql.connector.connect(**db_session_config())
+    cursor = db.cursor(buffered=True)
+    optimize_session(cursor)
+    return db, cursor
+
+
+class ChartDBPool:
+    """Bounded pool of bulk-load sessions built on mysql.connector.pooling.
+
+    connect() blocks while all DB_POOL_SIZE connections are checked out
+    (mysql.connector raises instead), pings each connection before handing
+    it out and reconnects after OperationalError. The pool resets sessions
+    on return, so the bulk-load settings are applied on every checkout.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = size
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name="chart_log",
+            pool_size=size,
+            pool_reset_session=True,
+            **db_session_config(),
+        )
+        self.slots = threading.BoundedSemaphore(size)
+
+    def connect(self):
+        """Check out a healthy connection; returns (db, cursor)"""
+        self.slots.acquire()
+        for attempt in range(1, DB_CONNECT_ATTEMPTS + 1):
+            db = None
+            try:
+                db = self.pool.get_connection()
+                db.ping(reconnect=True, attempts=1)
+                cursor = db.cursor(buffered=True)
+                optimize_session(cursor)
+                return db, cursor
+            except (
+                mysql.connector.OperationalError,
+                mysql.connector.InterfaceError,
+            ) as e:
+                if db is not None:
+                    self._close(db)
+                if attempt == DB_CONNECT_ATTEMPTS:
+                    self.slots.release()
+                    raise
+                logger.warning(
+                    f"Database connection unhealthy ({e}), reconnecting "
+                    f"({attempt}/{DB_CONNECT_ATTEMPTS})"
+                )
+                time.sleep(DB_RETRY_DELAY * attempt)
+            except Exception:
+                if db is not None:
+                    self._close(db)
+                self.slots.release()
+                raise
+
+    def release(self, db, cursor):
+        """Roll back anything uncommitted and return the connection to the pool"""
+        try:
+            cursor.close()
+            db.rollback()
+        except mysql.connector.Error:
+            pass  # broken connections are reconnected on their next checkout
+        self._close(db)
+        self.slots.release()
+
+    @staticmethod
+    def _close(db):
+        try:
+            db.close()
+        except mysql.connector.Error:
+            pass
+
+
+def innodb_row_lock_waits(cursor):
+    """Server-wide (Innodb_row_lock_waits, Innodb_row_lock_time in ms) counters"""
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock_%'")
+    status = dict(cursor.fetchall())
+    return (
+        int(status.get("Innodb_row_lock_waits", 0)),
+        int(status.get("Innodb_row_lock_time", 0)),
+    )
+
+
+class ChartWriter(threading.Thread):
+    """DB writer stage: commits queued charts on its own connection.
+
+    The crawl (producer) hands every fetched chart to submit(); the bounded
+    queue blocks the producer when the writer falls behind, so memory stays
+    bounded while inserts overlap with network time. With a db_pool the
+    connection is checked out of the pool and replaced when it is lost.
+    """
+
+    def __init__(
+        self,
+        insert_sql,
+        current_table,
+        previous_table,
+        now,
+        failed_inserts,
+        queue_size=WRITER_QUEUE_SIZE,
+        dims=None,
+        work_queue=None,
+        db_pool=None,
+        name="chart-writer",
+        group=None,
+    ):
+        super().__init__(name=name, daemon=True)
+        self.queue = (
+            work_queue if work_queue is not None else queue.Queue(maxsize=queue_size)
+        )
+        self.db_pool = db_pool
+        self.group = group  # ChartWriters sharing work_queue, if any
+        self.insert_sql = insert_sql
+        self.current_table = current_table
+        self.previous_table = previous_table
+        self.now = now
+        self.failed_inserts = failed_inserts
+        self.dims = dims
+        self.records_inserted = 0
+        self.charts_written = 0
+        self.carried_charts = set()
+        self.error = None
+
+    def submit(self, region, res, prev_ranks=None):
+        self.queue.put((region, res, prev_ranks))
+
+    def _connect(self):
+        return self.db_pool.connect() if self.db_pool else connect_db()
+
+    def _release(self, db, cursor):
+        if self.db_pool:
+            self.db_pool.release(db, cursor)
+        else:
+            cursor.close()
+            db.close()
+
+    def _commit(self, db, cursor, region, res, prev_ranks):
+        return commit_chart(
+            db,
+            cursor,
+            self.insert_sql,
+            self.current_table,
+            self.previous_table,
+            region,
+            res,
+            self.now,
+            self.failed_inserts,
+            prev_ranks,
+            self.dims,
+        )
+
+    def _write(self, db, cursor, region, res, prev_ranks):
+        """Commit one chart, reconnecting once if the connection was lost; returns (db, cursor, inserted)"""
+        try:
+            return db, cursor, self._commit(db, cursor, region, res, prev_ranks)
+        except mysql.connector.Error as e:
+            logger.warning(f"{self.name} lost its connection ({e}), reconnecting")
+            self._release(db, cursor)
+
+        db, cursor = self._connect()
+        try:
+            # The connection may have dropped after the COMMIT reached the server
+            committed = chart_checkpoint_rows(
+                cursor, self.current_table, region, int(res.genre_id)
+            )
+            if committed is not None:
+                logger.info(
+                    f"{self.name}: {region.upper()}/{res.genre_id} was already committed"
+                )
+                return db, cursor, committed
+            return db, cursor, self._commit(db, cursor, region, res, prev_ranks)
+        except mysql.connector.Error:
+            self._release(db, cursor)
+            raise
+
+    def run(self):
+        try:
+            db, cursor = self._connect()
+        except mysql.connector.Error as e:
+            logger.error(f"{self.name} could not connect to database: {e}")
+            self._fail(e)
+            return
+
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                region, res, prev_ranks = item
+                if self.group is not None:
+                    self.group.writer_busy(True)
+                try:
+                    db, cursor, inserted = self._write(
+                        db, cursor, region, res, prev_ranks
+                    )
+                except mysql.connector.Error as e:
+                    logger.error(f"{self.name} giving up: {e}")
+                    db = cursor = None  # already released by _write
+                    self.failed_inserts.append(
+                        f"Chart {region.upper()}/{res.genre_id} not written: {e}"
+                    )
+                    self._fail(e)
+                    return
+                finally:
+                    if self.group is not None:
+                        self.group.writer_busy(False)
+                if inserted is None:
+                    continue
+                self.records_inserted += inserted
+                self.charts_written += 1
+                if res.unchanged:
+                    self.carried_charts.add(
+                        (region, res.category, res.subcategory or "")
+                    )
+        finally:
+            if db is not None:
+                self._release(db, cursor)
+
+    def _fail(self, error):
+        """Stop after a fatal error, leaving queued charts to the writers still running
+
+        Only a standalone writer, or the last one of its group, drains the
+        queue so the producer never blocks forever.
+        """
+        self.error = error
+        if self.group is None or self.group.writer_failed():
+            self._drain()
+
+    def _drain(self):
+        """Keep consuming after a fatal error so the producer never blocks forever"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            region, res, _ = item
+            self.failed_inserts.append(
+                f"Chart {region.upper()}/{res.genre_id} not written: {self.error}"
+            )
+
+    def close(self):
+        """Wait for every queued chart to be committed"""
+        self.queue.put(None)
+        self.join()
+        logger.info(
+            f"Writer committed {self.charts_written} charts ({self.records_inserted} records)"
+        )
+
+
+class ChartWriters:
+    """N ChartWriter threads on pooled connections, fed from one bounded queue.
+
+    Charts of different regions (and of the same region) commit concurrently,
+    each in its own transaction, instead of queueing behind one session.
+    """
+
+    def __init__(
+        self,
+        count,
+        db_pool,
+        insert_sql,
+        current_table,
+        previous_table,
+        now,
+        failed_inserts,
+        queue_size=WRITER_QUEUE_SIZE,
+        dims=None,
+    ):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.running = count  # writers that have not failed
+        self.lock = threading.Lock()
+        # Time-weighted count of writers inside a commit, to check they overlap
+        self.active = 0
+        self.busy_time = 0.0  # wall time with at least one writer committing
+        self.concurrent_time = 0.0  # writer-seconds spent committing
+        self.last_change = None
+        self.writers = [
+            ChartWriter(
+                insert_sql,
+                current_table,
+                previous_table,
+                now,
+                failed_inserts,
+                dims=dims,
+                work_queue=self.queue,
+                db_pool=db_pool,
+                name=f"chart-writer-{i}",
+                group=self,
+            )
+            for i in range(count)
+        ]
+
+    def start(self):
+        for writer in self.writers:
+            writer.start()
+
+    def submit(self, region, res, prev_ranks=None):
+        self.queue.put((region, res, prev_ranks))
+
+    def writer_busy(self, busy):
+        with self.lock:
+            now = time.time()
+            if self.active:
+                self.busy_time += now - self.last_change
+                self.concurrent_time += self.active * (now - self.last_change)
+            self.active += 1 if busy else -1
+            self.last_change = now
+
+    def writer_failed(self):
+        """Record a writer's fatal error; True if it was the last one running"""
+        with self.lock:
+            self.running -= 1
+            if self.running:
+                logger.warning(f"{self.running} DB writers left")
+            return self.running == 0
+
+    def close(self):
+        """Wait for every queued chart to be committed by all writers"""
+        for _ in self.writers:
+            self.queue.put(None)  # one sentinel per writer
+        for writer in self.writers:
+            writer.join()
+        concurrency = self.concurrent_time / self.busy_time if self.busy_time else 0.0
+        logger.info(
+            f"{len(self.writers)} writers committed {self.charts_written} charts "
+            f"({self.records_inserted} records), {concurrency:.1f} committing at once "
+            f"on average while busy"
+        )
+
+    @property
+    def records_inserted(self):
+        return sum(w.records_inserted for w in self.writers)
+
+    @property
+    def charts_written(self):
+        return sum(w.charts_written for w in self.writers)
+
+    @property
+    def carried_charts(self):
+        return set().union(*(w.carried_charts for w in self.writers))
+
+
+# ===============================
+# MAIN
+# ===============================
 def main():
     start_time = datetime.datetime.now()
     logger.info("=" * 80)
@@ -1018,10 +3582,19 @@ def main():
     logger.info(f"Log file: {main_log_file}")
     logger.info("=" * 80)
 
+    # Closed in the finally below on every path out of main, early returns included
+    session = crawler = metadata_cache = None
+    db = cursor = None
     try:
         # Create robust HTTP session
         logger.info("Initializing HTTP session")
         session = create_robust_session()
+        metadata_cache = MetadataCache() if USE_METADATA_CACHE else None
+        crawler = AsyncChartCrawler(cache=metadata_cache) if USE_ASYNC_CRAWL else None
+        if crawler is not None:
+            logger.info(
+                f"Async crawl enabled (global={MAX_CONCURRENCY}, per-endpoint={ENDPOINT_CONCURRENCY})"
+            )
 
         # Fetch and build genres mapping
         logger.info("Preparing output files")
@@ -1045,73 +3618,88 @@ def main():
         all_genres_info = collect_genre_info({"26": genres_data["26"]})
         logger.info(f"Processed {len(all_genres_info)} total genres")
 
-        # Connect to database with optimized settings
-        logger.info("Connecting to database")
-        db_config_optimized = DB_CONFIG.copy()
-        db_config_optimized.update(
-            {
-                "autocommit": False,
-                "use_unicode": True,
-                "charset": "utf8mb4",
-            }
+        tree_version = genre_tree_version(genres_data)
+        storefront_trees = (
+            load_genre_tree_cache(tree_version) if USE_STOREFRONT_GENRES else {}
         )
 
+        # Connect to database with optimized settings
+        logger.info("Connecting to database")
         try:
-            db = mysql.connector.connect(**db_config_optimized)
-            cursor = db.cursor(buffered=True)
-            logger.info("Successfully connected to database")
+            db_pool = ChartDBPool(DB_POOL_SIZE)
+            db, cursor = db_pool.connect()
+            logger.info(f"Successfully connected to database (pool of {DB_POOL_SIZE})")
         except mysql.connector.Error as e:
             logger.error(f"Database connection failed: {e}")
             return
 
-        # Optimize MySQL session variables for bulk operations
-        try:
-            logger.info("Optimizing database session")
-            cursor.execute("SET SESSION bulk_insert_buffer_size = 67108864")  # 64MB
-            cursor.execute("SET SESSION myisam_sort_buffer_size = 67108864")  # 64MB
-            cursor.execute(
-                "SET SESSION innodb_lock_wait_timeout = 120"
-            )  # Increase lock timeout
-            cursor.execute("SET SESSION max_heap_table_size = 134217728")  # 128MB
-            cursor.execute("SET SESSION tmp_table_size = 134217728")  # 128MB
-            logger.info("Database session optimized for bulk operations")
-        except mysql.connector.Error as e:
-            logger.warning(
-                f"Some database optimizations failed (this is usually OK): {e}"
-            )
-
         # ===============================
         # TABLE RESUMPTION LOGIC
         # ===============================
         logger.info("Checking for existing tables and resumption possibility")
 
-        last_table = get_last_table_name(cursor)  # most recent table (could be today's)
+        try:
+            create_snapshot_catalog(cursor)
+            create_checkpoint_table(cursor)
+            bootstrap_snapshot_catalog(cursor)
+            db.commit()
+            # most recent snapshot (could be today's)
+            latest = get_latest_snapshot(cursor)
+        except mysql.connector.Error as e:
+            logger.error(f"Snapshot catalog unavailable: {e}")
+            return
+        last_table = latest.table if latest else None
         now = datetime.datetime.now()
         today_str = now.strftime("%Y%m%d")
 
         reuse_existing = False
-        current_table = None
+        current_table = None  # published name; rows load into load_table until then
+        load_table = None
         previous_table = None  # the baseline to compare against (yesterday)
 
-        if last_table and last_table.startswith(f"apple_chart_{today_str}"):
+        if (
+            latest
+            and latest.status != "complete"
+            and last_table != published_table_name(last_table)
+            and not table_exists(cursor, last_table)
+        ):
+            # Crashed between RENAME and re-keying its bookkeeping: finish publishing
+            logger.info(f"Finishing interrupted publish of {last_table}")
+            publish_snapshot(cursor, last_table, published_table_name(last_table))
+            db.commit()
+            latest = get_latest_snapshot(cursor)
+            last_table = latest.table
+
+        resumable = (
+            last_table
+            if last_table and str(latest.snapshot_id).startswith(today_str)
+            else None
+        )
+        try:
+            fail_stale_snapshots(cursor, resumable)
+            db.commit()
+        except mysql.connector.Error as e:
+            logger.warning(f"Could not clean up abandoned snapshots: {e}")
+
+        if resumable:
             # Check if today's table is complete
-            cursor.execute(f"SELECT COUNT(DISTINCT countryCode) FROM {last_table}")
-            completed_regions = cursor.fetchone()[0]
-            if completed_regions == len(REGIONS):
+            completed_regions = latest.regions_done
+            if latest.status == "complete":
                 logger.info(
                     f"Today's table {last_table} already exists and is complete. Exiting."
                 )
-                cursor.close()
-                db.close()
-                session.close()
                 return  # <-- End the script immediately
             else:
                 # If incomplete, still allow resumption
                 reuse_existing = True
-                current_table = last_table
-                previous_table = get_previous_table_name(
-                    cursor, exclude_table=current_table
+                current_table = published_table_name(last_table)
+                load_table = last_table
+                baseline = (
+                    get_snapshot(cursor, latest.baseline_snapshot_id)
+                    if latest.baseline_snapshot_id
+                    else get_baseline_snapshot(cursor, latest.snapshot_id)
                 )
+                previous_table = baseline.table if baseline else None
                 logger.info(
                     f"Resuming into existing table: {current_table} "
                     f"(completed {completed_regions}/{len(REGIONS)} regions)"
@@ -1119,183 +3707,307 @@ def main():
 
         if not reuse_existing:
             current_table = f"apple_chart_{now.strftime('%Y%m%d_%H%M%S')}"
+            load_table = staging_table_name(current_table)
             try:
-                create_new_table(cursor, current_table)
-                previous_table = last_table  # yesterday's (or None if first run)
-                logger.info(f"Created new table: {current_table}")
+                create_new_table(cursor, load_table, DEFER_SECONDARY_INDEXES)
+                # Newest complete snapshot (or None if first run)
+                baseline = get_baseline_snapshot(cursor)
+                previous_table = baseline.table if baseline else None
+                logger.info(f"Created new table: {load_table}")
                 if previous_table:
                     logger.info(f"Will compare with: {previous_table}")
             except mysql.connector.Error as e:
                 logger.error(f"Failed to create table: {e}")
-                cursor.close()
-                db.close()
                 return
 
+        try:
+            register_snapshot(cursor, load_table, now, previous_table)
+            db.commit()
+        except mysql.connector.Error as e:
+            logger.warning(f"Could not register {current_table} in catalog: {e}")
+
+        # Tables from before subcategory_key existed get it (and its index) once
+        for table in (previous_table, load_table if reuse_existing else None):
+            if table:
+                try:
+                    ensure_subcategory_key(cursor, table)
+                except mysql.connector.Error as e:
+                    logger.error(f"Could not add subcategory_key to {table}: {e}")
+                    return
+
+        prev_fingerprints = {}
+        if USE_CHART_FINGERPRINTS:
+            try:
+                create_fingerprint_table(cursor)
+                if previous_table:
+                    prev_fingerprints = load_chart_fingerprints(cursor, previous_table)
+            except mysql.connector.Error as e:
+                logger.warning(f"Chart fingerprints unavailable: {e}")
+
+        availability = {}
+        if USE_NEGATIVE_CACHE:
+            try:
+                create_availability_table(cursor)
+                availability = load_chart_availability(cursor)
+            except mysql.connector.Error as e:
+                logger.warning(f"Chart availability matrix unavailable: {e}")
+
         db.commit()
 
-        insert_sql = f"""
-        INSERT INTO {current_table}
-        (chart_rank, podcast_url, appleid, title, img_url, countryCode, countryName, 
-         category, subcategory, createdTime, updatedTime)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        """
+        insert_sql = build_insert_sql(load_table)
 
         all_apple_ids = set()
         failed_requests, failed_inserts = [], []
-        batch_insert_data = []
+        carried_charts = set()  # (region, category, subcategory or '') copied forward
 
         # Statistics tracking
         total_charts_fetched = 0
         total_metadata_lookups = 0
         total_records_inserted = 0
+        total_charts_skipped = 0
 
         logger.info("Starting data collection phase")
 
         # ===============================
-        # RESUME FROM LAST COMPLETED REGION
+        # RESUME FROM CHART CHECKPOINTS
         # ===============================
-        cursor.execute(f"SELECT DISTINCT countryCode FROM {current_table}")
-        done_regions = {row[0] for row in cursor.fetchall()}
-        start_index = 0
-
-        if done_regions:
-            last_done = None
-            for r in REGIONS:  # walk in processing order
-                if r in done_regions:
-                    last_done = r
-            if last_done:
-                # wipe last region to guard against partial work before crash
-                logger.info(f"Cleaning partial data for last region: {last_done}")
-                cursor.execute(
-                    f"DELETE FROM {current_table} WHERE countryCode = %s", (last_done,)
-                )
+        try:
+            create_checkpoint_table(cursor)
+            db.commit()
+            checkpoints = load_checkpoints(cursor, load_table)
+        except mysql.connector.Error as e:
+            logger.error(f"Checkpoint table unavailable: {e}")
+            return
+
+        dims = None
+        if USE_NORMALIZED_SCHEMA:
+            try:
+                create_dimension_tables(cursor)
                 db.commit()
-                start_index = REGIONS.index(last_done)
-                logger.info(
-                    f"Resuming from region {last_done.upper()} (wiped its old rows)"
-                )
+                dims = ChartDimensions(snapshot_id_for_table(current_table))
+            except mysql.connector.Error as e:
+                logger.warning(f"Normalized schema unavailable, skipping it: {e}")
 
-        total_regions = len(REGIONS)
-        logger.info(
-            f"Processing {len(REGIONS[start_index:])} regions starting from index {start_index}"
-        )
+        if checkpoints:
+            logger.info(
+                f"Resuming: {sum(len(v) for v in checkpoints.values())} charts already "
+                f"committed across {len(checkpoints)} regions"
+            )
 
-        for region_idx, region in enumerate(
-            REGIONS[start_index:], start=start_index + 1
-        ):
+        # Replay charts that were fetched and spooled but never committed
+        spool = ChartSpool(current_table) if USE_SPOOL else None
+        if spool is not None and reuse_existing:
+            pending = load_spooled_charts(spool, checkpoints)
+            replayed = 0
+            for region, chart_results in pending.items():
+                prev_ranks = get_region_prev_ranks(cursor, previous_table, region)
+                for res in chart_results:
+                    inserted = commit_chart(
+                        db,
+                        cursor,
+                        insert_sql,
+                        load_table,
+                        previous_table,
+                        region,
+                        res,
+                        now,
+                        failed_inserts,
+                        prev_ranks,
+                        dims,
+                    )
+                    if inserted is None:
+                        continue
+                    replayed += 1
+                    total_records_inserted += inserted
+                    all_apple_ids.update(str(aid) for aid in res.ids_ranked)
+                    checkpoints[region].add(res.genre_id)
+                    if res.unchanged:
+                        carried_charts.add(
+                            (region, res.category, res.subcategory or "")
+                        )
+            if replayed:
+                logger.info(f"Replayed {replayed} spooled charts without refetching")
+
+        writer = None
+        if USE_DB_WRITER_THREAD:
+            writer = ChartWriters(
+                DB_WRITER_THREADS,
+                db_pool,
+                insert_sql,
+                load_table,
+                previous_table,
+                now,
+                failed_inserts,
+                dims=dims,
+            )
+            try:
+                lock_waits_before = innodb_row_lock_waits(cursor)
+            except mysql.connector.Error as e:
+                logger.debug(f"Could not read InnoDB lock counters: {e}")
+                lock_waits_before = None
+            writer.start()
             logger.info(
-                f"Processing region: {region.upper()} ({region_idx}/{total_regions})"
+                f"{DB_WRITER_THREADS} DB writer threads started (queue size {WRITER_QUEUE_SIZE})"
             )
-            genre_list = get_genres_for_region(all_genres_info, region)
 
-            region_charts = 0
-            region_metadata = 0
-            region_records = 0
+        total_regions = len(REGIONS)
+        logger.info(f"Processing {total_regions} regions")
 
-            for idx, (genre_id, (category_name, subcategory_name)) in enumerate(
-                genre_list, start=1
-            ):
-                display_name = subcategory_name if subcategory_name else category_name
-                logger.debug(
-                    f"[{idx}/{len(genre_list)}] {region.upper()} | {genre_id} - {display_name}"
+        def planned_regions():
+            """Plan each region (genre list, negative cache, chart plan) as the crawl asks for it"""
+            nonlocal total_charts_skipped
+            for region_idx, region in enumerate(REGIONS, start=1):
+                logger.info(
+                    f"Processing region: {region.upper()} ({region_idx}/{total_regions})"
                 )
+                storefront_genre_ids = None
+                if USE_STOREFRONT_GENRES:
+                    storefront_genre_ids = get_storefront_genre_ids(
+                        session, region, storefront_trees, tree_version
+                    )
+                genre_list = get_genres_for_region(
+                    all_genres_info, region, storefront_genre_ids
+                )
+                probe_genres = set()
+                skipped = []
+                if USE_NEGATIVE_CACHE:
+                    genre_list, probe_genres, skipped = plan_region_genres(
+                        region, genre_list, availability, now
+                    )
+                    total_charts_skipped += len(skipped)
 
-                # 1) Get ranked IDs from charts
                 try:
-                    ids_ranked = fetch_chart_ids(session, region, genre_id, CHART_LIMIT)
-                    region_charts += len(ids_ranked)
-                    total_charts_fetched += len(ids_ranked)
-                except Exception as e:
-                    logger.error(f"Charts error for {region}/{genre_id}: {e}")
-                    failed_requests.append((region, genre_id, display_name, str(e)))
-                    continue
+                    save_region_plan(
+                        cursor, load_table, region, [g[0] for g in genre_list] + skipped
+                    )
+                    # Known-empty charts are done without a fetch
+                    for genre_id in skipped:
+                        save_chart_checkpoint(cursor, load_table, region, genre_id, 0)
+                    db.commit()
+                except mysql.connector.Error as e:
+                    logger.warning(f"Could not save chart plan for {region}: {e}")
+                    db.rollback()
 
-                if not ids_ranked:
-                    logger.debug(f"No chart IDs found for {region}/{genre_id}")
+                done_genres = checkpoints.get(region, set())
+                if done_genres:
+                    genre_list = [g for g in genre_list if g[0] not in done_genres]
+                    logger.info(
+                        f"Region {region.upper()}: {len(done_genres)} charts already committed, "
+                        f"{len(genre_list)} remaining"
+                    )
+                if not genre_list:
                     continue
+                yield region, genre_list, probe_genres
 
-                logger.debug(
-                    f"Found {len(ids_ranked)} chart entries for {display_name}"
+        if crawler is not None:
+            # Several regions in flight under the shared request semaphores
+            crawled = crawler.crawl_regions(
+                planned_regions(), missing_ids_set, prev_fingerprints
+            )
+        else:
+            crawled = (
+                (
+                    region,
+                    crawl_region_sync(
+                        session,
+                        region,
+                        genre_list,
+                        missing_ids_set,
+                        metadata_cache,
+                        prev_fingerprints.get(region),
+                        probe_genres,
+                    ),
                 )
+                for region, genre_list, probe_genres in planned_regions()
+            )
 
-                # 2) Enrich with Lookup metadata in batches
-                try:
-                    meta_map = lookup_metadata(
-                        session, ids_ranked, region, missing_ids_set
-                    )
-                    region_metadata += len(meta_map)
-                    total_metadata_lookups += len(meta_map)
-                    logger.debug(f"Retrieved metadata for {len(meta_map)} podcasts")
-                except Exception as e:
-                    logger.error(f"Metadata lookup error for {region}/{genre_id}: {e}")
-                    meta_map = {}
-
-                # 3) Collect data for batch insert
-                for rank, aid in enumerate(ids_ranked, start=1):
-                    all_apple_ids.add(str(aid))
-                    meta = meta_map.get(aid, {})
-                    podcast_url = meta.get(
-                        "podcast_url",
-                        f"https://podcasts.apple.com/{region}/podcast/id{aid}",
-                    )
-                    title = meta.get("title", "")
-                    img_url = meta.get("artwork", "")
-
-                    subcat_value = subcategory_name if subcategory_name else None
-                    country_name = COUNTRY_NAMES.get(region, region.upper())
-
-                    # Collect data for batch insert
-                    batch_insert_data.append(
-                        (
-                            rank,
-                            podcast_url,
-                            int(aid),
-                            title,
-                            img_url,
-                            region,
-                            country_name,
-                            category_name,
-                            subcat_value,
-                            now,
-                            now,
-                        )
-                    )
-                    region_records += 1
+        for region, chart_results in crawled:
+            prev_ranks = get_region_prev_ranks(cursor, previous_table, region)
 
-            # Batch insert per region to avoid memory issues (with idempotent logic)
-            if batch_insert_data:
-                logger.info(
-                    f"Batch inserting {len(batch_insert_data)} records for {region.upper()}"
-                )
+            region_charts = 0
+            region_metadata = 0
+            region_records = 0
+
+            if spool is not None:
                 try:
-                    # Clear any existing data for this region first (idempotent)
-                    cursor.execute(
-                        f"DELETE FROM {current_table} WHERE countryCode = %s", (region,)
-                    )
+                    spool_region(spool, region, chart_results)
+                except OSError as e:
+                    logger.error(f"Could not spool region {region.upper()}: {e}")
 
-                    inserted = batch_insert_podcasts(
-                        cursor, insert_sql, batch_insert_data, failed_inserts
-                    )
-                    total_records_inserted += inserted
-                    batch_insert_data = []  # Clear for next region
-                    db.commit()  # Commit per region
-                    logger.info(
-                        f"Successfully committed {inserted} records for {region.upper()}"
-                    )
+            if USE_NEGATIVE_CACHE:
+                try:
+                    record_chart_availability(cursor, region, chart_results, now)
+                    db.commit()
                 except mysql.connector.Error as e:
-                    logger.error(f"Database error for {region.upper()}: {e}")
-                    db.rollback()
-                    failed_inserts.append(f"Region {region.upper()} batch failed: {e}")
-                except Exception as e:
-                    logger.error(f"Unexpected error for {region.upper()}: {e}")
+                    logger.warning(f"Could not record availability for {region}: {e}")
                     db.rollback()
-                    failed_inserts.append(
-                        f"Region {region.upper()} unexpected error: {e}"
+
+            for res in chart_results:
+                if res.error:
+                    display_name = res.subcategory if res.subcategory else res.category
+                    failed_requests.append(
+                        (region, res.genre_id, display_name, res.error)
                     )
+                    continue
+
+                region_charts += len(res.ids_ranked)
+                total_charts_fetched += len(res.ids_ranked)
+                region_metadata += len(res.meta_map)
+                total_metadata_lookups += len(res.meta_map)
+                all_apple_ids.update(str(aid) for aid in res.ids_ranked)
+
+                if writer is not None:
+                    # 3) Hand off to the writer stage; blocks only when its queue is full
+                    writer.submit(region, res, prev_ranks)
+                    region_records += len(res.ids_ranked)
+                    continue
+
+                # 3) Build rows and commit the chart together with its checkpoint
+                inserted = commit_chart(
+                    db,
+                    cursor,
+                    insert_sql,
+                    load_table,
+                    previous_table,
+                    region,
+                    res,
+                    now,
+                    failed_inserts,
+                    prev_ranks,
+                    dims,
+                )
+                if inserted is not None:
+                    total_records_inserted += inserted
+                    region_records += inserted
+                    if res.unchanged:
+                        carried_charts.add(
+                            (region, res.category, res.subcategory or "")
+                        )
 
             logger.info(
                 f"Region {region.upper()} completed: {region_charts} charts, {region_metadata} metadata, {region_records} records"
             )
+            try:
+                refresh_snapshot_progress(cursor, load_table)
+                db.commit()
+            except mysql.connector.Error as e:
+                logger.warning(f"Could not update snapshot progress: {e}")
+                db.rollback()
+
+        if writer is not None:
+            logger.info("Waiting for DB writer to drain")
+            writer.close()
+            if lock_waits_before is not None:
+                try:
+                    waits, wait_ms = innodb_row_lock_waits(cursor)
+                    logger.info(
+                        f"InnoDB row lock waits during the writer run: "
+                        f"{waits - lock_waits_before[0]} ({wait_ms - lock_waits_before[1]} ms, server-wide)"
+                    )
+                except mysql.connector.Error as e:
+                    logger.debug(f"Could not read InnoDB lock counters: {e}")
+            total_records_inserted += writer.records_inserted
+            carried_charts |= writer.carried_charts
 
         logger.info("Performing final commit")
         try:
@@ -1311,8 +4023,25 @@ def main():
         logger.info("Checking if rank comparison should be performed")
 
         # Only run rank comparison if table is complete
-        cursor.execute(f"SELECT COUNT(DISTINCT countryCode) FROM {current_table}")
-        completed_regions = cursor.fetchone()[0]
+        try:
+            completed_regions = refresh_snapshot_progress(cursor, load_table)
+            db.commit()
+            if completed_regions == len(REGIONS) and DEFER_SECONDARY_INDEXES:
+                logger.info(
+                    f"Load phase took {datetime.datetime.now() - start_time}, "
+                    f"building deferred indexes"
+                )
+                # Comparison, exits and publish all read through idx_chart_key
+                build_secondary_indexes(cursor, load_table)
+        except mysql.connector.Error as e:
+            logger.error(f"Could not update snapshot catalog or build indexes: {e}")
+            db.rollback()
+            failed_inserts.append(f"Snapshot finalization failed: {e}")
+            completed_regions = 0
+
+        if spool is not None and completed_regions == len(REGIONS):
+            # Everything is committed; the spool has nothing left to replay
+            spool.remove()
 
         if completed_regions == len(REGIONS) and previous_table:
             logger.info("Starting rank comparison phase")
@@ -1320,33 +4049,49 @@ def main():
                 logger.info(
                     f"All regions completed ({completed_regions}/{len(REGIONS)}). Comparing with {previous_table}"
                 )
-                csv_data = bulk_rank_comparison(cursor, previous_table, current_table)
+                csv_data = None
+                csv_written = False
+                create_exits_table(cursor)
+                if RANK_COMPARISON_MODE == "dict":
+                    csv_data, exits = bulk_rank_comparison(
+                        cursor, previous_table, load_table, carried_charts
+                    )
 
-                logger.info("Committing rank updates")
-                db.commit()
-                logger.info("Rank updates committed successfully")
+                    logger.info("Committing rank updates")
+                    db.commit()
+                    logger.info("Rank updates committed successfully")
+
+                    snapshot_id = snapshot_id_for_table(current_table)
+                    clear_chart_exits(cursor, snapshot_id)
+                    insert_chart_exits(db, cursor, snapshot_id, exits)
+                    csv_data.extend(exit_csv_row(row) for row in exits)
+                elif RANK_COMPARISON_MODE == "merge":
+                    # Records exits and writes the CSV itself while it streams
+                    merge_rank_comparison(
+                        db, cursor, previous_table, load_table, carried_charts
+                    )
+                    csv_written = True
+                else:
+                    if RANK_COMPARISON_MODE == "sql":
+                        sql_rank_comparison(db, cursor, previous_table, load_table)
+                    sql_chart_exits(db, cursor, previous_table, load_table)
+
+                if dims is not None and RANK_COMPARISON_MODE != "insert":
+                    # Fact rows were copied before old_rank was known
+                    refreshed = dims.refresh_old_ranks(db, cursor, load_table)
+                    logger.info(f"Refreshed old_rank on {refreshed} fact rows")
 
                 # Write CSV file
-                logger.info(f"Writing {len(csv_data)} records to CSV")
                 try:
-                    with open(CSV_OUTPUT, "w", newline="", encoding="utf-8") as f:
-                        writer = csv.writer(f)
-                        writer.writerow(
-                            [
-                                "appleid",
-                                "title",
-                                "country_code",
-                                "country_name",
-                                "category",
-                                "subcategory",
-                                "current_rank",
-                                "old_rank",
-                                "movement",
-                            ]
-                        )
-                        writer.writerows(csv_data)
-
-                    logger.info(f"Rank comparison CSV saved to {CSV_OUTPUT}")
+                    if csv_data is not None:
+                        logger.info(f"Writing {len(csv_data)} records to CSV")
+                        write_comparison(csv_data, current_table)
+                    elif not csv_written:
+                        # old_rank/movement were stored with each row; just export them
+                        exported = export_rank_comparison(db, load_table)
+                        logger.info(f"Exported {exported} records to CSV")
+
+                    logger.info("Rank comparison output written")
                 except Exception as e:
                     logger.error(f"Failed to write CSV: {e}")
                     failed_inserts.append(f"CSV write failed: {e}")
@@ -1362,6 +4107,27 @@ def main():
             elif not previous_table:
                 logger.info("Skipping rank comparison - no previous table available")
 
+        # Rows, indexes and old_rank/movement are final: make the snapshot visible
+        published = False
+        if completed_regions == len(REGIONS):
+            try:
+                publish_snapshot(cursor, load_table, current_table)
+                db.commit()
+                published = True
+            except mysql.connector.Error as e:
+                logger.error(f"Publishing {load_table} failed: {e}")
+                db.rollback()
+                failed_inserts.append(f"Snapshot publish failed: {e}")
+
+        if WRITE_HISTORY_TABLE and published:
+            try:
+                publish_snapshot_to_history(cursor, current_table)
+                db.commit()
+            except (mysql.connector.Error, ValueError) as e:
+                logger.error(f"Publishing {current_table} to history failed: {e}")
+                db.rollback()
+                failed_inserts.append(f"History publish failed: {e}")
+
         # Save other output files
         try:
             logger.info("Writing output files")
@@ -1402,10 +4168,16 @@ def main():
         logger.info(f"Total Apple IDs collected: {len(all_apple_ids)}")
         logger.info(f"Total chart entries fetched: {total_charts_fetched}")
         logger.info(f"Total metadata lookups: {total_metadata_lookups}")
+        logger.info(f"Known-empty charts skipped: {total_charts_skipped}")
         logger.info(f"Total records inserted: {total_records_inserted}")
         logger.info(f"Failed requests: {len(failed_requests)}")
         logger.info(f"Failed inserts: {len(failed_inserts)}")
         logger.info(f"Missing lookup IDs: {len(missing_ids_set)}")
+        log_rate_limiter_summary()
+        if metadata_cache is not None:
+            logger.info(f"Metadata cache: {metadata_cache.summary()}")
+        if dims is not None:
+            logger.info(f"Normalized schema: {dims.summary()}")
         logger.info(f"Created/used table: {current_table}")
 
         if previous_table:
@@ -1424,15 +4196,6 @@ def main():
             for region, count in sorted(failed_by_region.items()):
                 logger.warning(f"  {region.upper()}: {count} failures")
 
-        # Clean up
-        try:
-            cursor.close()
-            db.close()
-            session.close()
-            logger.info("Cleaned up database and HTTP connections")
-        except Exception as e:
-            logger.warning(f"Cleanup warning: {e}")
-
         logger.info(
             "Enhanced collection with resumption capability completed successfully!"
         )
@@ -1442,6 +4205,17 @@ def main():
         logger.error(f"Fatal error in main execution: {e}", exc_info=True)
         raise
 
+    finally:
+        # Clean up
+        for resource in (cursor, db, session, crawler, metadata_cache):
+            if resource is None:
+                continue
+            try:
+                resource.close()
+            except Exception as e:
+                logger.warning(f"Cleanup warning: {e}")
+        logger.info("Cleaned up database and HTTP connections")
+
 
 if __name__ == "__main__":
     try:
@@ -10,6 +10,7 @@ from typing import Dict, List, Tuple
 from collections import defaultdict
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+from metadata_cache import MetadataCache
 
 # ===============================
 # CONFIG
@@ -28,6 +29,9 @@ RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
 REQUEST_TIMEOUT = (10, 30)  # (connect timeout, read timeout)
 MAX_CONSECUTIVE_FAILURES = 10
 
+# Persistent (country, appleid) -> metadata cache in front of LOOKUP_URL_TPL
+USE_METADATA_CACHE = True
+
 DB_CONFIG = {
     "host": "localhost",
     "user": "root",
@@ -574,9 +578,12 @@ def batched(iterable, n):
 
 
 def lookup_metadata(
-    session, apple_ids: List[int], country: str, missing_ids_set: set
+    session, apple_ids: List[int], country: str, missing_ids_set: set, cache=None
 ) -> Dict[int, dict]:
     out = {}
+    if cache is not None:
+        out = cache.get_many(country, apple_ids)
+        apple_ids = [aid for aid in apple_ids if aid not in out]
     consecutive_failures = 0
     for chunk in batched(apple_ids, 100):
         if consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
@@ -619,6 +626,9 @@ def lookup_metadata(
                 }
                 found_ids.add(int(aid))
 
+            if cache is not None:
+                cache.put_many(country, {aid: out[aid] for aid in found_ids})
+
             for aid in chunk:
                 if aid not in found_ids:
                     missing_ids_set.add((country, aid))
@@ -817,6 +827,7 @@ def main():
     )
 
     session = create_robust_session()
+    metadata_cache = MetadataCache() if USE_METADATA_CACHE else None
 
     open(os.path.join(OUTPUT_DIR, "lookup_missing_ids.txt"), "w").close()
     missing_ids_set = set()
@@ -955,7 +966,9 @@ def main():
 
             # 2) Lookup metadata
             try:
-                meta_map = lookup_metadata(session, ids_ranked, region, missing_ids_set)
+                meta_map = lookup_metadata(
+                    session, ids_ranked, region, missing_ids_set, metadata_cache
+                )
                 print(f"    ✅ Retrieved metadata for {len(meta_map)} podcasts")
             except Exception as e:
                 print(f"    ❌ Metadata lookup error: {e}")
@@ -1096,6 +1109,8 @@ def main():
         cursor.close()
         db.close()
         session.close()
+        if metadata_cache is not None:
+            metadata_cache.close()
         print("✅ Cleaned up connections")
     except Exception as e:
         print(f"⚠️ Cleanup warning: {e}")
@@ -1106,6 +1121,8 @@ def main():
     print(f"  • Failed requests: {len(failed_requests)}")
     print(f"  • Failed inserts: {len(failed_inserts)}")
     print(f"  • Missing lookup IDs: {len(missing_ids_set)}")
+    if metadata_cache is not None:
+        print(f"  • Metadata cache: {metadata_cache.summary()}")
     print(f"  • Created/used table: {current_table}")
     if previous_table:
         print(f"  • Compared with: {previous_table}")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import sqlite3
+import os
+import time
+import random
+import logging
+import threading
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# ===============================
+# CONFIG
+# ===============================
+CACHE_PATH = os.path.join("./documents", "itunes_metadata_cache.sqlite3")
+CACHE_TTL_DAYS = 14  # title/artwork/url rarely change
+CACHE_TTL_JITTER = 0.5  # +/- fraction of the TTL, spreads refreshes across days
+CACHE_MAX_ENTRIES = 3_000_000  # LRU eviction above this many (country, appleid) rows
+CACHE_EVICT_TO = 0.9  # evict down to this fraction of the cap
+SQLITE_MAX_PARAMS = 900  # stay under SQLite's bound-variable limit
+
+
+class MetadataCache:
+    """Persistent SQLite cache of iTunes Lookup metadata keyed by (country, appleid).
+
+    Entries expire after CACHE_TTL_DAYS +/- CACHE_TTL_JITTER so that a cold
+    cache does not expire in one go on the same day. Every hit refreshes
+    last_access, and put_many evicts the least recently used rows once the
+    table grows past max_entries. The table is only counted when an upper
+    bound on its size (every stored row assumed new) passes the cap. Works
+    without network access: a cache-only caller just treats misses as missing.
+    """
+
+    def __init__(
+        self,
+        path=CACHE_PATH,
+        ttl_days=CACHE_TTL_DAYS,
+        jitter=CACHE_TTL_JITTER,
+        max_entries=CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.jitter = jitter
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                country TEXT NOT NULL,
+                appleid INTEGER NOT NULL,
+                title TEXT,
+                artwork TEXT,
+                podcast_url TEXT,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (country, appleid)
+            ) WITHOUT ROWID
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON metadata (last_access)"
+        )
+        self.conn.commit()
+        self.max_rows = self.count()  # upper bound on the rows in the table
+        logger.info(f"Metadata cache opened at {path} ({self.max_rows} entries)")
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+    def _expiry(self, now):
+        return now + self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def get_many(self, country: str, apple_ids: List[int]) -> Dict[int, dict]:
+        """Return fresh cached metadata for the given IDs (expired rows count as misses)."""
+        now = time.time()
+        out = {}
+        ids = list(dict.fromkeys(int(x) for x in apple_ids))
+
+        with self._lock:
+            for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+                chunk = ids[i : i + SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"""
+                    SELECT appleid, title, artwork, podcast_url
+                    FROM metadata
+                    WHERE country = ? AND expires_at > ? AND appleid IN ({placeholders})
+                    """,
+                    [country, now, *chunk],
+                ).fetchall()
+                for aid, title, artwork, podcast_url in rows:
+                    out[aid] = {
+                        "title": title,
+                        "artwork": artwork,
+                        "podcast_url": podcast_url,
+                    }
+
+            if out:
+                self.conn.executemany(
+                    "UPDATE metadata SET last_access = ? WHERE country = ? AND appleid = ?",
+                    [(now, country, aid) for aid in out],
+                )
+                self.conn.commit()
+
+            self.hits += len(out)
+            self.misses += len(ids) - len(out)
+
+        return out
+
+    def put_many(self, country: str, meta_map: Dict[int, dict]):
+        """Store freshly fetched metadata, then enforce the size cap."""
+        if not meta_map:
+            return
+        now = time.time()
+        rows = [
+            (
+                country,
+                int(aid),
+                meta.get("title", ""),
+                meta.get("artwork", ""),
+                meta.get("podcast_url", ""),
+                now,
+                self._expiry(now),
+                now,
+            )
+            for aid, meta in meta_map.items()
+        ]
+
+        with self._lock:
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO metadata
+                (country, appleid, title, artwork, podcast_url, fetched_at, expires_at, last_access)
+                VALUES (?,?,?,?,?,?,?,?)
+                """,
+                rows,
+            )
+            self.conn.commit()
+            self.stores += len(rows)
+            self.max_rows += len(rows)
+            self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        if self.max_rows <= self.max_entries:
+            return
+        total = self.conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        self.max_rows = total
+        if total <= self.max_entries:
+            return
+
+        excess = total - int(self.max_entries * CACHE_EVICT_TO)
+        self.conn.execute(
+            """
+            DELETE FROM metadata
+            WHERE (country, appleid) IN (
+                SELECT country, appleid FROM metadata ORDER BY last_access LIMIT ?
+            )
+            """,
+            (excess,),
+        )
+        self.conn.commit()
+        self.evicted += excess
+        self.max_rows -= excess
+        logger.info(f"Metadata cache evicted {excess} least recently used entries")
+
+    def purge_expired(self) -> int:
+        """Drop expired rows (optional housekeeping; expired rows are never served)."""
+        with self._lock:
+            cur = self.conn.execute(
+                "DELETE FROM metadata WHERE expires_at <= ?", (time.time(),)
+            )
+            self.conn.commit()
+            self.max_rows -= cur.rowcount
+            return cur.rowcount
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate:.1%} hit rate), {self.stores} stored, {self.evicted} evicted"
+        )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Vectorized rank diff between chart snapshots for multi-day analytics.
+
+Snapshots are loaded as typed NumPy arrays (int64 appleid, uint8 country,
+uint16 genre, uint16 rank) and compared with a sort + searchsorted instead
+of bulk_rank_comparison's per-key dict loop.
+
+    python rank_diff_numpy.py diff --last 7 --output documents/rank_diff
+    python rank_diff_numpy.py diff apple_chart_20250824_103954 apple_chart_20250825_103954
+    python rank_diff_numpy.py bench --rows 4800000
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from chart_history import list_snapshot_tables
+from chart_db import compute_movement, connect_db, movement_bucket
+
+logger = logging.getLogger(__name__)
+
+APPLEID_BITS = 39  # composite key: country(8) | genre(16) | appleid(39)
+FETCH_ROWS = 100000
+
+NEW, UP, DOWN, SAME = 0, 1, 2, 3
+MOVEMENT_NAMES = ("new", "up", "down", "same")
+
+
+class KeyEncoder:
+    """Stable small-int codes for countries and (category, subcategory) pairs across snapshots"""
+
+    def __init__(self):
+        self.countries = {}
+        self.genres = {}
+
+    def country(self, code):
+        return self.countries.setdefault(code, len(self.countries))
+
+    def genre(self, category, subcategory):
+        return self.genres.setdefault((category, subcategory), len(self.genres))
+
+
+def composite_keys(country, genre, appleid):
+    if appleid.size and appleid.max() >= 1 << APPLEID_BITS:
+        raise ValueError("appleid does not fit the composite key")
+    return (
+        (country.astype(np.int64) << (APPLEID_BITS + 16))
+        | (genre.astype(np.int64) << APPLEID_BITS)
+        | appleid
+    )
+
+
+def load_snapshot(db, table, encoder):
+    """Read one snapshot table into typed arrays (streamed in FETCH_ROWS batches)"""
+    cursor = db.cursor()
+    cursor.execute(f"""
+        SELECT appleid, countryCode, category, COALESCE(subcategory, ''), chart_rank
+        FROM {table}
+        WHERE appleid IS NOT NULL AND chart_rank IS NOT NULL
+    """)
+    parts = []
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        parts.append(
+            (
+                np.fromiter((r[0] for r in rows), np.int64, len(rows)),
+                np.fromiter((encoder.country(r[1]) for r in rows), np.uint8, len(rows)),
+                np.fromiter(
+                    (encoder.genre(r[2], r[3]) for r in rows), np.uint16, len(rows)
+                ),
+                np.fromiter((r[4] for r in rows), np.uint16, len(rows)),
+            )
+        )
+    cursor.close()
+
+    if not parts:
+        empty = np.empty(0, np.int64)
+        return {
+            "appleid": empty,
+            "country": np.empty(0, np.uint8),
+            "genre": np.empty(0, np.uint16),
+            "rank": np.empty(0, np.uint16),
+            "key": empty,
+        }
+    appleid, country, genre, rank = (np.concatenate(cols) for cols in zip(*parts))
+    logger.info(f"Loaded {len(appleid)} rows from {table}")
+    return {
+        "appleid": appleid,
+        "country": country,
+        "genre": genre,
+        "rank": rank,
+        "key": composite_keys(country, genre, appleid),
+    }
+
+
+def rank_diff(old, new):
+    """Return (old_rank, movement_code, counts) for every row of new.
+
+    old_rank is 0 where the key is absent from old (movement NEW). Duplicate
+    keys in old resolve to the last one after sorting, as dict insertion did.
+    """
+    order = np.argsort(old["key"], kind="stable")
+    old_keys = old["key"][order]
+    old_ranks = old["rank"][order]
+
+    pos = np.searchsorted(old_keys, new["key"], side="right") - 1
+    found = pos >= 0
+    found[found] = old_keys[pos[found]] == new["key"][found]
+
+    old_rank = np.zeros(len(new["key"]), np.uint16)
+    old_rank[found] = old_ranks[pos[found]]
+
+    diff = old_rank.astype(np.int32) - new["rank"].astype(np.int32)
+    code = np.full(len(diff), SAME, np.uint8)
+    code[diff > 0] = UP
+    code[diff < 0] = DOWN
+    code[~found] = NEW
+
+    counts = dict(zip(MOVEMENT_NAMES, np.bincount(code, minlength=4).tolist()))
+    return old_rank, code, counts
+
+
+def movement_strings(old_rank, new_rank, code):
+    """Materialize the stored movement column ('NEW', '+n', '-n', '0')"""
+    diff = old_rank.astype(np.int32) - new_rank.astype(np.int32)
+    diff[code == NEW] = np.iinfo(np.int32).min  # sentinel, never a real diff
+    # Only a few hundred distinct diffs exist: format each once, then gather
+    values, inverse = np.unique(diff, return_inverse=True)
+    labels = np.array(
+        [
+            "NEW" if v == np.iinfo(np.int32).min else f"+{v}" if v > 0 else str(v)
+            for v in values.tolist()
+        ],
+        dtype=object,
+    )
+    return labels[inverse]
+
+
+def save_diff(path, snapshot, old_rank, code, encoder):
+    """Write one diff as .npz: per-row keys, ranks and movement plus the code tables
+
+    country/genre index country_codes/genres; old_rank 0 means NEW, and
+    movement holds NEW/UP/DOWN/SAME codes (see MOVEMENT_NAMES).
+    """
+    np.savez_compressed(
+        path,
+        appleid=snapshot["appleid"],
+        country=snapshot["country"],
+        genre=snapshot["genre"],
+        chart_rank=snapshot["rank"],
+        old_rank=old_rank,
+        movement=code,
+        country_codes=np.array(list(encoder.countries), dtype=str),
+        genres=np.array(list(encoder.genres), dtype=str).reshape(-1, 2),
+    )
+
+
+def diff_tables(tables, output_dir=None):
+    """Diff each consecutive pair of snapshot tables, loading every table once
+
+    Returns {(old_table, new_table): (old_rank, movement_code, counts)}; with
+    output_dir every diff is also saved as <new_table>.npz (see save_diff).
+    """
+    db, cursor = connect_db()
+    cursor.close()
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    encoder = KeyEncoder()
+    previous = None
+    diffs = {}
+    try:
+        for table in tables:
+            current = load_snapshot(db, table, encoder)
+            if previous is not None:
+                start = time.perf_counter()
+                old_rank, code, counts = rank_diff(previous[1], current)
+                logger.info(
+                    f"{previous[0]} -> {table}: NEW={counts['new']}, UP={counts['up']}, "
+                    f"DOWN={counts['down']}, SAME={counts['same']} "
+                    f"({time.perf_counter() - start:.2f}s)"
+                )
+                diffs[(previous[0], table)] = (old_rank, code, counts)
+                if output_dir:
+                    path = os.path.join(output_dir, f"{table}.npz")
+                    save_diff(path, current, old_rank, code, encoder)
+                    logger.info(f"Saved {path}")
+            previous = (table, current)
+    finally:
+        db.close()
+    return diffs
+
+
+# ===============================
+# BENCHMARK
+# ===============================
+def synthetic_snapshots(rows, churn=0.1, seed=1):
+    """Two snapshots of the same shape; churn fraction of entries are replaced"""
+    rng = np.random.default_rng(seed)
+    chart_size = 250
+    charts = rows // chart_size
+    country = np.repeat(rng.integers(0, 175, charts).astype(np.uint8), chart_size)
+    genre = np.repeat(np.arange(charts, dtype=np.uint16) % 120, chart_size)
+    rank = np.tile(np.arange(1, chart_size + 1, dtype=np.uint16), charts)
+
+    old_ids = rng.integers(10**8, 2 * 10**9, charts * chart_size, dtype=np.int64)
+    new_ids = old_ids.copy()
+    replaced = rng.random(len(new_ids)) < churn
+    new_ids[replaced] = rng.integers(10**8, 2 * 10**9, replaced.sum())
+    for start in range(0, len(new_ids), chart_size):  # reshuffle each chart's order
+        rng.shuffle(new_ids[start : start + chart_size])
+
+    def snapshot(ids):
+        return {
+            "appleid": ids,
+            "country": country,
+            "genre": genre,
+            "rank": rank,
+            "key": composite_keys(country, genre, ids),
+        }
+
+    return snapshot(old_ids), snapshot(new_ids)
+
+
+def dict_rank_diff(old, new):
+    """bulk_rank_comparison's algorithm: dict of every old row, per-key Python loop"""
+    old_data = {
+        (int(a), int(c), int(g)): {"rank": int(r)}
+        for a, c, g, r in zip(old["appleid"], old["country"], old["genre"], old["rank"])
+    }
+    stats = {"new": 0, "up": 0, "down": 0, "same": 0}
+    movements = []
+    for a, c, g, r in zip(new["appleid"], new["country"], new["genre"], new["rank"]):
+        old_info = old_data.get((int(a), int(c), int(g)))
+        old_rank = old_info["rank"] if old_info is not None else None
+        movement = compute_movement(old_rank, int(r))
+        stats[movement_bucket(movement)] += 1
+        movements.append(movement)
+    return movements, stats
+
+
+def bench(rows):
+    old, new = synthetic_snapshots(rows)
+    print(f"{len(new['key'])} rows per snapshot")
+
+    start = time.perf_counter()
+    old_rank, code, counts = rank_diff(old, new)
+    diff_time = time.perf_counter() - start
+    movements = movement_strings(old_rank, new["rank"], code)
+    numpy_time = time.perf_counter() - start
+    print(f"numpy  {numpy_time:8.2f}s  {counts} (diff {diff_time:.2f}s)")
+
+    start = time.perf_counter()
+    dict_movements, stats = dict_rank_diff(old, new)
+    dict_time = time.perf_counter() - start
+    print(f"dict   {dict_time:8.2f}s  {stats}")
+
+    assert counts == stats and list(movements) == dict_movements
+    print(f"speedup {dict_time / numpy_time:.1f}x, results identical")
+
+
+# ===============================
+# MAIN
+# ===============================
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized chart rank diffs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_diff = sub.add_parser("diff", help="diff consecutive snapshot tables")
+    p_diff.add_argument("tables", nargs="*")
+    p_diff.add_argument("--last", type=int, help="use the newest N snapshot tables")
+    p_diff.add_argument("--output", help="directory for one .npz per diff")
+
+    p_bench = sub.add_parser("bench", help="numpy vs dict on synthetic snapshots")
+    p_bench.add_argument("--rows", type=int, default=4_800_000)
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        bench(args.rows)
+        return
+
+    tables = args.tables
+    if args.last:
+        db, cursor = connect_db()
+        tables = list_snapshot_tables(cursor)[-args.last :]
+        cursor.close()
+        db.close()
+    if len(tables) < 2:
+        parser.error("need at least two snapshot tables")
+    diff_tables(tables, args.output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s | %(levelname)-8s | %(message)s"
+    )
+    main()
@@ -429,22 +429,41 @@ def create_new_table(cursor, table_name):
             subcategory varchar(255) DEFAULT NULL,
             createdTime datetime DEFAULT NULL,
             updatedTime datetime DEFAULT NULL,
-            PRIMARY KEY (id)
+            subcategory_key varchar(255) AS (COALESCE(subcategory, '')) STORED NOT NULL,
+            PRIMARY KEY (id),
+            INDEX idx_chart_key (countryCode, category, subcategory_key, appleid, chart_rank)
         ) ENGINE=InnoDB
     """)
 
 
+def ensure_subcategory_key(cursor, table):
+    """Add the generated subcategory_key column and its index to an older chart table"""
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+          AND COLUMN_NAME = 'subcategory_key'
+    """,
+        (table,),
+    )
+    if cursor.fetchone()[0]:
+        return
+    cursor.execute(f"""
+        ALTER TABLE {table}
+        ADD COLUMN subcategory_key varchar(255) AS (COALESCE(subcategory, '')) STORED NOT NULL,
+        ADD INDEX idx_chart_key (countryCode, category, subcategory_key, appleid, chart_rank)
+    """)
+
+
 def compare_ranks(cursor, last_table, current_table, region, category, subcategory):
     if not last_table:
         cursor.execute(
             f"""
             SELECT appleid, chart_rank, title, countryCode, countryName
             FROM {current_table}
-            WHERE countryCode=%s AND category=%s AND (
-                (subcategory IS NULL AND %s IS NULL) OR subcategory=%s
-            )
+            WHERE countryCode=%s AND category=%s AND subcategory_key=%s
         """,
-            (region, category, subcategory, subcategory),
+            (region, category, subcategory or ""),
         )
         new_data = {
             row[0]: (row[1], row[2], row[3], row[4]) for row in cursor.fetchall()
@@ -458,11 +477,9 @@ def compare_ranks(cursor, last_table, current_table, region, category, subcatego
         f"""
         SELECT appleid, chart_rank, title
         FROM {last_table}
-        WHERE countryCode=%s AND category=%s AND (
-            (subcategory IS NULL AND %s IS NULL) OR subcategory=%s
-        )
+        WHERE countryCode=%s AND category=%s AND subcategory_key=%s
     """,
-        (region, category, subcategory, subcategory),
+        (region, category, subcategory or ""),
     )
     old_data = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
 
@@ -470,11 +487,9 @@ def compare_ranks(cursor, last_table, current_table, region, category, subcatego
         f"""
         SELECT appleid, chart_rank, title, countryCode, countryName
         FROM {current_table}
-        WHERE countryCode=%s AND category=%s AND (
-            (subcategory IS NULL AND %s IS NULL) OR subcategory=%s
-        )
+        WHERE countryCode=%s AND category=%s AND subcategory_key=%s
     """,
-        (region, category, subcategory, subcategory),
+        (region, category, subcategory or ""),
     )
     new_data = {row[0]: (row[1], row[2], row[3], row[4]) for row in cursor.fetchall()}
 
@@ -515,6 +530,8 @@ last_table = get_last_table_name(cursor)
 now = datetime.datetime.now()
 current_table = f"apple_rss_{now.strftime('%Y%m%d_%H%M%S')}"
 create_new_table(cursor, current_table)
+if last_table:
+    ensure_subcategory_key(cursor, last_table)
 
 print(f"📊 Created new table: {current_table}")
 if last_table:
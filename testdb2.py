@@ -48,6 +48,25 @@ def collect_genre_info(genre_dict, parent_name=None, depth=0):
     return ids
 
 
+def ensure_subcategory_key(cursor, table):
+    """Add the generated subcategory_key column and its index to an older chart table"""
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+          AND COLUMN_NAME = 'subcategory_key'
+    """,
+        (table,),
+    )
+    if cursor.fetchone()[0]:
+        return
+    cursor.execute(f"""
+        ALTER TABLE {table}
+        ADD COLUMN subcategory_key varchar(255) AS (COALESCE(subcategory, '')) STORED NOT NULL,
+        ADD INDEX idx_chart_key (countryCode, category, subcategory_key, appleid, chart_rank)
+    """)
+
+
 def compare_ranks(db_cursor, region, category, subcategory):
     """Compare today's vs yesterday's ranks for a given genre & return changes."""
     # Fetch yesterday's ranks
@@ -55,11 +74,9 @@ def compare_ranks(db_cursor, region, category, subcategory):
         """
         SELECT appleid, chart_rank, title
         FROM unique_apple_chart_old
-        WHERE countryCode=%s AND category=%s AND (
-            (subcategory IS NULL AND %s IS NULL) OR subcategory=%s
-        )
+        WHERE countryCode=%s AND category=%s AND subcategory_key=%s
     """,
-        (region, category, subcategory, subcategory),
+        (region, category, subcategory or ""),
     )
     old_data = {
         row[0]: (row[1], row[2]) for row in db_cursor.fetchall()
@@ -70,11 +87,9 @@ def compare_ranks(db_cursor, region, category, subcategory):
         """
         SELECT appleid, chart_rank, title
         FROM unique_apple_chart
-        WHERE countryCode=%s AND category=%s AND (
-            (subcategory IS NULL AND %s IS NULL) OR subcategory=%s
-        )
+        WHERE countryCode=%s AND category=%s AND subcategory_key=%s
     """,
-        (region, category, subcategory, subcategory),
+        (region, category, subcategory or ""),
     )
     new_data = {
         row[0]: (row[1], row[2]) for row in db_cursor.fetchall()
@@ -118,9 +133,18 @@ REGIONS = ["us"]
 db = mysql.connector.connect(**DB_CONFIG)
 cursor = db.cursor()
 
+for table in ("unique_apple_chart", "unique_apple_chart_old"):
+    ensure_subcategory_key(cursor, table)
+
 print("♻️ Moving current snapshot to old table...")
 cursor.execute("TRUNCATE TABLE unique_apple_chart_old")
-cursor.execute("INSERT INTO unique_apple_chart_old SELECT * FROM unique_apple_chart")
+# Explicit columns: the generated subcategory_key cannot be copied
+cursor.execute("""
+INSERT INTO unique_apple_chart_old
+(chart_rank, podcast_url, appleid, title, img_url, countryCode, countryName, category, subcategory, createdTime, updatedTime)
+SELECT chart_rank, podcast_url, appleid, title, img_url, countryCode, countryName, category, subcategory, createdTime, updatedTime
+FROM unique_apple_chart
+""")
 cursor.execute("TRUNCATE TABLE unique_apple_chart")
 db.commit()
 
@@ -6,6 +6,7 @@ import datetime
 import os
 import csv
 from collections import defaultdict
+from chart_db import bisect_insert, is_row_error
 
 # ===============================
 # CONFIG
@@ -281,7 +282,7 @@ def bulk_rank_comparison(cursor, last_table, current_table):
 
 
 # OPTIMIZED: Batch insert with executemany
-def batch_insert_podcasts(cursor, insert_sql, batch_data):
+def batch_insert_podcasts(cursor, insert_sql, batch_data, failed_inserts):
     """Insert podcast data in batches for better performance"""
     chunk_size = 500
     total_inserted = 0
@@ -296,14 +297,11 @@ def batch_insert_podcasts(cursor, insert_sql, batch_data):
                 print(f"  ✅ Inserted {total_inserted} records...")
 
         except mysql.connector.Error as err:
-            # Handle individual failures if needed
-            print(f"  ⚠️ Batch insert failed: {err}")
-            for single_record in chunk:
-                try:
-                    cursor.execute(insert_sql, single_record)
-                    total_inserted += 1
-                except mysql.connector.Error as single_err:
-                    failed_inserts.append(f"Individual insert failed: {single_err}")
+            if not is_row_error(err):
+                raise
+            # Split the chunk until the bad rows are isolated
+            print(f"  ⚠️ Batch insert failed, bisecting {len(chunk)} rows: {err}")
+            total_inserted += bisect_insert(cursor, insert_sql, chunk, failed_inserts)
 
     return total_inserted
 
@@ -433,7 +431,7 @@ for region in REGIONS:
         print(
             f"  💾 Batch inserting {len(batch_insert_data)} records for {region.upper()}..."
         )
-        batch_insert_podcasts(cursor, insert_sql, batch_insert_data)
+        batch_insert_podcasts(cursor, insert_sql, batch_insert_data, failed_inserts)
         batch_insert_data = []  # Clear for next region
         db.commit()  # Commit per region
 